@@ -0,0 +1,352 @@
+"""Event-driven insight alerts.
+
+Instead of rescanning the whole fleet when a user runs insights, each
+device toggle (POST /events/device) re-checks only the rules for that
+device's type (rules.RULES: light > 8h, AC > 6h, night-time plug load,
+flexible plug). A rule that can't hold yet is put on a timer for the
+moment it would: `since + min_hours`, or the next start of its hour
+window. A single asyncio task sleeps until the earliest timer. The cost
+per event is constant, and an alert fires once the threshold is crossed
+even if nothing else happens.
+
+Each alert fires once per episode: per on-run for duration rules, per
+night for windowed rules, and once per device for flag rules. Alerts and
+the last known device state live in SQLite, so timers are rebuilt after a
+restart. The PHP app pulls undelivered alerts into its insights table
+and acknowledges them.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .metrics import registry
+from .rules import RULES, Rule
+from .shared import MULTI_WORKER, connect
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alert_devices (
+  device_id INTEGER PRIMARY KEY,
+  user_id INTEGER NULL,
+  home_id INTEGER NOT NULL,
+  name TEXT NOT NULL,
+  type TEXT NOT NULL,
+  is_on INTEGER NOT NULL,
+  power_w REAL NOT NULL,
+  since REAL NOT NULL,
+  flags TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS alerts (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  user_id INTEGER NULL,
+  home_id INTEGER NOT NULL,
+  device_id INTEGER NOT NULL,
+  rule INTEGER NOT NULL,
+  episode REAL NOT NULL,
+  severity TEXT NOT NULL,
+  title TEXT NOT NULL,
+  detail TEXT NOT NULL,
+  ts REAL NOT NULL,
+  delivered INTEGER NOT NULL DEFAULT 0,
+  UNIQUE (device_id, rule, episode)
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_user ON alerts(user_id, delivered, id);
+"""
+
+log = logging.getLogger(__name__)
+
+registry.describe("voltspace_alerts_total", "counter", "Real-time insight alerts fired, by device type and severity")
+
+Timer = Tuple[float, int, int, int, float]   # due, seq, device_id, rule index, device `since` when scheduled
+Fired = List[Tuple[int, Dict[str, Any]]]     # (rule index, alert) written in the current transaction
+Armed = List[Tuple[float, Dict[str, Any], int]]   # (due, device, rule index) to schedule once it commits
+
+
+def window_start(ts: float, window: Tuple[int, int]) -> Optional[float]:
+    """Start of the local-hour window containing ts, or None if ts is outside it."""
+    dt = datetime.fromtimestamp(ts)
+    if not window[0] <= dt.hour <= window[1]:
+        return None
+    return dt.replace(hour=window[0], minute=0, second=0, microsecond=0).timestamp()
+
+
+def next_window(ts: float, window: Tuple[int, int]) -> float:
+    """Earliest time >= ts inside the (inclusive, same-day) local-hour window."""
+    if window_start(ts, window) is not None:
+        return ts
+    dt = datetime.fromtimestamp(ts)
+    start = dt.replace(hour=window[0], minute=0, second=0, microsecond=0)
+    if start <= dt:
+        start += timedelta(days=1)
+    return start.timestamp()
+
+
+class AlertEngine:
+    def __init__(self, db_path: Path | str, rules: Sequence[Rule] = RULES):
+        if isinstance(db_path, Path):
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = connect(db_path)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self.rules = tuple(rules)
+        self._by_type: Dict[str, List[int]] = {}
+        for k, r in enumerate(self.rules):
+            self._by_type.setdefault(r.type, []).append(k)
+        self._devices: Dict[int, Dict[str, Any]] = {}
+        self._timers: List[Timer] = []
+        self._seq = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # -- lifecycle -------------------------------------------------------------
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        now = time.time()
+        fired: Fired = []
+        armed: Armed = []
+        with self._lock:
+            for dev in self._read_devices():
+                self._devices[dev["device_id"]] = dev
+            # Re-arm whatever was pending when the service stopped (crossings meanwhile fire now)
+            with self._db:
+                cur = self._db.cursor()
+                for dev in self._devices.values():
+                    for k in self._by_type.get(dev["type"], ()):
+                        self._check(cur, dev, k, now, fired, armed)
+            self._committed(fired, armed)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # -- events ----------------------------------------------------------------
+    def device_event(
+        self,
+        device_id: int,
+        home_id: int,
+        user_id: Optional[int],
+        on: bool,
+        power_w: float,
+        ts: Optional[float] = None,
+        name: Optional[str] = None,
+        type: Optional[str] = None,
+        state: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Apply one state change and re-check that device's rules; returns alerts fired right away."""
+        now = time.time()
+        ts = now if ts is None else ts
+        fired: Fired = []
+        armed: Armed = []
+        with self._lock:
+            # One transaction per event: device row, alerts and (after commit) timers and memory all or nothing
+            with self._db:
+                cur = self._db.cursor()
+                cur.execute("BEGIN IMMEDIATE")
+                dev = self._event(cur, device_id, home_id, user_id, on, power_w, ts, name, type, state)
+                for k in self._by_type.get(dev["type"], ()):
+                    self._check(cur, dev, k, now, fired, armed)
+            self._devices[device_id] = dev
+            self._committed(fired, armed)
+        return [alert for _, alert in fired]
+
+    def _event(
+        self,
+        cur: sqlite3.Cursor,
+        device_id: int,
+        home_id: int,
+        user_id: Optional[int],
+        on: bool,
+        power_w: float,
+        ts: float,
+        name: Optional[str],
+        type: Optional[str],
+        state: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        prev = self._device(device_id, cur) or {}
+        flag_names = {r.flag for r in self.rules if r.flag}
+        dev = {
+            "device_id": device_id,
+            "user_id": user_id if user_id is not None else prev.get("user_id"),
+            "home_id": home_id,
+            "name": name or prev.get("name") or f"device {device_id}",
+            "type": (type or prev.get("type") or "").lower(),
+            "on": bool(on),
+            "power_w": float(power_w),
+            "since": ts if bool(on) != prev.get("on") or "since" not in prev else prev["since"],
+            "flags": {f: bool(state.get(f)) for f in flag_names} if state is not None else prev.get("flags", {}),
+        }
+        cur.execute(
+            "INSERT OR REPLACE INTO alert_devices(device_id, user_id, home_id, name, type, is_on, power_w, since, flags) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (device_id, dev["user_id"], home_id, dev["name"], dev["type"], int(dev["on"]), dev["power_w"], dev["since"], json.dumps(dev["flags"])),
+        )
+        return dev
+
+    def fire_due(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Run every timer that is due; stale timers (device toggled since) are dropped."""
+        now = time.time() if now is None else now
+        fired: Fired = []
+        armed: Armed = []
+        with self._lock:
+            if not (self._timers and self._timers[0][0] <= now):
+                return []
+            popped: List[Timer] = []
+            try:
+                with self._db:
+                    cur = self._db.cursor()
+                    while self._timers and self._timers[0][0] <= now:
+                        popped.append(heapq.heappop(self._timers))
+                        _, _, did, k, since = popped[-1]
+                        dev = self._device(did, cur)
+                        if dev is None or dev["since"] != since:
+                            continue
+                        self._check(cur, dev, k, now, fired, armed)
+            except Exception:
+                for t in popped:   # rolled back: keep them for the next pass
+                    heapq.heappush(self._timers, t)
+                raise
+            self._committed(fired, armed)
+        return [alert for _, alert in fired]
+
+    def _device(self, device_id: int, cur: Optional[sqlite3.Cursor] = None) -> Optional[Dict[str, Any]]:
+        """Last known state; re-read from SQLite when other workers may have changed it."""
+        if MULTI_WORKER:
+            rows = self._read_devices(device_id, cur)
+            if rows:
+                self._devices[device_id] = rows[0]
+            return rows[0] if rows else None
+        return self._devices.get(device_id)
+
+    def _read_devices(self, device_id: Optional[int] = None, cur: Optional[sqlite3.Cursor] = None) -> List[Dict[str, Any]]:
+        q = "SELECT device_id, user_id, home_id, name, type, is_on, power_w, since, flags FROM alert_devices"
+        db = cur or self._db
+        rows = db.execute(q + " WHERE device_id=?", (device_id,)) if device_id is not None else db.execute(q)
+        return [
+            {
+                "device_id": did, "user_id": uid, "home_id": hid, "name": name, "type": typ,
+                "on": bool(is_on), "power_w": pw, "since": since, "flags": json.loads(flags or "{}"),
+            }
+            for did, uid, hid, name, typ, is_on, pw, since, flags in rows.fetchall()
+        ]
+
+    # -- rule checks -----------------------------------------------------------
+    def _check(self, cur: sqlite3.Cursor, dev: Dict[str, Any], k: int, now: float, fired: Fired, armed: Armed) -> None:
+        """Fire rule k for dev if it holds at `now`, else arm a timer for when it will.
+
+        Writes go through the caller's cursor; new alerts and timers are collected in
+        `fired` / `armed` and only take effect via _committed once the transaction commits.
+        """
+        r = self.rules[k]
+        if r.requires_on and not dev["on"]:
+            return
+        if r.flag is not None and not dev["flags"].get(r.flag):
+            return
+        if r.min_power_w is not None and not dev["power_w"] > r.min_power_w:
+            return
+
+        due = now
+        if r.min_hours is not None:
+            due = max(due, dev["since"] + r.min_hours * 3600.0 + 1.0)   # strictly greater than
+        if r.hours_of_day is not None:
+            due = next_window(due, r.hours_of_day)
+        if due > now:
+            armed.append((due, dev, k))
+            return
+
+        episode = dev["since"] if r.requires_on else 0.0
+        if r.hours_of_day is not None:
+            episode = window_start(now, r.hours_of_day) or now
+            # Still on tomorrow night → alert again then
+            armed.append((next_window(episode + 86400.0, r.hours_of_day), dev, k))
+        alert = self._emit(cur, dev, k, episode, now)
+        if alert is not None:
+            fired.append((k, alert))
+
+    def _committed(self, fired: Fired, armed: Armed) -> None:
+        for due, dev, k in armed:
+            self._arm(due, dev, k)
+        for k, _ in fired:
+            r = self.rules[k]
+            registry.inc("voltspace_alerts_total", type=r.type, severity=r.severity)
+
+    def _arm(self, due: float, dev: Dict[str, Any], k: int) -> None:
+        self._seq += 1
+        heapq.heappush(self._timers, (due, self._seq, dev["device_id"], k, dev["since"]))
+        if self._loop is not None and self._wake is not None and self._timers[0][0] == due:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _emit(self, cur: sqlite3.Cursor, dev: Dict[str, Any], k: int, episode: float, now: float) -> Optional[Dict[str, Any]]:
+        r = self.rules[k]
+        fields = {
+            "name": dev["name"],
+            "hrs": int(max(0.0, now - dev["since"]) / 3600.0),
+            "power_w": int(dev["power_w"]),
+        }
+        alert = {
+            "user_id": dev["user_id"], "home_id": dev["home_id"], "device_id": dev["device_id"],
+            "severity": r.severity, "title": r.title.format(**fields), "detail": r.detail.format(**fields), "ts": now,
+        }
+        cur.execute(
+            """INSERT OR IGNORE INTO alerts(user_id, home_id, device_id, rule, episode, severity, title, detail, ts)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (dev["user_id"], dev["home_id"], dev["device_id"], k, episode, alert["severity"], alert["title"], alert["detail"], now),
+        )
+        if not cur.rowcount:
+            return None   # already fired for this episode
+        alert["id"] = cur.lastrowid
+        return alert
+
+    async def _run(self) -> None:
+        assert self._wake is not None
+        while True:
+            self._wake.clear()
+            with self._lock:
+                delay = self._timers[0][0] - time.time() if self._timers else None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            # SQLite (and, with several workers, its busy timeout) stays off the event loop
+            try:
+                await asyncio.to_thread(self.fire_due)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("alert timers failed; retrying")
+                await asyncio.sleep(1.0)   # rolled-back timers are due again right away
+
+    # -- reads -----------------------------------------------------------------
+    def for_user(self, user_id: int, after: int = 0, undelivered: bool = False, limit: int = 50) -> List[Dict[str, Any]]:
+        q = "SELECT id, home_id, device_id, severity, title, detail, ts, delivered FROM alerts WHERE user_id=? AND id>?"
+        if undelivered:
+            q += " AND delivered=0"
+        q += " ORDER BY id LIMIT ?"
+        with self._lock:
+            rows = self._db.execute(q, (user_id, after, limit)).fetchall()
+        return [
+            {"id": i, "home_id": h, "device_id": d, "severity": s, "title": t, "detail": dt, "ts": ts, "delivered": bool(dl)}
+            for i, h, d, s, t, dt, ts, dl in rows
+        ]
+
+    def ack(self, user_id: int, ids: List[int]) -> int:
+        if not ids:
+            return 0
+        marks = ",".join("?" * len(ids))
+        with self._lock, self._db:
+            cur = self._db.execute(f"UPDATE alerts SET delivered=1 WHERE user_id=? AND id IN ({marks})", (user_id, *ids))
+            return cur.rowcount
+
+    def pending_timers(self) -> int:
+        with self._lock:
+            return len(self._timers)
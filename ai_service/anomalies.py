@@ -0,0 +1,334 @@
+"""Anomaly detection over device toggle history.
+
+Every device gets a fixed-size row in three memory-mapped files under
+data/series/:
+
+- devices.bin: id, home, type, name, whether it is on now and since when,
+  last applied log_id, and the number of completed runs;
+- runs.bin: a ring buffer of the device's last ANOMALY_HISTORY runs
+  (start, seconds on);
+- days.bin: runs started per (UTC) day over the last DAYS days, so
+  devices that cycle many times a day still have weeks of rate history;
+- hours.bin: on-seconds per local hour of day, decayed with a half-life
+  of ANOMALY_HALF_LIFE_DAYS.
+
+Each toggle (POST /events/device) touches only its device's row: turning
+on records `since`, and turning off appends the run and adds its seconds to
+the hour profile. backfill() replays a home's device_logs once, as for the
+energy ledger. The files are the store, so nothing is loaded at startup and
+every worker process sees the same rows.
+
+detect() evaluates every device in one pass over the arrays:
+
+- long_run: on for much longer than its typical run. The baseline is the
+  median and MAD of log run lengths, per device, or per device type while
+  the device has few runs of its own.
+- cycling: far more runs in the last 24 hours than on its usual day
+  (e.g. a fridge short-cycling).
+- odd_hour: on at a local hour when the device, and its type, is hardly
+  ever on (e.g. a TV at 04:00).
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .metrics import registry
+from .shared import MULTI_WORKER, file_lock
+
+DEVICE = np.dtype([
+    ("device_id", "<i8"),          # 0 = free row
+    ("home_id", "<i8"),
+    ("type", "S16"),
+    ("name", "S48"),
+    ("is_on", "u1"),
+    ("since", "<f8"),
+    ("last_log", "<i8"),
+    ("runs", "<i8"),               # completed runs ever; ring slot of the next one is runs % history
+    ("profile_at", "<f8"),         # time the hour profile was last decayed to
+    ("first_day", "<i4"),          # day number (UTC) of the first run
+    ("day", "<i4"),                # latest day number counted in days.bin
+])
+RUN = np.dtype([("start", "<f8"), ("secs", "<f4")])
+DAYS = 28
+CHUNK = 1024                       # initial rows; the files double when full
+
+MIN_RUNS = 8                       # runs before a device (or type) baseline is trusted
+MIN_MAD = 0.25                     # floor on the log-duration spread, so very regular devices don't flag on noise
+Z_LONG = 3.5
+MIN_LONG_S = 1800                  # runs shorter than this are never "long"
+CYCLE_RATIO = 2.0
+Z_CYCLE = 3.0
+MIN_CYCLE_DAYS = 2.0               # history needed before the last 24h is compared with it
+ODD_SHARE = 0.02                   # share of a device's on-time at this hour below which it counts as unusual
+ODD_TYPE_SHARE = 0.05
+MIN_PROFILE_H = 10.0
+
+registry.describe("voltspace_anomalies_total", "counter", "Anomalies returned by /anomalies, by kind")
+
+
+def _local_hours(start: float, end: float) -> Iterator[Tuple[int, float]]:
+    """(local hour of day, seconds) pieces of [start, end)."""
+    t = start
+    while t < end:
+        dt = datetime.fromtimestamp(t)
+        nxt = min(end, (dt.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)).timestamp())
+        yield dt.hour, nxt - t
+        t = nxt
+
+
+def _median(values: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Per-row median of the first counts[i] finite values of each row (NaN for empty rows).
+
+    values must hold +inf in unused slots, so they sort last.
+    """
+    s = np.sort(values, axis=1)
+    c = np.maximum(counts, 1)[:, None]
+    mid = (np.take_along_axis(s, (c - 1) // 2, axis=1) + np.take_along_axis(s, c // 2, axis=1))[:, 0] / 2
+    return np.where(counts > 0, mid, np.nan)
+
+
+class DeviceSeries:
+    def __init__(self, directory: Path, history: int = 128, half_life_days: float = 14.0):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.dir = directory
+        meta = directory / "meta.json"
+        if meta.exists():
+            history = int(json.loads(meta.read_text(encoding="utf-8"))["history"])   # files are laid out for it
+        else:
+            meta.write_text(json.dumps({"history": history}), encoding="utf-8")
+        self.history = history
+        self.half_life_s = half_life_days * 86400.0
+        self._lock = threading.Lock()
+        self._rows = 0
+        self._index: Dict[int, int] = {}
+        self._open()
+
+    # -- storage ---------------------------------------------------------------
+    def _open(self, rows: int = 0) -> None:
+        """Map the files, growing them to at least `rows` rows."""
+        path = self.dir / "devices.bin"
+        have = path.stat().st_size // DEVICE.itemsize if path.exists() else 0
+        rows = max(rows, have, CHUNK)
+        files = (("devices.bin", DEVICE.itemsize), ("runs.bin", RUN.itemsize * self.history), ("days.bin", 4 * DAYS), ("hours.bin", 4 * 24))
+        for name, width in files:
+            p = self.dir / name
+            with open(p, "ab") as f:
+                if f.tell() < rows * width:
+                    f.truncate(rows * width)   # sparse; untouched rows cost no disk
+        self._dev = np.memmap(self.dir / "devices.bin", dtype=DEVICE, mode="r+", shape=(rows,))
+        self._runs = np.memmap(self.dir / "runs.bin", dtype=RUN, mode="r+", shape=(rows, self.history))
+        self._days = np.memmap(self.dir / "days.bin", dtype="<i4", mode="r+", shape=(rows, DAYS))
+        self._hours = np.memmap(self.dir / "hours.bin", dtype="<f4", mode="r+", shape=(rows, 24))
+        self._rows = rows
+        ids = np.asarray(self._dev["device_id"])
+        used = np.flatnonzero(ids)
+        self._index = dict(zip(ids[used].tolist(), used.tolist()))
+
+    def _sync(self) -> None:
+        """Pick up rows (and file growth) from other workers."""
+        if MULTI_WORKER:
+            self._open()
+
+    @contextmanager
+    def _guard(self) -> Iterator[None]:
+        with self._lock:
+            if not MULTI_WORKER:
+                yield
+                return
+            with file_lock(self.dir / "devices.bin"):
+                yield
+
+    def _row(self, device_id: int, home_id: int, type_: Optional[str], name: Optional[str]) -> int:
+        r = self._index.get(device_id)
+        if r is None and MULTI_WORKER:
+            self._sync()
+            r = self._index.get(device_id)
+        if r is None:
+            r = len(self._index)
+            if r >= self._rows:
+                self.flush()
+                self._open(self._rows * 2)
+            self._reset(r, device_id, home_id)
+            self._index[device_id] = r
+        dev = self._dev
+        dev["home_id"][r] = home_id
+        if type_:
+            dev["type"][r] = type_.lower().encode("utf-8")[:16]
+        if name:
+            dev["name"][r] = name.encode("utf-8")[:48]
+        return r
+
+    def _reset(self, r: int, device_id: int, home_id: int) -> None:
+        self._dev[r] = np.zeros((), dtype=DEVICE)
+        self._dev["device_id"][r], self._dev["home_id"][r] = device_id, home_id
+        self._days[r] = 0
+        self._hours[r] = 0
+
+    def flush(self) -> None:
+        for m in (self._dev, self._runs, self._days, self._hours):
+            m.flush()
+
+    # -- ingestion -------------------------------------------------------------
+    def event(
+        self,
+        device_id: int,
+        home_id: int,
+        on: bool,
+        ts: Optional[float] = None,
+        log_id: Optional[int] = None,
+        type_: Optional[str] = None,
+        name: Optional[str] = None,
+    ) -> bool:
+        """Apply one toggle; False if log_id was already applied."""
+        ts = time.time() if ts is None else ts
+        with self._guard():
+            return self._apply(self._row(device_id, home_id, type_, name), on, ts, log_id)
+
+    def _apply(self, r: int, on: bool, ts: float, log_id: Optional[int]) -> bool:
+        dev = self._dev
+        if log_id is not None and log_id <= dev["last_log"][r]:
+            return False
+        if on:
+            if not dev["is_on"][r]:
+                dev["is_on"][r], dev["since"][r] = 1, ts
+        elif dev["is_on"][r]:
+            if ts > dev["since"][r]:
+                self._close(r, float(dev["since"][r]), ts)
+            dev["is_on"][r] = 0
+        if log_id is not None:
+            dev["last_log"][r] = log_id
+        return True
+
+    def _close(self, r: int, start: float, end: float) -> None:
+        dev = self._dev
+        n = int(dev["runs"][r])
+        self._runs[r, n % self.history] = (start, end - start)
+        dev["runs"][r] = n + 1
+
+        day, last = int(start // 86400), int(dev["day"][r])
+        if n == 0:
+            dev["first_day"][r], last = day, day - DAYS
+        if day > last:
+            for d in range(max(last + 1, day - DAYS + 1), day + 1):   # days with no runs since
+                self._days[r, d % DAYS] = 0
+            dev["day"][r] = day
+        if day > int(dev["day"][r]) - DAYS:
+            self._days[r, day % DAYS] += 1
+        at = float(dev["profile_at"][r])
+        hours = self._hours[r]
+        if at and end > at:
+            hours *= 0.5 ** ((end - at) / self.half_life_s)
+        for h, secs in _local_hours(start, end):
+            hours[h] += secs
+        dev["profile_at"][r] = max(at, end)
+
+    def backfill(self, home_id: int, types: Dict[int, str], logs: Iterable[Dict[str, Any]], device_ids: Iterable[int] = ()) -> int:
+        """Rebuild the series of a home's devices from {id, device_id, ts, to} log rows; returns events applied."""
+        rows = sorted(logs, key=lambda r: (float(r["ts"]), int(r.get("id") or 0)))
+        with self._guard():
+            reset = {*map(int, device_ids), *map(int, types)}
+            for did in reset:
+                r = self._row(did, home_id, types.get(did), None)
+                type_, name = self._dev["type"][r], self._dev["name"][r]
+                self._reset(r, did, home_id)
+                self._dev["type"][r], self._dev["name"][r] = type_, name
+            n = 0
+            for lg in rows:
+                did = int(lg["device_id"])
+                if did in reset and self._apply(self._index[did], bool(lg.get("to")), float(lg["ts"]), lg.get("id")):
+                    n += 1
+            self.flush()
+            return n
+
+    # -- detection -------------------------------------------------------------
+    def detect(self, home_ids: Optional[List[int]] = None, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        now = time.time() if now is None else now
+        with self._guard():
+            self._sync()
+            used = len(self._index)
+            ids = self._dev["device_id"][:used]
+            sel = np.flatnonzero(ids != 0)
+            if home_ids is not None:
+                sel = sel[np.isin(self._dev["home_id"][sel], home_ids)]
+            dev = np.array(self._dev[sel])
+            runs = np.array(self._runs[sel])
+            days = np.array(self._days[sel])
+            hours = np.array(self._hours[sel], dtype=np.float64)
+        if not len(dev):
+            return []
+
+        H = self.history
+        count = np.minimum(dev["runs"], H)
+        valid = np.arange(H)[None, :] < count[:, None]
+        logd = np.where(valid, np.log(np.maximum(runs["secs"], 1.0)), np.inf)
+
+        # Run-length baselines: the device's own, or its type's until it has MIN_RUNS
+        med = _median(logd, count)
+        mad = np.maximum(_median(np.where(valid, np.abs(logd - med[:, None]), np.inf), count) * 1.4826, MIN_MAD)
+        types, tix = np.unique(dev["type"], return_inverse=True)
+        t_med = np.full(len(types), np.nan)
+        t_mad = np.full(len(types), np.nan)
+        t_share = np.zeros((len(types), 24))
+        for t in range(len(types)):
+            m = tix == t
+            pooled = logd[m][valid[m]]
+            if pooled.size >= MIN_RUNS:
+                t_med[t] = np.median(pooled)
+                t_mad[t] = max(np.median(np.abs(pooled - t_med[t])) * 1.4826, MIN_MAD)
+            prof = hours[m].sum(axis=0)
+            t_share[t] = prof / max(prof.sum(), 1e-9)
+        own = count >= MIN_RUNS
+        base_med = np.where(own, med, t_med[tix])
+        base_mad = np.where(own, mad, t_mad[tix])
+
+        on = (dev["is_on"] == 1) & (dev["since"] < now)
+        cur = np.where(on, now - dev["since"], 0.0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z_long = (np.log(np.maximum(cur, 1.0)) - base_med) / base_mad
+        long_run = on & (cur > MIN_LONG_S) & (z_long > Z_LONG)
+
+        # Runs in the last 24h vs. the daily count over whole days before them (first, partial day excluded)
+        recent = (valid & (runs["start"] >= now - 86400.0)).sum(axis=1)
+        cut = int((now - 86400.0) // 86400)                 # day the 24h window starts in
+        lo = np.maximum(dev["first_day"] + 1, cut - DAYS + 1)
+        slot_day = dev["day"][:, None] - (dev["day"][:, None] - np.arange(DAYS)[None, :]) % DAYS
+        n_old = np.where((slot_day >= lo[:, None]) & (slot_day < cut), days, 0).sum(axis=1)
+        n_days = np.where(dev["runs"] > 0, cut - lo, 0)
+        rate = np.where(n_days >= MIN_CYCLE_DAYS, n_old / np.maximum(n_days, 1), np.nan)
+        with np.errstate(invalid="ignore"):
+            z_cycle = (recent - rate) / np.sqrt(np.maximum(rate, 1.0))
+            cycling = (n_old >= MIN_RUNS) & (recent > CYCLE_RATIO * rate) & (z_cycle > Z_CYCLE)
+
+        # Time-of-day profile: share of on-time at the current local hour
+        h = datetime.fromtimestamp(now).hour
+        total = hours.sum(axis=1) * 0.5 ** (np.maximum(now - dev["profile_at"], 0.0) / self.half_life_s)
+        share = hours[:, h] / np.maximum(hours.sum(axis=1), 1e-9)
+        odd_hour = on & (total >= MIN_PROFILE_H * 3600) & (share < ODD_SHARE) & (t_share[tix, h] < ODD_TYPE_SHARE)
+
+        out: List[Dict[str, Any]] = []
+        for i in np.flatnonzero(long_run | cycling | odd_hour):
+            t = dev["type"][i].decode("utf-8", "replace")
+            name = dev["name"][i].decode("utf-8", "replace") or f"{t or 'device'} #{int(dev['device_id'][i])}"
+            common = {"device_id": int(dev["device_id"][i]), "home_id": int(dev["home_id"][i]), "type": t, "name": name}
+            if long_run[i]:
+                typical = float(np.exp(base_med[i]))
+                out.append({**common, "kind": "long_run", "severity": "warn", "score": round(float(z_long[i]), 2),
+                            "title": f"Unusually long run: {name}",
+                            "detail": f"'{name}' has been on for {cur[i] / 3600:.1f}h; it usually runs about {typical / 3600:.1f}h."})
+            if cycling[i]:
+                out.append({**common, "kind": "cycling", "severity": "warn", "score": round(float(z_cycle[i]), 2),
+                            "title": f"Abnormal cycling: {name}",
+                            "detail": f"'{name}' switched on {int(recent[i])} times in the last 24h, against about {rate[i]:.0f} on a usual day."})
+            if odd_hour[i]:
+                out.append({**common, "kind": "odd_hour", "severity": "info", "score": round(float(share[i]), 3),
+                            "title": f"On at an unusual hour: {name}",
+                            "detail": f"'{name}' is on at {h:02d}:00, when it is almost never in use."})
+        for a in out:
+            registry.inc("voltspace_anomalies_total", kind=a["kind"])
+        return out
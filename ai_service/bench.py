@@ -0,0 +1,363 @@
+"""Benchmark / load-test suite for the AI service.
+
+Generates synthetic device fleets shaped like the `devices` table, drives
+the endpoints concurrently (in-process through the ASGI app, or over real
+HTTP via uvicorn) against local OpenAI/Meshy stand-ins from stubs.py, and
+reports p50/p95/p99 latency, throughput and peak RSS. Results can be saved
+and compared against a baseline to catch regressions.
+
+    python -m ai_service.bench --sizes 10,1000,100000 --mode both
+    python -m ai_service.bench --save bench_baseline.json
+    python -m ai_service.bench --baseline bench_baseline.json --tolerance 0.25
+
+Environment for the service is set up here (temp storage dir, stub URLs)
+before ai_service.main is imported, so a run never touches real data.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from .stubs import ServerThread, build_stub_app
+
+DEVICE_TYPES = ("light", "ac", "plug", "sensor", "tv", "pc", "speaker", "fridge", "washer", "camera")
+TYPE_POWER = {"light": 9, "ac": 900, "plug": 60, "sensor": 1, "tv": 100, "pc": 150, "speaker": 10, "fridge": 120, "washer": 500, "camera": 5}
+SCENARIOS = ("insights", "insights_batch", "insights_ai", "agent", "agent_stream", "meshify", "events", "loadshift")
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Synthetic fleets
+# ──────────────────────────────────────────────────────────────────────────────
+def make_fleet(n: int, seed: int = 7, homes: int = 0) -> List[Dict[str, Any]]:
+    """n devices in the payload shape run_insights.php sends (device row + home/room + hours_on)."""
+    rnd = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    homes = homes or max(1, n // 12)
+    out: List[Dict[str, Any]] = []
+    for i in range(n):
+        t = rnd.choice(DEVICE_TYPES)
+        on = rnd.random() < 0.45
+        hours = rnd.uniform(0, 14)
+        state: Dict[str, Any] = {"on": on}
+        if t == "light":
+            state["brightness"] = rnd.randint(10, 100)
+        elif t == "ac":
+            state["setpoint"] = rnd.randint(18, 27)
+        elif t == "plug":
+            state["flexible"] = rnd.random() < 0.3
+        out.append({
+            "id": i + 1,
+            "name": f"{t}-{i}",
+            "type": t,
+            "home": f"Home {i % homes}",
+            "room": f"Room {i % 7}",
+            "power_w": TYPE_POWER[t],
+            "state": state,
+            "on": on,
+            "hours_on": round(hours, 2) if on else 0.0,
+            "last_active": (now - timedelta(hours=hours)).isoformat(),
+            "hour_now": now.hour,
+        })
+    return out
+
+
+def make_groups(fleet: List[Dict[str, Any]], per_group: int = 12) -> Dict[str, List[Dict[str, Any]]]:
+    return {f"home:{g}": fleet[i:i + per_group] for g, i in enumerate(range(0, len(fleet), per_group))}
+
+
+def make_shift(fleet: List[Dict[str, Any]], seed: int = 7) -> Dict[str, Any]:
+    """/loadshift batch: every home in the fleet with its flexible plugs as loads, under a peak cap."""
+    rnd = random.Random(seed)
+    homes: Dict[str, Dict[str, Any]] = {}
+    for d in fleet:
+        h = homes.setdefault(d["home"], {
+            "home_id": len(homes) + 1,
+            "price_cents_per_kwh": rnd.choice((12.0, 15.0, 22.0)),
+            "peak_w": 4000, "base_w": 600, "loads": [],
+        })
+        if d["state"].get("flexible"):
+            h["loads"].append({"id": d["id"], "power_w": max(d["power_w"], 500), "hours": rnd.choice((1, 2, 3)),
+                               "done_within_h": rnd.choice((None, 12))})
+    offpeak = {h: 8.0 for h in (22, 23, 0, 1, 2, 3, 4, 5)}
+    return {"homes": list(homes.values()), "tariff": {**offpeak, 17: 30.0, 18: 30.0, 19: 30.0, 20: 30.0}, "slot_minutes": 15}
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Measurement
+# ──────────────────────────────────────────────────────────────────────────────
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def percentile(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = (len(sorted_vals) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+async def run_load(call: Callable[[int], Awaitable[Optional[float]]], requests: int, concurrency: int) -> Dict[str, Any]:
+    """Run `requests` calls over `concurrency` workers; a call may return its own latency (e.g. TTFB)."""
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in counter:
+            t0 = time.perf_counter()
+            try:
+                own = await call(i)
+                latencies.append(own if own is not None else time.perf_counter() - t0)
+            except Exception:
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - t0
+    lat = sorted(latencies)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "p50_ms": round(percentile(lat, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(lat, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(lat, 0.99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(lat) * 1000, 2) if lat else 0.0,
+        "rps": round(len(lat) / wall, 2) if wall > 0 else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Scenarios (each returns a per-request coroutine factory)
+# ──────────────────────────────────────────────────────────────────────────────
+def _check(r: httpx.Response) -> httpx.Response:
+    if r.status_code >= 300:
+        raise RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
+    return r
+
+
+def scenario_call(name: str, client: httpx.AsyncClient, fleet: List[Dict[str, Any]], cache_hits: bool) -> Callable[[int], Awaitable[Optional[float]]]:
+    body = json.dumps(fleet).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+
+    if name == "insights":
+        async def call(i: int) -> Optional[float]:
+            _check(await client.post("/insights", content=body, headers=headers))
+    elif name == "insights_batch":
+        groups = json.dumps({"groups": make_groups(fleet)}).encode("utf-8")
+
+        async def call(i: int) -> Optional[float]:
+            _check(await client.post("/insights/batch", content=groups, headers=headers))
+    elif name == "insights_ai":
+        async def call(i: int) -> Optional[float]:
+            payload = body
+            if not cache_hits and fleet:
+                # Vary one device so every request is a distinct snapshot
+                first = dict(fleet[0], name=f"bench-{i}-{random.random()}")
+                payload = json.dumps([first] + fleet[1:]).encode("utf-8")
+            _check(await client.post("/insights_ai", content=payload, headers=headers))
+    elif name == "agent":
+        ctx = {"devices": fleet[:50]}
+
+        async def call(i: int) -> Optional[float]:
+            _check(await client.post("/agent", json={"question": "Which devices use most energy?", "context": ctx}))
+    elif name == "agent_stream":
+        ctx = {"devices": fleet[:50]}
+
+        async def call(i: int) -> float:
+            # Latency here is time to first chunk (in-process, httpx's ASGI transport buffers the whole body)
+            t0 = time.perf_counter()
+            ttfb = None
+            async with client.stream("POST", "/agent/stream", json={"question": "Any tips?", "context": ctx}) as r:
+                _check(r)
+                async for _ in r.aiter_bytes():
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - t0
+            return ttfb if ttfb is not None else time.perf_counter() - t0
+    elif name == "meshify":
+        async def call(i: int) -> Optional[float]:
+            img = b"\x89PNG\r\n\x1a\n" + os.urandom(32 * 1024)
+            r = _check(await client.post("/meshify/jobs", files={"image": (f"plan{i}.png", img, "image/png")}))
+            job = r.json()
+            job_id = job.get("job_id")
+            while job.get("status") not in ("succeeded", "failed"):
+                await asyncio.sleep(0.1)
+                job = _check(await client.get(f"/meshify/jobs/{job_id}")).json()
+            if job["status"] != "succeeded":
+                raise RuntimeError(job.get("error"))
+    elif name == "events":
+        async def call(i: int) -> Optional[float]:
+            d = fleet[i % len(fleet)] if fleet else {"id": 1}
+            _check(await client.post("/events/device", json={
+                "device_id": d["id"], "home_id": 1 + d["id"] % 50, "on": i % 2 == 0,
+                "power_w": d.get("power_w", 10), "log_id": 1_000_000 + i,
+            }))
+    elif name == "loadshift":
+        shift = json.dumps(make_shift(fleet)).encode("utf-8")
+
+        async def call(i: int) -> Optional[float]:
+            _check(await client.post("/loadshift", content=shift, headers=headers))
+    else:
+        raise ValueError(f"Unknown scenario {name}")
+    return call
+
+
+def requests_for(size: int, requests: int) -> int:
+    # Keep the large fleets from dominating wall time
+    return max(5, min(requests, requests * 1000 // max(size, 1)))
+
+
+async def run_suite(args: argparse.Namespace, app: Any) -> List[Dict[str, Any]]:
+    results: List[Dict[str, Any]] = []
+    modes = ["inproc", "http"] if args.mode == "both" else [args.mode]
+    fleets = {n: make_fleet(n) for n in args.sizes}
+
+    for mode in modes:
+        if mode == "inproc":
+            async with app.router.lifespan_context(app):
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+                    results += await _run_scenarios(args, client, fleets, mode)
+        else:
+            server: Optional[ServerThread] = None
+            url = args.url
+            if not url:
+                server = ServerThread(app).__enter__()
+                url = server.url
+            try:
+                limits = httpx.Limits(max_connections=args.concurrency * 2)
+                async with httpx.AsyncClient(base_url=url, timeout=600, limits=limits) as client:
+                    results += await _run_scenarios(args, client, fleets, mode)
+            finally:
+                if server is not None:
+                    server.__exit__(None, None, None)
+    return results
+
+
+async def _run_scenarios(args: argparse.Namespace, client: httpx.AsyncClient, fleets: Dict[int, List[Dict[str, Any]]], mode: str) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    for scenario in args.scenarios:
+        # Upstream-bound scenarios don't depend on fleet size beyond the prompt; run them once
+        sizes = args.sizes if scenario in ("insights", "insights_batch", "insights_ai", "loadshift") else args.sizes[:1]
+        for size in sizes:
+            n = requests_for(size, args.requests) if scenario != "meshify" else min(args.requests, args.meshify_requests)
+            call = scenario_call(scenario, client, fleets[size], args.cache_hits)
+            row = {"scenario": scenario, "size": size, "mode": mode}
+            row.update(await run_load(call, n, args.concurrency))
+            out.append(row)
+            print(format_row(row), flush=True)
+    return out
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Reporting / baselines
+# ──────────────────────────────────────────────────────────────────────────────
+def format_row(r: Dict[str, Any]) -> str:
+    return (
+        f"{r['mode']:<6} {r['scenario']:<15} n={r['size']:<7} reqs={r['requests']:<4} c={r['concurrency']:<3} "
+        f"p50={r['p50_ms']:>9.2f}ms p95={r['p95_ms']:>9.2f}ms p99={r['p99_ms']:>9.2f}ms "
+        f"rps={r['rps']:>8.2f} err={r['errors']:<3} rss={r['peak_rss_mb']:.0f}MB"
+    )
+
+
+def compare(current: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Regressions: p95 slower or throughput lower than baseline by more than tolerance."""
+    base = {(b["scenario"], b["size"], b["mode"]): b for b in baseline}
+    problems: List[str] = []
+    for r in current:
+        b = base.get((r["scenario"], r["size"], r["mode"]))
+        if not b:
+            continue
+        tag = f"{r['mode']}/{r['scenario']}/n={r['size']}"
+        if b["p95_ms"] > 0 and r["p95_ms"] > b["p95_ms"] * (1 + tolerance):
+            problems.append(f"{tag}: p95 {r['p95_ms']}ms vs baseline {b['p95_ms']}ms")
+        if b["rps"] > 0 and r["rps"] < b["rps"] * (1 - tolerance):
+            problems.append(f"{tag}: throughput {r['rps']} rps vs baseline {b['rps']} rps")
+        if r["errors"] > b.get("errors", 0):
+            problems.append(f"{tag}: {r['errors']} errors vs baseline {b.get('errors', 0)}")
+    return problems
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="VoltSpace AI service benchmarks")
+    ap.add_argument("--sizes", default="10,1000,10000", help="comma-separated fleet sizes (up to 100000)")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--mode", choices=("inproc", "http", "both"), default="inproc")
+    ap.add_argument("--url", default="", help="benchmark an already running service instead of starting one (http mode)")
+    ap.add_argument("--requests", type=int, default=50)
+    ap.add_argument("--meshify-requests", type=int, default=10)
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--llm-latency", type=float, default=0.3, help="stub OpenAI latency (s)")
+    ap.add_argument("--meshy-latency", type=float, default=0.02, help="stub Meshy per-call latency (s)")
+    ap.add_argument("--meshy-job-seconds", type=float, default=0.5, help="stub Meshy time to finish a task (s)")
+    ap.add_argument("--cache-hits", action="store_true", help="send identical /insights_ai snapshots (measure cache hits)")
+    ap.add_argument("--save", default="", help="write results JSON here")
+    ap.add_argument("--baseline", default="", help="compare against a saved results JSON")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    args = ap.parse_args(argv)
+    args.sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    args.scenarios = [s for s in args.scenarios.split(",") if s.strip()]
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    stub = ServerThread(build_stub_app(
+        llm_latency=args.llm_latency,
+        meshy_latency=args.meshy_latency,
+        meshy_job_seconds=args.meshy_job_seconds,
+    )).__enter__()
+    storage = tempfile.TemporaryDirectory(prefix="voltspace-bench-")
+    os.environ.update({
+        "AI_SERVICE_STORAGE_DIR": storage.name,
+        "OPENAI_API_KEY": "bench-key",
+        "OPENAI_BASE_URL": f"{stub.url}/v1",
+        "MESHY_API_KEY": "bench-key",
+        "MESHY_API_URL": f"{stub.url}/openapi/v1/image-to-3d",
+        "MESHY_POLL_INTERVAL": os.getenv("MESHY_POLL_INTERVAL", "0.2"),
+        "OPENAI_RPM": os.getenv("OPENAI_RPM", "100000"),
+        "OPENAI_BURST": os.getenv("OPENAI_BURST", "1000"),
+    })
+    from .main import app  # imported after the environment points at the stubs
+
+    try:
+        results = asyncio.run(run_suite(args, app))
+    finally:
+        stub.__exit__(None, None, None)
+        storage.cleanup()
+
+    report = {
+        "meta": {"at": datetime.now(timezone.utc).isoformat(), "python": sys.version.split()[0], "argv": sys.argv[1:]},
+        "results": results,
+    }
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f).get("results", [])
+        problems = compare(results, baseline, args.tolerance)
+        for p in problems:
+            print("REGRESSION", p)
+        if problems:
+            return 1
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
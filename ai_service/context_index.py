@@ -0,0 +1,323 @@
+"""Per-user assistant context, kept current between questions.
+
+The PHP app seeds a user's summary now and then: devices, recent insights
+and recent device logs. /events/device keeps device state and recent
+activity up to date in between, so a question no longer needs three DB
+queries. For each question the summary is cut into snippets:
+
+- an overview
+- top consumers (kWh today from the energy ledger, else current draw)
+- devices left on for long
+- recent warnings
+- recent activity
+- one line per device
+
+Each snippet is scored against the question's words and packed greedily
+into a token budget. The prompt then carries what is relevant rather
+than the first 6000 characters of a JSON dump.
+
+Summaries are stored as one JSON document per user in SQLite so they
+survive restarts.
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .rules import RULES
+from .shared import MULTI_WORKER, connect
+
+MAX_INSIGHTS = 20
+MAX_EVENTS = 30
+LONG_ON_DEFAULT_H = 4.0
+# Per-type "on too long" thresholds come from the rule table (lights 8h, AC 6h)
+LONG_ON_HOURS = {r.type: float(r.min_hours) for r in RULES if r.min_hours is not None}
+
+# Question words that make a whole section more relevant
+SECTION_HINTS: Dict[str, Tuple[str, ...]] = {
+    "consumers": ("energy", "kwh", "consum", "usage", "use most", "bill", "cost", "expensive", "power", "watt", "save", "saving"),
+    "long_on": ("left on", "still on", "long", "hours", "running", "forgot", "all day", "overnight", "night"),
+    "alerts": ("alert", "warn", "insight", "problem", "issue", "anomal", "critical", "unusual", "wrong", "check"),
+    "activity": ("when", "last", "recent", "turned", "switched", "toggle", "yesterday", "today", "history"),
+    "devices": ("device", "which", "list", "room", "all my", "status"),
+}
+SECTION_TITLES = (
+    ("overview", "Overview"),
+    ("consumers", "Top consumers"),
+    ("long_on", "On for a long time"),
+    ("alerts", "Recent warnings"),
+    ("activity", "Recent activity"),
+    ("devices", "Devices"),
+)
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def approx_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English/JSON)."""
+    return len(text) // 4 + 1
+
+
+def _words(text: Any) -> set:
+    return set(_WORD.findall(str(text or "").lower()))
+
+
+def _ts(v: Any) -> Optional[float]:
+    if v in (None, ""):
+        return None
+    if isinstance(v, (int, float)):
+        return float(v)
+    try:
+        dt = datetime.fromisoformat(str(v).replace(" ", "T"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def doc_from_context(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize the PHP context ({devices, insights, logs}) into a summary document."""
+    devices: Dict[str, Dict[str, Any]] = {}
+    for i, d in enumerate(ctx.get("devices") or []):
+        if not isinstance(d, dict):
+            continue
+        key = str(d.get("id") if d.get("id") is not None else f"n{i}")
+        on = bool(d.get("on"))
+        devices[key] = {
+            "name": d.get("name") or "?",
+            "type": (d.get("type") or "").lower(),
+            "room": d.get("room"),
+            "on": on,
+            "watts": float(d.get("watts") if d.get("watts") is not None else d.get("power_w") or 0),
+            "since": _ts(d.get("since")) or _ts(d.get("last_active")),
+            "attrs": d.get("attrs") if isinstance(d.get("attrs"), dict) else {},
+        }
+    insights = [
+        {"title": i.get("title"), "severity": i.get("severity") or "info", "ts": _ts(i.get("ts") or i.get("created_at"))}
+        for i in (ctx.get("insights") or [])[:MAX_INSIGHTS] if isinstance(i, dict)
+    ]
+    events = [
+        {"device": e.get("device"), "event": e.get("event"), "on": e.get("on"), "ts": _ts(e.get("ts") or e.get("created_at"))}
+        for e in (ctx.get("logs") or [])[:MAX_EVENTS] if isinstance(e, dict)
+    ]
+    return {"devices": devices, "insights": insights, "events": events, "seeded_at": time.time()}
+
+
+def _fmt_hours(h: float) -> str:
+    return f"{h:.0f}h" if h >= 10 else f"{h:.1f}h"
+
+
+def _fmt_time(ts: Optional[float]) -> str:
+    if ts is None:
+        return "?"
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+
+
+def snippets(
+    doc: Dict[str, Any],
+    now: Optional[float] = None,
+    kwh_today: Optional[Dict[str, float]] = None,
+) -> List[Tuple[str, float, set, str]]:
+    """(section, base score, tag words, text) for every piece of the summary."""
+    now = time.time() if now is None else now
+    devices = doc.get("devices") or {}
+    out: List[Tuple[str, float, set, str]] = []
+
+    def tags(d: Dict[str, Any]) -> set:
+        return _words(d.get("name")) | _words(d.get("type")) | _words(d.get("room"))
+
+    on = [d for d in devices.values() if d.get("on")]
+    draw = sum(d.get("watts") or 0 for d in on)
+    rooms = sorted({str(d["room"]) for d in devices.values() if d.get("room")})
+    overview = f"{len(devices)} devices, {len(on)} on now drawing ~{draw:.0f} W"
+    if rooms:
+        overview += f"; rooms: {', '.join(rooms[:12])}"
+    out.append(("overview", 100.0, set(), overview))
+
+    # Top consumers: metered kWh today when the ledger knows the device, else current draw
+    metered = sorted(((v, k) for k, v in (kwh_today or {}).items() if v > 0 and k in devices), reverse=True)[:8]
+    if metered:
+        for r, (kwh, k) in enumerate(metered):
+            d = devices[k]
+            out.append(("consumers", 5.0 - 0.3 * r, tags(d), f"{d['name']} ({d['type']}): {kwh:.2f} kWh today"))
+    else:
+        ranked_on = sorted(on, key=lambda d: d.get("watts") or 0, reverse=True)[:8]
+        for r, d in enumerate(ranked_on):
+            out.append(("consumers", 5.0 - 0.3 * r, tags(d), f"{d['name']} ({d['type']}): ~{d.get('watts') or 0:.0f} W now"))
+
+    for d in on:
+        since = d.get("since")
+        if since is None:
+            continue
+        hrs = max(0.0, (now - since) / 3600.0)
+        limit = LONG_ON_HOURS.get(d.get("type") or "", LONG_ON_DEFAULT_H)
+        if hrs > limit:
+            out.append(("long_on", 6.0 + min(hrs / limit, 3.0), tags(d),
+                        f"{d['name']} ({d['type']}{', ' + str(d['room']) if d.get('room') else ''}) on for {_fmt_hours(hrs)}"))
+
+    sev_score = {"critical": 7.0, "warn": 5.0, "info": 2.5}
+    for r, i in enumerate(doc.get("insights") or []):
+        out.append(("alerts", sev_score.get(i.get("severity"), 2.5) - 0.1 * r, _words(i.get("title")),
+                    f"[{i.get('severity')}] {i.get('title')} ({_fmt_time(i.get('ts'))})"))
+
+    for r, e in enumerate(doc.get("events") or []):
+        what = e.get("event") or "toggle"
+        if e.get("on") is not None:
+            what = "turned on" if e["on"] else "turned off"
+        out.append(("activity", 3.0 - 0.05 * r, _words(e.get("device")), f"{_fmt_time(e.get('ts'))}: {e.get('device')} {what}"))
+
+    for d in devices.values():
+        attrs = ", ".join(f"{k}={v}" for k, v in list((d.get("attrs") or {}).items())[:6])
+        line = f"{d['name']} ({d['type']}{', ' + str(d['room']) if d.get('room') else ''}): {'on' if d.get('on') else 'off'}, {d.get('watts') or 0:.0f} W"
+        out.append(("devices", 1.0, tags(d), line + (f", {attrs}" if attrs else "")))
+    return out
+
+
+def render(pieces: Iterable[Tuple[str, float, set, str]], question: str, budget_tokens: int) -> str:
+    """Score snippets against the question and pack the best ones into the budget."""
+    q = (question or "").lower()
+    qwords = _words(q)
+    boosted = {s for s, hints in SECTION_HINTS.items() if any(h in q for h in hints)}
+    scored = []
+    for n, (section, base, tags, text) in enumerate(pieces):
+        score = base + (3.0 if section in boosted else 0.0) + (4.0 if tags & qwords else 0.0)
+        scored.append((-score, n, section, text))
+    scored.sort()
+
+    chosen: Dict[str, List[Tuple[int, str]]] = {}
+    used = 0
+    for _, n, section, text in scored:
+        cost = approx_tokens(text) + (0 if section in chosen else 4)  # + section header
+        if used + cost > budget_tokens:
+            continue
+        used += cost
+        chosen.setdefault(section, []).append((n, text))
+
+    blocks: List[str] = []
+    for section, title in SECTION_TITLES:
+        lines = [t for _, t in sorted(chosen.get(section, []))]
+        if lines:
+            blocks.append(f"{title}:\n" + "\n".join(f"- {t}" for t in lines))
+    return "\n".join(blocks)
+
+
+class ContextIndex:
+    def __init__(
+        self,
+        db_path: Path | str,
+        kwh_source: Optional[Callable[[List[int], float], Dict[int, float]]] = None,
+    ):
+        if isinstance(db_path, Path):
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = connect(db_path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS user_context (user_id INTEGER PRIMARY KEY, doc TEXT NOT NULL, updated REAL NOT NULL)")
+        self._lock = threading.Lock()
+        self._docs: Dict[int, Dict[str, Any]] = {}
+        self._memo = not MULTI_WORKER   # other workers write the same rows, so always read them back
+        self.kwh_source = kwh_source
+
+    # -- updates ---------------------------------------------------------------
+    def seed(self, user_id: int, ctx: Dict[str, Any]) -> None:
+        """Replace a user's summary with a fresh snapshot from the PHP app."""
+        doc = doc_from_context(ctx)
+        with self._lock:
+            self._save(user_id, doc)
+            if self._memo:
+                self._docs[user_id] = doc
+
+    def device_event(
+        self,
+        user_id: int,
+        device_id: int,
+        on: bool,
+        watts: float,
+        ts: Optional[float] = None,
+        name: Optional[str] = None,
+        type: Optional[str] = None,
+    ) -> bool:
+        """Fold a toggle into a seeded summary; unknown users are left for the next seed."""
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            with self._db:
+                cur = self._db.cursor()
+                cur.execute("BEGIN IMMEDIATE")
+                doc = self._get(user_id)
+                if doc is None:
+                    return False
+                doc = self._update(doc, device_id, on, watts, ts, name, type)
+                self._save_in_tx(cur, user_id, doc)
+            # Memo only changes once the row is committed
+            if self._memo:
+                self._docs[user_id] = doc
+            return True
+
+    @staticmethod
+    def _update(
+        doc: Dict[str, Any],
+        device_id: int,
+        on: bool,
+        watts: float,
+        ts: float,
+        name: Optional[str],
+        type: Optional[str],
+    ) -> Dict[str, Any]:
+        """Copy of doc with the toggle folded in (the memoized doc stays untouched)."""
+        prev = doc["devices"].get(str(device_id)) or {"room": None, "attrs": {}}
+        d = {
+            **prev,
+            "name": name or prev.get("name") or f"device {device_id}",
+            "type": (type or prev.get("type") or "").lower(),
+            "on": bool(on),
+            "watts": float(watts),
+            "since": ts,
+        }
+        events = [{"device": d["name"], "event": "toggle", "on": bool(on), "ts": ts}] + doc["events"][:MAX_EVENTS - 1]
+        return {**doc, "devices": {**doc["devices"], str(device_id): d}, "events": events}
+
+    # -- reads -----------------------------------------------------------------
+    def has(self, user_id: int) -> bool:
+        with self._lock:
+            return self._get(user_id) is not None
+
+    def build(self, user_id: int, question: str, budget_tokens: int, now: Optional[float] = None) -> Optional[str]:
+        now = time.time() if now is None else now
+        with self._lock:
+            doc = self._get(user_id)
+            if doc is None:
+                return None
+            doc = json.loads(json.dumps(doc))   # snapshot; scoring happens outside the lock
+        kwh: Optional[Dict[str, float]] = None
+        ids = [int(k) for k in doc["devices"] if k.isdigit()]
+        if self.kwh_source is not None and ids:
+            try:
+                kwh = {str(k): v for k, v in self.kwh_source(ids, now).items()}
+            except Exception:
+                kwh = None
+        return render(snippets(doc, now, kwh), question, budget_tokens)
+
+    # -- storage ---------------------------------------------------------------
+    def _get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        doc = self._docs.get(user_id)
+        if doc is None:
+            row = self._db.execute("SELECT doc FROM user_context WHERE user_id=?", (user_id,)).fetchone()
+            if row:
+                doc = json.loads(row[0])
+                if self._memo:
+                    self._docs[user_id] = doc
+        return doc
+
+    def _save(self, user_id: int, doc: Dict[str, Any]) -> None:
+        with self._db:
+            self._save_in_tx(self._db.cursor(), user_id, doc)
+
+    @staticmethod
+    def _save_in_tx(cur: sqlite3.Cursor, user_id: int, doc: Dict[str, Any]) -> None:
+        """Write doc inside the caller's open transaction (no commit here)."""
+        cur.execute(
+            "INSERT OR REPLACE INTO user_context(user_id, doc, updated) VALUES (?, ?, ?)",
+            (user_id, json.dumps(doc, ensure_ascii=False), time.time()),
+        )
@@ -0,0 +1,221 @@
+"""Incremental energy accounting from device toggle events.
+
+Each toggle closes the device's previous on-interval, and that interval's
+on-seconds and kWh are added to hourly, daily and monthly buckets (UTC).
+Reports then read precomputed totals (plus whatever is still running)
+instead of replaying device_logs per page view. Buckets and per-device
+state live in SQLite so they survive restarts.
+
+backfill() replays a home's existing logs once; after that, live events
+with a log_id already applied are ignored, so replays are idempotent.
+"""
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .shared import connect
+
+PERIODS = (("hour", "%Y-%m-%dT%H"), ("day", "%Y-%m-%d"), ("month", "%Y-%m"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS device_state (
+  device_id INTEGER PRIMARY KEY,
+  home_id INTEGER NOT NULL,
+  is_on INTEGER NOT NULL DEFAULT 0,
+  watts REAL NOT NULL DEFAULT 0,
+  since REAL NULL,
+  last_log_id INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS energy_buckets (
+  device_id INTEGER NOT NULL,
+  home_id INTEGER NOT NULL,
+  period TEXT NOT NULL,
+  bucket TEXT NOT NULL,
+  on_seconds REAL NOT NULL DEFAULT 0,
+  kwh REAL NOT NULL DEFAULT 0,
+  PRIMARY KEY (device_id, period, bucket)
+);
+CREATE INDEX IF NOT EXISTS idx_buckets_home ON energy_buckets(home_id, period, bucket);
+CREATE TABLE IF NOT EXISTS backfilled_homes (
+  home_id INTEGER PRIMARY KEY,
+  at REAL NOT NULL
+);
+"""
+
+
+def split_hours(start: float, end: float) -> List[Tuple[datetime, float]]:
+    """Split [start, end) into (hour start, seconds) pieces on UTC hour boundaries."""
+    out: List[Tuple[datetime, float]] = []
+    t = start
+    while t < end:
+        dt = datetime.fromtimestamp(t, timezone.utc)
+        hour = dt.replace(minute=0, second=0, microsecond=0)
+        nxt = min(end, (hour + timedelta(hours=1)).timestamp())
+        out.append((hour, nxt - t))
+        t = nxt
+    return out
+
+
+class EnergyLedger:
+    def __init__(self, db_path: Path | str):
+        if isinstance(db_path, Path):
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = connect(db_path)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    # -- ingestion -------------------------------------------------------------
+    def apply(
+        self,
+        device_id: int,
+        home_id: int,
+        on: bool,
+        watts: float,
+        ts: Optional[float] = None,
+        log_id: Optional[int] = None,
+    ) -> bool:
+        """Apply one toggle; returns False if it was already applied (log_id not newer)."""
+        ts = time.time() if ts is None else ts
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")   # state read + write in one step, also across workers
+            return self._apply(device_id, home_id, on, watts, ts, log_id)
+
+    def _apply(self, device_id: int, home_id: int, on: bool, watts: float, ts: float, log_id: Optional[int]) -> bool:
+        row = self._db.execute(
+            "SELECT is_on, watts, since, last_log_id FROM device_state WHERE device_id=?", (device_id,)
+        ).fetchone()
+        was_on, prev_watts, since, last_log_id = row if row else (0, 0.0, None, 0)
+        if log_id is not None and log_id <= last_log_id:
+            return False
+        if was_on and since is not None and ts > since:
+            self._accrue(device_id, home_id, since, ts, prev_watts)
+        self._db.execute(
+            """INSERT INTO device_state(device_id, home_id, is_on, watts, since, last_log_id)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(device_id) DO UPDATE SET home_id=excluded.home_id, is_on=excluded.is_on,
+                 watts=excluded.watts, since=excluded.since, last_log_id=excluded.last_log_id""",
+            (device_id, home_id, int(on), float(watts) if on else 0.0, ts, max(last_log_id, log_id or 0)),
+        )
+        return True
+
+    def _accrue(self, device_id: int, home_id: int, start: float, end: float, watts: float) -> None:
+        acc: Dict[Tuple[str, str], float] = {}
+        for hour, secs in split_hours(start, end):
+            for period, fmt in PERIODS:
+                k = (period, hour.strftime(fmt))
+                acc[k] = acc.get(k, 0.0) + secs
+        self._db.executemany(
+            """INSERT INTO energy_buckets(device_id, home_id, period, bucket, on_seconds, kwh)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(device_id, period, bucket) DO UPDATE SET
+                 on_seconds=on_seconds+excluded.on_seconds, kwh=kwh+excluded.kwh, home_id=excluded.home_id""",
+            [(device_id, home_id, p, b, secs, watts * secs / 3600000.0) for (p, b), secs in acc.items()],
+        )
+
+    def backfill(self, home_id: int, watts: Dict[int, float], logs: Iterable[Dict[str, Any]]) -> int:
+        """Rebuild a home's totals from its full toggle history; returns events applied.
+
+        watts maps device_id → draw while on; logs are {id, device_id, ts, to}
+        rows in any order.
+        """
+        rows = sorted(logs, key=lambda r: (float(r["ts"]), int(r.get("id") or 0)))
+        with self._lock, self._db:
+            self._db.execute("BEGIN IMMEDIATE")
+            ids = list(watts.keys())
+            marks = ",".join("?" * len(ids))
+            if ids:
+                self._db.execute(f"DELETE FROM energy_buckets WHERE device_id IN ({marks})", ids)
+                self._db.execute(f"DELETE FROM device_state WHERE device_id IN ({marks})", ids)
+            n = 0
+            for r in rows:
+                did = int(r["device_id"])
+                if did not in watts:
+                    continue
+                if self._apply(did, home_id, bool(r.get("to")), watts[did], float(r["ts"]), r.get("id")):
+                    n += 1
+            self._db.execute("INSERT OR REPLACE INTO backfilled_homes(home_id, at) VALUES (?, ?)", (home_id, time.time()))
+            return n
+
+    # -- reads -----------------------------------------------------------------
+    def report(self, home_ids: List[int], now: Optional[float] = None) -> Dict[int, Dict[str, Any]]:
+        """Today / month / year totals per home, including intervals still open at `now`."""
+        now = time.time() if now is None else now
+        dt = datetime.fromtimestamp(now, timezone.utc)
+        day, month, year = dt.strftime("%Y-%m-%d"), dt.strftime("%Y-%m"), dt.strftime("%Y")
+        out: Dict[int, Dict[str, Any]] = {
+            h: {"backfilled": False, "kwh_today": 0.0, "on_seconds_today": 0.0, "kwh_month": 0.0, "kwh_year": 0.0}
+            for h in home_ids
+        }
+        if not home_ids:
+            return out
+        marks = ",".join("?" * len(home_ids))
+        with self._lock:
+            for (h,) in self._db.execute(f"SELECT home_id FROM backfilled_homes WHERE home_id IN ({marks})", home_ids):
+                out[h]["backfilled"] = True
+            q = f"""SELECT home_id, period, bucket, SUM(on_seconds), SUM(kwh) FROM energy_buckets
+                    WHERE home_id IN ({marks}) AND ((period='day' AND bucket=?) OR (period='month' AND bucket LIKE ?))
+                    GROUP BY home_id, period, bucket"""
+            for h, period, bucket, secs, kwh in self._db.execute(q, [*home_ids, day, f"{year}-%"]):
+                if period == "day":
+                    out[h]["kwh_today"] += kwh
+                    out[h]["on_seconds_today"] += secs
+                else:
+                    out[h]["kwh_year"] += kwh
+                    if bucket == month:
+                        out[h]["kwh_month"] += kwh
+            running = self._db.execute(
+                f"SELECT home_id, watts, since FROM device_state WHERE is_on=1 AND home_id IN ({marks})", home_ids
+            ).fetchall()
+
+        # Devices still on: count their open interval without persisting it
+        day_start = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+        starts = {
+            "today": day_start.timestamp(),
+            "month": day_start.replace(day=1).timestamp(),
+            "year": day_start.replace(month=1, day=1).timestamp(),
+        }
+        for h, watts, since in running:
+            if since is None or since >= now:
+                continue
+            secs = {k: max(0.0, now - max(since, start)) for k, start in starts.items()}
+            out[h]["kwh_today"] += watts * secs["today"] / 3600000.0
+            out[h]["on_seconds_today"] += secs["today"]
+            out[h]["kwh_month"] += watts * secs["month"] / 3600000.0
+            out[h]["kwh_year"] += watts * secs["year"] / 3600000.0
+        return out
+
+    def device_kwh(self, device_ids: List[int], now: Optional[float] = None) -> Dict[int, float]:
+        """kWh used today (UTC) per device, including a still-open interval."""
+        now = time.time() if now is None else now
+        if not device_ids:
+            return {}
+        dt = datetime.fromtimestamp(now, timezone.utc)
+        day_start = dt.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        marks = ",".join("?" * len(device_ids))
+        out = {d: 0.0 for d in device_ids}
+        with self._lock:
+            for did, kwh in self._db.execute(
+                f"SELECT device_id, kwh FROM energy_buckets WHERE period='day' AND bucket=? AND device_id IN ({marks})",
+                [dt.strftime("%Y-%m-%d"), *device_ids],
+            ):
+                out[did] += kwh
+            running = self._db.execute(
+                f"SELECT device_id, watts, since FROM device_state WHERE is_on=1 AND device_id IN ({marks})", device_ids
+            ).fetchall()
+        for did, watts, since in running:
+            if since is not None and since < now:
+                out[did] += watts * (now - max(since, day_start)) / 3600000.0
+        return out
+
+    def series(self, home_id: int, period: str, start: str, end: str) -> List[Dict[str, Any]]:
+        """Closed-interval bucket totals for a home, e.g. period='hour', start/end as bucket keys."""
+        with self._lock:
+            rows = self._db.execute(
+                """SELECT bucket, SUM(on_seconds), SUM(kwh) FROM energy_buckets
+                   WHERE home_id=? AND period=? AND bucket BETWEEN ? AND ?
+                   GROUP BY bucket ORDER BY bucket""",
+                (home_id, period, start, end),
+            ).fetchall()
+        return [{"bucket": b, "on_seconds": s, "kwh": k} for b, s, k in rows]
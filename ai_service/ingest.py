@@ -0,0 +1,194 @@
+"""Raw JSON ingestion for the insights endpoints.
+
+Validating every device into a Pydantic Device and then copying it again
+into prompt dicts cost more than the rules themselves on large fleets.
+Here the request body is decoded once and checked in a single pass that
+fills the DeviceTable columns directly; the decoded dicts are kept as the
+row store. `state` is never copied: the pass reads only the rule flags, and
+compact() builds prompt entries (attrs included) only when /insights_ai
+needs them.
+
+Validation mirrors the Device model: name and type are strings, power_w an
+integer, state an object, last_active an ISO 8601 string or epoch number.
+Problems are reported as FastAPI-style error lists (loc / msg / type).
+"""
+import json
+from bisect import bisect_right
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .rules import RULE_FLAGS, DeviceTable
+
+Row = Dict[str, Any]
+
+
+class IngestError(ValueError):
+    def __init__(self, errors: List[Dict[str, Any]]):
+        super().__init__(f"{len(errors)} validation error(s)")
+        self.errors = errors
+
+    def __reduce__(self):  # keep `errors` when raised in an offload.py pool process
+        return (IngestError, (self.errors,))
+
+
+def _err(loc: Sequence[Any], msg: str, typ: str, value: Any = None) -> Dict[str, Any]:
+    return {"type": typ, "loc": list(loc), "msg": msg, "input": value}
+
+
+def _timestamp(v: Any) -> float:
+    """Epoch seconds for an ISO 8601 string or a number (seconds, or ms if huge); naive = UTC."""
+    if isinstance(v, bool):
+        raise ValueError
+    if isinstance(v, (int, float)):
+        return v / 1000.0 if abs(v) > 2e10 else float(v)
+    if isinstance(v, str):
+        dt = datetime.fromisoformat(v[:-1] + "+00:00" if v.endswith(("Z", "z")) else v)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+    raise ValueError
+
+
+def _power(v: Any) -> int:
+    if isinstance(v, bool):
+        raise ValueError
+    if isinstance(v, int):
+        return v
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    if isinstance(v, str):
+        return int(v.strip())
+    raise ValueError
+
+
+def load(body: bytes) -> Any:
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        raise IngestError([_err(["body", getattr(e, "pos", 0)], "JSON decode error", "json_invalid")])
+
+
+def read_devices(
+    rows: Any,
+    loc: Sequence[Any] = ("body",),
+    group: Optional[Sequence[int]] = None,
+    now: Optional[datetime] = None,
+) -> DeviceTable:
+    """Validate decoded device dicts and lay them out as a DeviceTable in one pass.
+
+    power_w is normalized to int in place, so compact() sees the same value
+    the rules did.
+    """
+    if not isinstance(rows, list):
+        raise IngestError([_err(loc, "Input should be a valid list", "list_type", rows)])
+    n = len(rows)
+    names: List[str] = [""] * n
+    types = np.empty(n, dtype=object)
+    on = np.zeros(n, dtype=bool)
+    power_w = np.zeros(n, dtype=np.int64)
+    last_ts = np.full(n, np.nan)
+    flags = {f: np.zeros(n, dtype=bool) for f in RULE_FLAGS}
+    errors: List[Dict[str, Any]] = []
+
+    for i, d in enumerate(rows):
+        if not isinstance(d, dict):
+            errors.append(_err([*loc, i], "Input should be a valid dictionary", "dict_type", d))
+            continue
+        name, typ = d.get("name"), d.get("type")
+        if not isinstance(name, str):
+            errors.append(_err([*loc, i, "name"], "Input should be a valid string", "string_type", name))
+        if not isinstance(typ, str):
+            errors.append(_err([*loc, i, "type"], "Input should be a valid string", "string_type", typ))
+        st = d.get("state")
+        if st is None or st == []:   # PHP encodes an empty array as []
+            st = {}
+        elif not isinstance(st, dict):
+            errors.append(_err([*loc, i, "state"], "Input should be a valid dictionary", "dict_type", st))
+            continue
+        pw = d.get("power_w", 0)
+        try:
+            d["power_w"] = pw = _power(pw)
+        except (TypeError, ValueError):
+            errors.append(_err([*loc, i, "power_w"], "Input should be a valid integer", "int_type", pw))
+            continue
+        la = d.get("last_active")
+        if la is not None:
+            try:
+                last_ts[i] = _timestamp(la)
+            except (TypeError, ValueError):
+                errors.append(_err([*loc, i, "last_active"], "Input should be a valid datetime", "datetime_type", la))
+        if errors:
+            continue  # keep scanning for errors, skip filling
+        names[i] = name
+        types[i] = typ.lower()
+        on[i] = bool(st.get("on", False))
+        power_w[i] = pw
+        for f, col in flags.items():
+            col[i] = bool(st.get(f))
+
+    if errors:
+        raise IngestError(errors)
+
+    now_ts = (now or datetime.now(timezone.utc)).timestamp()
+    hours_on = np.maximum(0.0, (now_ts - last_ts) / 3600.0)
+    hours_on = np.where(on & ~np.isnan(last_ts), hours_on, 0.0)
+    grp = np.asarray(group, dtype=np.int32) if group is not None else None
+    return DeviceTable(names, types, on, power_w, hours_on, flags, grp)
+
+
+def parse_devices(body: bytes) -> Tuple[List[Row], DeviceTable]:
+    """`[device, ...]` request body → (decoded rows, table)."""
+    rows = load(body)
+    return rows, read_devices(rows)
+
+
+def parse_groups(body: bytes) -> Tuple[List[str], DeviceTable]:
+    """`{"groups": {key: [device, ...]}}` request body → (group keys, table with table.group set)."""
+    data = load(body)
+    groups = data.get("groups") if isinstance(data, dict) else None
+    if not isinstance(groups, dict):
+        raise IngestError([_err(["body", "groups"], "Input should be a valid dictionary", "dict_type", groups)])
+    keys = list(groups.keys())
+    rows: List[Any] = []
+    group: List[int] = []
+    starts: List[int] = []
+    for g, key in enumerate(keys):
+        devs = groups[key]
+        if not isinstance(devs, list):
+            raise IngestError([_err(["body", "groups", key], "Input should be a valid list", "list_type", devs)])
+        starts.append(len(rows))
+        rows.extend(devs)
+        group.extend([g] * len(devs))
+    try:
+        return keys, read_devices(rows, loc=("body", "groups"), group=group)
+    except IngestError as e:
+        # Flat row index → (group key, index within that group), matching the body's shape
+        for err in e.errors:
+            i = err["loc"][2]
+            g = bisect_right(starts, i) - 1
+            err["loc"][2:3] = [keys[g], i - starts[g]]
+        raise
+
+
+def compact(rows: List[Row]) -> List[Row]:
+    """Prompt / cache-key entries for /insights_ai, built straight from the decoded rows."""
+    out: List[Row] = []
+    for raw in rows:
+        st = raw.get("state") or {}
+        if not isinstance(st, dict):
+            st = {}
+        out.append({
+            "name": raw.get("name"),
+            "type": raw.get("type"),
+            "home": raw.get("home"),
+            "room": raw.get("room"),
+            "on": bool(raw.get("on", st.get("on", False))),
+            "power_w": raw.get("power_w") or 0,
+            "hours_on": float(raw.get("hours_on") or 0.0),
+            "last_active": raw.get("last_active"),
+            "hour_now": raw.get("hour_now"),
+            "attrs": {k: v for k, v in st.items() if k != "on"},
+        })
+    return out
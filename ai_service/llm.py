@@ -0,0 +1,172 @@
+"""Process-wide, pooled OpenAI clients.
+
+One client per (api key, model), created just after startup (or on first
+use) and shared by every request, so keep-alive connections and TLS sessions are reused. Each client
+caps concurrent upstream calls with a semaphore and smooths request rate
+with a token bucket; callers over either limit wait in line (up to
+queue_timeout) instead of tripping the upstream rate limit. Streaming calls
+use an AsyncOpenAI twin of the client and share the same limits.
+
+The openai SDK is imported when the first client is built, not with this
+module: it is about half of the service's import time.
+"""
+import asyncio
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+
+from .metrics import registry, upstream
+
+
+class LLMBusy(RuntimeError):
+    """Raised when a call waited longer than queue_timeout for a slot (message mentions rate limit)."""
+
+
+class TokenBucket:
+    def __init__(self, rate_per_s: float, capacity: float):
+        self.rate = rate_per_s
+        self.capacity = capacity
+        self._tokens = capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def _take(self, default_wait: float) -> float:
+        """Take a token if available (returns 0), else return seconds until one is."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate if self.rate > 0 else default_wait
+
+    def acquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._take(timeout)
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    async def acquire_async(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self._take(timeout)
+            if not wait:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+
+class LLMClient:
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        base_url: Optional[str] = None,
+        max_inflight: int = 8,
+        rpm: float = 120,
+        burst: int = 10,
+        queue_timeout: float = 30.0,
+        max_connections: int = 20,
+    ):
+        from openai import AsyncOpenAI, OpenAI  # deferred, see module docstring
+
+        self.model = model
+        self.queue_timeout = queue_timeout
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        timeout = httpx.Timeout(30.0, connect=10.0)
+        self._http = httpx.Client(limits=limits, timeout=timeout)
+        self._ahttp = httpx.AsyncClient(limits=limits, timeout=timeout)
+        self.client = OpenAI(api_key=api_key, base_url=base_url, http_client=self._http, max_retries=2)
+        self.aclient = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self._ahttp, max_retries=2)
+        self._sem = threading.BoundedSemaphore(max_inflight)
+        self._bucket = TokenBucket(rpm / 60.0, burst)
+
+    def chat(self, **kwargs: Any):
+        """chat.completions.create with this client's model, after waiting for a slot."""
+        deadline = time.monotonic() + self.queue_timeout
+        if not self._bucket.acquire(self.queue_timeout):
+            raise self._busy("chat", "Local rate limit exceeded while waiting for an OpenAI slot")
+        if not self._sem.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            raise self._busy("chat", "Local rate limit exceeded: too many concurrent OpenAI calls")
+        try:
+            kwargs.setdefault("model", self.model)
+            with upstream("openai", "chat"):
+                return self.client.chat.completions.create(**kwargs)
+        finally:
+            self._sem.release()
+
+    async def stream_chat(self, **kwargs: Any) -> AsyncIterator[str]:
+        """Streaming chat completion; yields content deltas as they arrive."""
+        deadline = time.monotonic() + self.queue_timeout
+        if not await self._bucket.acquire_async(self.queue_timeout):
+            raise self._busy("stream", "Local rate limit exceeded while waiting for an OpenAI slot")
+        # Poll the shared (thread) semaphore so sync and streaming calls count against one cap
+        while not self._sem.acquire(blocking=False):
+            if time.monotonic() > deadline:
+                raise self._busy("stream", "Local rate limit exceeded: too many concurrent OpenAI calls")
+            await asyncio.sleep(0.05)
+        try:
+            kwargs.setdefault("model", self.model)
+            with upstream("openai", "stream"):
+                stream = await self.aclient.chat.completions.create(stream=True, **kwargs)
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        yield delta
+        finally:
+            self._sem.release()
+
+    @staticmethod
+    def _busy(op: str, msg: str) -> LLMBusy:
+        registry.inc("voltspace_upstream_calls_total", service="openai", op=op, outcome="busy")
+        return LLMBusy(msg)
+
+    async def aclose(self) -> None:
+        self._http.close()
+        await self._ahttp.aclose()
+
+
+_clients: Dict[Tuple[str, str], LLMClient] = {}
+_lock = threading.Lock()
+
+
+def get_llm(api_key: str, model: str) -> LLMClient:
+    """Shared client for (api_key, model); created on first use if startup didn't."""
+    k = (api_key, model)
+    c = _clients.get(k)
+    if c is not None:
+        return c
+    with _lock:
+        c = _clients.get(k)
+        if c is None:
+            c = LLMClient(
+                api_key,
+                model,
+                base_url=os.getenv("OPENAI_BASE_URL") or None,
+                max_inflight=int(os.getenv("OPENAI_MAX_INFLIGHT", "8")),
+                rpm=float(os.getenv("OPENAI_RPM", "120")),
+                burst=int(os.getenv("OPENAI_BURST", "10")),
+                queue_timeout=float(os.getenv("OPENAI_QUEUE_TIMEOUT", "30")),
+            )
+            _clients[k] = c
+        return c
+
+
+async def close_llms() -> None:
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for c in clients:
+        await c.aclose()
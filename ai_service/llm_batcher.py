@@ -0,0 +1,157 @@
+"""Micro-batching and coalescing for /insights_ai LLM calls.
+
+Concurrent /insights_ai requests for small fleets are collected for a
+short window (INSIGHTS_BATCH_WINDOW_MS) and answered by one chat
+completion. The prompt has one section per household, and the JSON
+result is split back per caller. The long system prompt and a slot under
+the OpenAI rate limit are then paid once per batch instead of once per
+user.
+
+Requests with the same snapshot key that arrive while one is already in
+flight wait for that call instead of starting another.
+
+If the merged call fails or its reply leaves a household out, the batcher
+makes that household's regular single call itself, once per snapshot,
+and every waiter on it gets the result.
+
+Waiting is bounded by the caller's timeout, which covers every path. A
+caller that times out gets None and answers from the rules. It doesn't
+start a second upstream call while the first is still running.
+"""
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List, Optional
+
+from .metrics import registry
+
+Insights = List[Dict[str, Any]]
+SingleFn = Callable[[Any, List[Dict[str, Any]]], Insights]
+MultiFn = Callable[[Any, List[List[Dict[str, Any]]]], List[Optional[Insights]]]
+
+registry.describe("voltspace_llm_batch_requests_total", "counter", "insights_ai LLM requests by path (batched, single, coalesced, retry, timeout)")
+registry.describe("voltspace_llm_batches_total", "counter", "insights_ai LLM calls made by the batcher, by number of merged requests")
+
+
+class _Item:
+    __slots__ = ("key", "client", "compact", "future", "ctx")
+
+    def __init__(self, key: str, client: Any, compact: List[Dict[str, Any]], future: Future):
+        self.key = key
+        self.client = client
+        self.compact = compact
+        self.future = future
+        self.ctx = contextvars.copy_context()   # keeps the caller's endpoint label on stage timings
+
+
+class InsightsBatcher:
+    def __init__(
+        self,
+        single: SingleFn,
+        multi: MultiFn,
+        window_s: float = 0.02,
+        max_batch: int = 8,
+        max_devices: int = 40,
+        workers: int = 4,
+    ):
+        self.single = single
+        self.multi = multi
+        self.window_s = window_s
+        self.max_batch = max_batch
+        self.max_devices = max_devices
+        self._q: "queue.Queue[_Item]" = queue.Queue()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="insights-batch")
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, client: Any, key: str, compact: List[Dict[str, Any]], timeout: float) -> Optional[Insights]:
+        """LLM insights for one snapshot; None means no answer within `timeout`.
+
+        Errors from the single call for this snapshot are raised as-is, the
+        same as a direct call would raise them.
+        """
+        with self._lock:
+            fut = self._inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = self._inflight[key] = Future()
+        if not leader:
+            registry.inc("voltspace_llm_batch_requests_total", path="coalesced")
+        elif self.window_s <= 0 or self.max_batch <= 1 or len(compact) > self.max_devices:
+            # Big fleets (or batching off) go alone, but identical snapshots still share the call
+            registry.inc("voltspace_llm_batch_requests_total", path="single")
+            self._pool.submit(self._run_single, _Item(key, client, compact, fut))
+        else:
+            self._ensure_thread()
+            self._q.put(_Item(key, client, compact, fut))
+        try:
+            result = fut.result(timeout=timeout)
+        except FutureTimeout:   # not the builtin TimeoutError before 3.11
+            registry.inc("voltspace_llm_batch_requests_total", path="timeout")
+            return None
+        return result
+
+    # -- dispatch --------------------------------------------------------------
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._dispatch, name="insights-batcher", daemon=True)
+                self._thread.start()
+
+    def _dispatch(self) -> None:
+        while True:
+            batch = [self._q.get()]
+            deadline = time.monotonic() + self.window_s
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            by_client: Dict[int, List[_Item]] = {}
+            for item in batch:
+                by_client.setdefault(id(item.client), []).append(item)
+            for items in by_client.values():
+                self._pool.submit(self._flush, items)
+
+    def _flush(self, items: List[_Item]) -> None:
+        registry.inc("voltspace_llm_batches_total", size=str(len(items)))
+        if len(items) == 1:
+            registry.inc("voltspace_llm_batch_requests_total", path="single")
+            self._run_single(items[0])
+            return
+        registry.inc("voltspace_llm_batch_requests_total", float(len(items)), path="batched")
+        try:
+            # Stage timings go to the first caller's endpoint
+            results = items[0].ctx.run(self.multi, items[0].client, [it.compact for it in items])
+        except Exception:
+            results = [None] * len(items)
+        for item, res in zip(items, results):
+            if res is None:
+                # Failed or left out: one single call per snapshot, shared by everyone waiting on it
+                registry.inc("voltspace_llm_batch_requests_total", path="retry")
+                self._pool.submit(self._run_single, item)
+            else:
+                self._finish(item, res)
+
+    def _run_single(self, item: _Item) -> None:
+        try:
+            res = item.ctx.run(self.single, item.client, item.compact)
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(item.key, None)
+            item.future.set_exception(e)
+            return
+        self._finish(item, res)
+
+    def _finish(self, item: _Item, result: Optional[Insights]) -> None:
+        with self._lock:
+            self._inflight.pop(item.key, None)
+        item.future.set_result(result)
@@ -0,0 +1,204 @@
+"""Time-of-use load shifting for flexible plugs.
+
+Each home brings:
+- a tariff: its flat energy_price_cents_per_kwh, with optional per-hour
+  overrides (cents/kWh by local hour of day);
+- its flexible loads: power_w, run time, and optionally when each becomes
+  ready and when it must be done;
+- optionally, the rest of the household's draw (base_w) and a peak cap.
+
+Every load runs once, without interruption, and the plan covers a horizon
+of equal slots starting at the next slot boundary (now, if already on one).
+
+Every possible start of a load is priced in one numpy pass over a
+cumulative price array C:
+
+    cost(start) = kW * (C[start + d] - C[start]) * slot hours
+
+The window sums per (tariff, run length) are computed once per batch and
+shared by every home on the same tariff. Without a cap, or with one that all
+loads running together wouldn't reach, each load takes its cheapest start,
+also memoized. Otherwise loads are placed greedily, biggest energy
+first, at the cheapest start where base + already placed load + its own
+power stays within the cap for the whole run. All starts are checked at
+once with a sliding-window max. Greedy placement isn't guaranteed optimal
+under a tight cap. Loads that fit nowhere are returned as unscheduled
+rather than breaking the cap. So are loads whose window is too short for
+their run or whose deadline comes before they are ready. One bad
+appliance doesn't fail the rest of the batch.
+
+Savings are measured against running each load as soon as it is ready.
+"""
+import math
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+SLOT_MINUTES = (15, 30, 60)
+
+TariffKey = Tuple[float, Tuple[Tuple[int, float], ...]]
+
+
+class Tariffs:
+    """Slot prices, cumulative prices and run-length window sums, memoized per tariff within a batch."""
+
+    def __init__(self, start: datetime, slots: int, slot_minutes: int):
+        self.slots = slots
+        per_hour = 60 // slot_minutes
+        first = start.hour * per_hour + start.minute // slot_minutes
+        # Local hour of day for every slot of the horizon
+        self.hour_of_slot = ((first + np.arange(slots)) // per_hour) % 24
+        self._cum: Dict[TariffKey, np.ndarray] = {}
+        self._windows: Dict[Tuple[TariffKey, int], np.ndarray] = {}
+        self._best: Dict[Tuple[TariffKey, int, int, int], Tuple[int, float, float]] = {}
+
+    @staticmethod
+    def key(cents: float, overrides: Dict[int, float]) -> TariffKey:
+        return float(cents), tuple(sorted((int(h), float(c)) for h, c in overrides.items()))
+
+    def cumulative(self, key: TariffKey) -> np.ndarray:
+        cum = self._cum.get(key)
+        if cum is None:
+            hourly = np.full(24, key[0])
+            for h, c in key[1]:
+                hourly[h] = c
+            cum = self._cum[key] = np.concatenate(([0.0], np.cumsum(hourly[self.hour_of_slot])))
+        return cum
+
+    def windows(self, key: TariffKey, d: int) -> np.ndarray:
+        """Sum of slot prices over d slots for every start 0..slots-d."""
+        w = self._windows.get((key, d))
+        if w is None:
+            cum = self.cumulative(key)
+            w = self._windows[(key, d)] = cum[d:] - cum[:-d]
+        return w
+
+    def cheapest(self, key: TariffKey, d: int, lo: int, hi: int) -> Tuple[int, float, float]:
+        """(start, price sum, price sum when started at lo) for a d-slot run inside [lo, hi)."""
+        best = self._best.get((key, d, lo, hi))
+        if best is None:
+            w = self.windows(key, d)[lo:hi - d + 1]
+            k = int(np.argmin(w))
+            best = self._best[(key, d, lo, hi)] = (lo + k, float(w[k]), float(w[0]))
+        return best
+
+
+def _ready_slot(hours: Optional[float], slot_h: float, slots: int) -> int:
+    """First slot starting at or after `hours` (a load can't start before it is ready)."""
+    if hours is None:
+        return 0
+    return min(slots, max(0, math.ceil(float(hours) / slot_h - 1e-9)))
+
+
+def _deadline_slot(hours: Optional[float], slot_h: float, slots: int) -> int:
+    """Last slot boundary at or before `hours` (a load must end by it)."""
+    if hours is None:
+        return slots
+    return min(slots, max(0, int(float(hours) / slot_h + 1e-9)))
+
+
+def plan_home(home: Dict[str, Any], tariffs: Tariffs, tariff: Dict[int, float], slot_h: float) -> Dict[str, Any]:
+    slots = tariffs.slots
+    key = Tariffs.key(home["price_cents_per_kwh"], {**tariff, **(home.get("overrides") or {})})
+    base = home.get("base_w") or 0.0
+    used = np.asarray(base, dtype=float) if isinstance(base, list) else np.full(slots, float(base))
+    if used.shape != (slots,):
+        raise ValueError(f"home {home.get('home_id')}: base_w needs {slots} values (one per slot), got {used.size}")
+    cap = home.get("peak_w")
+
+    prepared = []
+    unscheduled: List[Dict[str, Any]] = []
+    for load in home.get("loads") or ():
+        d = max(1, int(np.ceil(float(load["hours"]) / slot_h - 1e-9)))
+        lo = _ready_slot(load.get("ready_in_h"), slot_h, slots)
+        hi = _deadline_slot(load.get("done_within_h"), slot_h, slots)   # run must end by slot hi
+        if lo > hi:
+            unscheduled.append({"id": load.get("id"), "name": load.get("name"), "reason": "deadline"})
+            continue
+        if hi - lo < d:
+            unscheduled.append({"id": load.get("id"), "name": load.get("name"), "reason": "window"})
+            continue
+        prepared.append((float(load["power_w"]) * d, d, lo, hi, load))
+
+    schedule: List[Dict[str, Any]] = []
+    total = baseline_total = 0.0
+    # Cap can only matter if everything running at once would break it; otherwise every
+    # load just takes its cheapest start, shared across homes on the same tariff
+    capped = cap is not None and float(used.max()) + sum(float(p[4]["power_w"]) for p in prepared) > float(cap)
+    # Biggest energy first, so large loads get the cheap slots before the cap fills up
+    for _, d, lo, hi, load in sorted(prepared, key=lambda p: -p[0]):
+        power = float(load["power_w"])
+        scale = power / 1000.0 * slot_h
+        if not capped:
+            s, price, first = tariffs.cheapest(key, d, lo, hi)
+            cost, baseline = price * scale, first * scale
+        else:
+            window = tariffs.windows(key, d)[lo:hi - d + 1]
+            peak = sliding_window_view(used, d)[lo:hi - d + 1].max(axis=1)
+            fits = np.where(peak + power <= float(cap), window, np.inf)
+            k = int(np.argmin(fits))
+            if not np.isfinite(fits[k]):
+                unscheduled.append({"id": load.get("id"), "name": load.get("name"), "reason": "peak cap"})
+                continue
+            s, cost, baseline = lo + k, float(window[k]) * scale, float(window[0]) * scale
+        used[s:s + d] += power
+        total += cost
+        baseline_total += baseline
+        schedule.append({
+            "id": load.get("id"),
+            "name": load.get("name"),
+            "start_slot": s,
+            "slots": d,
+            "cost_cents": round(cost, 2),
+            "baseline_cents": round(baseline, 2),
+        })
+
+    schedule.sort(key=lambda e: e["start_slot"])
+    return {
+        "home_id": home.get("home_id"),
+        "cost_cents": round(total, 2),
+        "baseline_cents": round(baseline_total, 2),
+        "savings_cents": round(baseline_total - total, 2),
+        "peak_w": round(float(used.max()), 1) if slots else 0.0,
+        "schedule": schedule,
+        "unscheduled": unscheduled,
+    }
+
+
+def plan(
+    homes: List[Dict[str, Any]],
+    tariff: Optional[Dict[int, float]] = None,
+    start: Optional[datetime] = None,
+    horizon_h: int = 24,
+    slot_minutes: int = 60,
+) -> Dict[str, Any]:
+    """Cost-minimal start times for every home's flexible loads (see module docstring)."""
+    if slot_minutes not in SLOT_MINUTES:
+        raise ValueError(f"slot_minutes must be one of {SLOT_MINUTES}")
+    # Round up to the next slot boundary so the first slot never starts in the past
+    start = start or datetime.now()
+    floor = start.replace(minute=start.minute - start.minute % slot_minutes, second=0, microsecond=0)
+    start = floor if floor == start else floor + timedelta(minutes=slot_minutes)
+    slot_h = slot_minutes / 60.0
+    slots = int(round(horizon_h / slot_h))
+    tariffs = Tariffs(start, slots, slot_minutes)
+
+    out = [plan_home(h, tariffs, tariff or {}, slot_h) for h in homes]
+    step = timedelta(minutes=slot_minutes)
+    for h in out:
+        for e in h["schedule"]:
+            e["start"] = (start + e["start_slot"] * step).isoformat(timespec="minutes")
+            e["end"] = (start + (e["start_slot"] + e["slots"]) * step).isoformat(timespec="minutes")
+    return {
+        "start": start.isoformat(timespec="minutes"),
+        "slot_minutes": slot_minutes,
+        "homes": out,
+        "totals": {
+            "cost_cents": round(sum(h["cost_cents"] for h in out), 2),
+            "baseline_cents": round(sum(h["baseline_cents"] for h in out), 2),
+            "savings_cents": round(sum(h["savings_cents"] for h in out), 2),
+            "unscheduled": sum(len(h["unscheduled"]) for h in out),
+        },
+    }
@@ -1,18 +1,41 @@
+import time
+_IMPORT_T0 = time.perf_counter()   # import-time measurement (voltspace_startup_seconds)
+
 import os
+import json
+import hmac
 from pathlib import Path
-from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
-import time
-import base64
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Union
+import asyncio
 import mimetypes
+from contextlib import asynccontextmanager
 
-import requests
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
-from openai import OpenAI
+
+from . import ingest, loadshift, offload
+from .alerts import AlertEngine
+from .anomalies import DeviceSeries
+from .context_index import ContextIndex, approx_tokens, doc_from_context, render as render_context, snippets
+from .energy import EnergyLedger
+from .insights_store import InsightsStore
+from .llm import close_llms, get_llm
+from .llm_batcher import InsightsBatcher
+from .metrics import MetricsMiddleware, mark_parsed, profiler, registry, stage
+from .meshy_jobs import MESHY_OPTIONS, MeshyJobManager, download_glb, get_task, submit_task
+from .model_cache import ModelCache
+from .offload import grouped_insights, rule_insights
+from .response_cache import ResponseCache, snapshot_key
+from .rules import DeviceTable
+from .shared import MULTI_WORKER, WORKERS
+from .uploads import UploadLimitMiddleware, save_upload, shrink_image
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Load .env so API keys are read from ai-service/.env
@@ -22,13 +45,96 @@ _dotenv = BASE_DIR / ".env"
 if _dotenv.exists():
     load_dotenv(dotenv_path=_dotenv)
 
-UPLOAD_DIR = BASE_DIR / "uploads"
-STATIC_DIR = BASE_DIR / "static"
+# Uploads, generated models and service state; relocatable for benchmarks/tests
+STORAGE_DIR = Path(os.getenv("AI_SERVICE_STORAGE_DIR") or BASE_DIR)
+UPLOAD_DIR = STORAGE_DIR / "uploads"
+STATIC_DIR = STORAGE_DIR / "static"
 MODELS_DIR = STATIC_DIR / "models"
-for p in (UPLOAD_DIR, MODELS_DIR):
+DATA_DIR = STORAGE_DIR / "data"
+for p in (UPLOAD_DIR, MODELS_DIR, DATA_DIR):
     p.mkdir(parents=True, exist_ok=True)
 
-app = FastAPI(title="VoltSpace AI Service")
+PUBLIC_URL = os.getenv("AI_SERVICE_PUBLIC_URL", "http://127.0.0.1:8000").rstrip("/")
+MESHY_DEADLINE_S = float(os.getenv("MESHY_DEADLINE_S", "420"))
+# Uploads over the cap get 413 before they are parsed; bigger plans are shrunk before submit (needs Pillow)
+MESHY_MAX_UPLOAD_BYTES = int(float(os.getenv("MESHY_MAX_UPLOAD_MB", "20")) * 1024 * 1024)
+MESHY_MAX_IMAGE_PX = int(os.getenv("MESHY_MAX_IMAGE_PX", "2048"))
+MESHY_TARGET_BYTES = int(float(os.getenv("MESHY_TARGET_MB", "4")) * 1024 * 1024)
+
+
+def model_url_for(filename: str) -> str:
+    return f"{PUBLIC_URL}/static/models/{filename}"
+
+
+model_cache = ModelCache(
+    index_path=DATA_DIR / "model_index.json",
+    upload_dir=UPLOAD_DIR,
+    models_dir=MODELS_DIR,
+    max_bytes=int(float(os.getenv("MODEL_CACHE_MAX_MB", "2048")) * 1024 * 1024),
+)
+
+meshy_jobs = MeshyJobManager(
+    store_path=DATA_DIR / "meshy_jobs.json",
+    models_dir=MODELS_DIR,
+    model_url_for=model_url_for,
+    queue_size=int(os.getenv("MESHY_QUEUE_SIZE", "16")),
+    submitters=int(os.getenv("MESHY_SUBMITTERS", "2")),
+    pollers=int(os.getenv("MESHY_POLLERS", "2")),
+    poll_interval=float(os.getenv("MESHY_POLL_INTERVAL", "3")),
+    deadline_s=MESHY_DEADLINE_S,
+    cache=model_cache,
+    keep_finished=int(os.getenv("MESHY_KEEP_JOBS", "500")),
+    keep_age_s=float(os.getenv("MESHY_KEEP_JOBS_HOURS", "168")) * 3600,
+)
+
+
+def insights_model() -> str:
+    return os.getenv("OPENAI_INSIGHTS_MODEL", os.getenv("OPENAI_MODEL", "gpt-4o-mini"))
+
+
+def agent_model() -> str:
+    return os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+
+def _warm_llms() -> None:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if api_key:
+        for m in {insights_model(), agent_model()}:
+            get_llm(api_key, m)
+
+
+# Seconds spent importing this module and running lifespan startup, per worker (see /metrics)
+STARTUP: Dict[str, float] = {}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    t0 = time.perf_counter()
+    if os.getenv("PROFILE_ENABLED", "0") == "1":
+        profiler.start()
+    cpu_pool.start()
+    await meshy_jobs.start()
+    await alert_engine.start()
+    # Build the shared OpenAI clients (and import the SDK) right after startup instead of
+    # during it, so the first request usually doesn't pay for them and startup doesn't either
+    warm = asyncio.get_running_loop().run_in_executor(None, _warm_llms)
+    STARTUP["lifespan"] = time.perf_counter() - t0
+    try:
+        yield
+    finally:
+        await asyncio.gather(warm, return_exceptions=True)
+        await alert_engine.stop()
+        await meshy_jobs.stop()
+        model_cache.flush()
+        await close_llms()
+        cpu_pool.stop()
+        device_series.flush()
+        if insights_store is not None:
+            insights_store.close()
+        profiler.stop()
+
+
+app = FastAPI(title="VoltSpace AI Service", lifespan=lifespan)
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
 # Serve GLB with proper MIME and allow cross-origin from localhost
@@ -45,6 +151,8 @@ app.add_middleware(
     allow_methods=["GET", "POST"],
     allow_headers=["*"]
 )
+app.add_middleware(UploadLimitMiddleware, max_bytes=MESHY_MAX_UPLOAD_BYTES)
+app.add_middleware(MetricsMiddleware)
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Models
@@ -57,133 +165,224 @@ class Device(BaseModel):
     last_active: Optional[datetime] = None
 
 
-def hours_since(dt: Optional[datetime]) -> float:
-    """Return hours since dt; robust to naive/aware datetimes."""
-    if not dt:
-        return 0.0
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    now = datetime.now(timezone.utc)
-    return max(0.0, (now - dt).total_seconds() / 3600.0)
-
-
 # ──────────────────────────────────────────────────────────────────────────────
-# Insights endpoint (unchanged logic; small robustness in hours_since above)
+# Insights endpoint (rules live in rules.RULES; evaluated columnar, see rules.py)
+#
+# Request bodies are read raw and decoded by ingest.py straight into a
+# DeviceTable (no per-device Device models); the Device schema above only
+# documents the payload. Handlers are async to read the body, then do the
+# parsing and rule work on the threadpool like the sync endpoints.
 # ──────────────────────────────────────────────────────────────────────────────
-@app.post("/insights")
-def insights(devices: List[Device]):
-    out: List[Dict[str, Any]] = []
-    hour = datetime.now().hour
-    for d in devices:
-        t = (d.type or "").lower()
-        on = bool(d.state.get("on", False))
-        hrs = hours_since(d.last_active) if on else 0.0
-
-        if t == "light" and on and hrs > 8:
-            out.append({
-                "severity": "warn",
-                "title": f"Light on for {int(hrs)}h: {d.name}",
-                "detail": f"The light '{d.name}' appears to be on for over {int(hrs)} hours. Consider turning it off.",
-            })
+_DEVICE_SCHEMA = Device.model_json_schema()
+_DEVICES_BODY = {"requestBody": {"required": True, "content": {"application/json": {"schema": {
+    "type": "array", "items": _DEVICE_SCHEMA,
+}}}}}
+_GROUPS_BODY = {"requestBody": {"required": True, "content": {"application/json": {"schema": {
+    "type": "object", "required": ["groups"],
+    "properties": {"groups": {"type": "object", "additionalProperties": {"type": "array", "items": _DEVICE_SCHEMA}}},
+}}}}}
 
-        if t == "ac" and on and hrs > 6:
-            out.append({
-                "severity": "warn",
-                "title": f"AC running {int(hrs)}h: {d.name}",
-                "detail": f"'{d.name}' has been cooling for more than {int(hrs)} hours. Review setpoint or schedule.",
-            })
 
-        if t == "plug" and on and 0 <= hour <= 5 and d.power_w > 5:
-            out.append({
-                "severity": "info",
-                "title": f"Night-time load  on plug: {d.name}",
-                "detail": f"'{d.name}' is using ~{d.power_w}W overnight (00:00–05:00). Consider turning it off.",
-            })
+def _parse(parser: Any, body: bytes) -> Any:
+    try:
+        out = parser(body)
+    except ingest.IngestError as e:
+        raise RequestValidationError(e.errors)
+    mark_parsed()
+    return out
 
-        if t == "plug" and d.state.get("flexible"):
-            out.append({
-                "severity": "info",
-                "title": f"Shiftable load: {d.name}",
-                "detail": "This plug is marked flexible. Consider moving usage to 22:00–06:00 to save costs.",
-            })
 
-    return {"insights": out}
+# Large bodies are parsed and evaluated in a process pool instead (see offload.py)
+cpu_pool = offload.Offload(
+    workers=int(os.getenv("OFFLOAD_WORKERS", "0")),
+    min_bytes=int(float(os.getenv("OFFLOAD_MIN_KB", "256")) * 1024),
+)
+
+
+async def _run_cpu(local: Callable[[bytes], Any], pooled: Callable[[bytes], Any], body: bytes) -> Any:
+    if not cpu_pool.wants(len(body)):
+        return await run_in_threadpool(local, body)
+    try:
+        with stage("offload"):
+            return await cpu_pool.run(pooled, body)
+    except ingest.IngestError as e:
+        raise RequestValidationError(e.errors)
+
+
+def _insights(body: bytes) -> Dict[str, Any]:
+    _, table = _parse(ingest.parse_devices, body)
+    return {"insights": rule_insights(table)}
+
+
+@app.post("/insights", openapi_extra=_DEVICES_BODY)
+async def insights(request: Request):
+    return await _run_cpu(_insights, offload.insights, await request.body())
+
+
+def _insights_batch(body: bytes) -> Dict[str, Any]:
+    keys, table = _parse(ingest.parse_groups, body)
+    return {"results": grouped_insights(keys, table)}
+
+
+@app.post("/insights/batch", openapi_extra=_GROUPS_BODY)
+async def insights_batch(request: Request):
+    """Rule-based insights for many users/homes in one call (single columnar pass).
+
+    Body: {"groups": {key: [devices...]}}, keyed by whatever the caller groups
+    on, e.g. "user:12" or "home:3".
+    """
+    return await _run_cpu(_insights_batch, offload.insights_batch, await request.body())
+
+
+INSIGHTS_CACHE_HOURS_BUCKET = float(os.getenv("INSIGHTS_CACHE_HOURS_BUCKET", "1"))
+insights_cache = ResponseCache(
+    ttl_s=float(os.getenv("INSIGHTS_CACHE_TTL", "600")),
+    max_entries=int(os.getenv("INSIGHTS_CACHE_MAX", "1024")),
+    # On disk by default with several workers, so they share cached answers
+    disk_path=(DATA_DIR / "insights_cache.sqlite3") if os.getenv("INSIGHTS_CACHE_DISK", "1" if MULTI_WORKER else "0") == "1" else None,
+    max_disk_rows=int(os.environ["INSIGHTS_CACHE_DISK_MAX"]) if os.getenv("INSIGHTS_CACHE_DISK_MAX") else None,
+)
+
+
+@app.get("/insights_ai/cache")
+def insights_ai_cache_stats():
+    return insights_cache.stats()
 
 
 # AI-generated insights (uses OpenAI if key available) with padding to a minimum count
-@app.post("/insights_ai")
-def insights_ai(devices: List[Device]):
+@app.post("/insights_ai", openapi_extra=_DEVICES_BODY)
+async def insights_ai(request: Request):
+    return await run_in_threadpool(_insights_ai, await request.body())
+
+
+def _insights_ai(body: bytes) -> Dict[str, Any]:
+    rows, table = _parse(ingest.parse_devices, body)
+    return _generate_insights(rows, table)
+
+
+INSIGHTS_SYSTEM_PROMPT = (
+    "You are VoltSpace's energy analyst. Analyze the provided household devices and generate concise, actionable insights. "
+    "Always return JSON with a top-level key 'insights' containing an array of at least and no more than 3 to 5 items. Each item must have: severity in ['info','warn','critical'], title, detail. "
+    "Use fields like on, hours_on, power_w, hour_now, room/home, and attrs (e.g., brightness, setpoint, flexible) to decide. "
+    "Focus on: long-on lights (>8h), AC overuse (>6h), phantom loads at night (00:00-05:00), high draws, and shifting flexible plugs (22:00-06:00). "
+    "If nothing critical, include at least one 'info' tip (e.g., cost shifting)."
+)
+INSIGHTS_MULTI_PROMPT = INSIGHTS_SYSTEM_PROMPT + (
+    " You will receive several unrelated households, keyed by id (h0, h1, ...). Analyze each one on its own, never mixing devices across ids. "
+    "Return JSON {\"results\": {\"<id>\": {\"insights\": [...]}}} with exactly one entry per id, each following the rules above."
+)
+
+
+def _read_llm_json(resp: Any) -> Any:
+    text = (resp.choices[0].message.content or "").strip()
+    # Try reading as JSON; tolerate leading prose
+    try:
+        return json.loads(text)
+    except Exception:
+        start = text.find('{')
+        return json.loads(text[start:]) if start >= 0 else {}
+
+
+def _llm_insights(client: Any, compact: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """One chat completion for one fleet (the per-request path)."""
+    with stage("prompt"):
+        user = "Devices JSON:\n" + json.dumps(compact, ensure_ascii=False)
+    with stage("llm"):
+        resp = client.chat(
+            messages=[
+                {"role":"system","content":INSIGHTS_SYSTEM_PROMPT},
+                {"role":"user","content":user},
+            ],
+            temperature=0.2,
+            max_tokens=600,
+            timeout=30,
+        )
+    with stage("json_repair"):
+        data = _read_llm_json(resp)
+        return data.get("insights", []) if isinstance(data, dict) else []
+
+
+def _llm_insights_multi(client: Any, compacts: List[List[Dict[str, Any]]]) -> List[Optional[List[Dict[str, Any]]]]:
+    """One chat completion for several small fleets; None for any household the reply left out."""
+    ids = [f"h{k}" for k in range(len(compacts))]
+    with stage("prompt"):
+        user = "Households JSON:\n" + json.dumps(dict(zip(ids, compacts)), ensure_ascii=False)
+    with stage("llm"):
+        resp = client.chat(
+            messages=[
+                {"role":"system","content":INSIGHTS_MULTI_PROMPT},
+                {"role":"user","content":user},
+            ],
+            temperature=0.2,
+            max_tokens=min(4000, 600 * len(compacts)),
+            timeout=30,
+        )
+    with stage("json_repair"):
+        data = _read_llm_json(resp)
+    results = data.get("results") if isinstance(data, dict) else None
+    if not isinstance(results, dict):
+        return [None] * len(compacts)
+    out: List[Optional[List[Dict[str, Any]]]] = []
+    for i in ids:
+        section = results.get(i)
+        ins = section.get("insights") if isinstance(section, dict) else None
+        out.append(ins if isinstance(ins, list) and ins else None)
+    return out
+
+
+# Concurrent small-fleet requests share one completion; identical snapshots share one call (see llm_batcher.py)
+INSIGHTS_BATCH_WAIT_S = float(os.getenv("INSIGHTS_BATCH_WAIT_S", "35"))
+insights_batcher = InsightsBatcher(
+    single=_llm_insights,
+    multi=_llm_insights_multi,
+    window_s=float(os.getenv("INSIGHTS_BATCH_WINDOW_MS", "20")) / 1000.0,
+    max_batch=int(os.getenv("INSIGHTS_BATCH_MAX", "8")),
+    max_devices=int(os.getenv("INSIGHTS_BATCH_MAX_DEVICES", "40")),
+    workers=int(os.getenv("OPENAI_MAX_INFLIGHT", "8")),
+)
+
+
+def _generate_insights(rows: List[Dict[str, Any]], table: DeviceTable) -> Dict[str, Any]:
+    """LLM insights (cached), cleaned and padded to INSIGHTS_MIN; rule-based on any failure."""
     api_key = os.getenv("OPENAI_API_KEY")
     min_items = int(os.getenv("INSIGHTS_MIN", "3"))
     max_items = int(os.getenv("INSIGHTS_MAX", "5"))
 
     try:
         # Normalize input for prompt and for rule-based fallback
-        client = OpenAI(api_key=api_key) if api_key else None
-        model = os.getenv("OPENAI_INSIGHTS_MODEL", os.getenv("OPENAI_MODEL", "gpt-4o-mini"))
-        compact: List[Dict[str, Any]] = []
-        for raw in devices:  # tolerate both Pydantic and raw dicts
-            if isinstance(raw, dict):
-                st = raw.get('state') or {}
-                entry = {
-                    'name': raw.get('name'),
-                    'type': raw.get('type'),
-                    'home': raw.get('home'),
-                    'room': raw.get('room'),
-                    'on': bool(raw.get('on', st.get('on', False))),
-                    'power_w': int(raw.get('power_w') or 0),
-                    'hours_on': float(raw.get('hours_on') or 0.0),
-                    'last_active': raw.get('last_active'),
-                    'hour_now': raw.get('hour_now'),
-                    'attrs': {k: v for k, v in (st.items() if isinstance(st, dict) else []) if k != 'on'},
-                }
-            else:
-                d = raw  # Device
-                st = d.state or {}
-                entry = {
-                    'name': d.name,
-                    'type': d.type,
-                    'on': bool(st.get('on', False)),
-                    'power_w': d.power_w,
-                    'last_active': d.last_active.isoformat() if isinstance(d.last_active, datetime) else (str(d.last_active) if d.last_active else None),
-                    'attrs': {k: v for k, v in st.items() if k != 'on'},
-                }
-            compact.append(entry)
+        client = get_llm(api_key, insights_model()) if api_key else None
+        with stage("build_compact"):
+            compact = ingest.compact(rows)
+
+        # Unchanged snapshot (hours_on bucketed) → reuse the previous LLM answer
+        cache_key = None
+        if client is not None:
+            cache_key = snapshot_key(
+                compact, INSIGHTS_CACHE_HOURS_BUCKET,
+                model=client.model, hour=datetime.now().hour, min_items=min_items, max_items=max_items,
+            )
+            with stage("cache_lookup"):
+                cached = insights_cache.get(cache_key)
+            registry.inc("voltspace_cache_lookups_total", cache="insights_ai", result="miss" if cached is None else "hit")
+            if cached is not None:
+                return cached
 
         # Start with LLM insights if key is available; otherwise start with rule-based
         ins: List[Dict[str, Any]] = []
         if client is not None:
-            system = (
-                "You are VoltSpace's energy analyst. Analyze the provided household devices and generate concise, actionable insights. "
-                "Always return JSON with a top-level key 'insights' containing an array of at least and no more than 3 to 5 items. Each item must have: severity in ['info','warn','critical'], title, detail. "
-                "Use fields like on, hours_on, power_w, hour_now, room/home, and attrs (e.g., brightness, setpoint, flexible) to decide. "
-                "Focus on: long-on lights (>8h), AC overuse (>6h), phantom loads at night (00:00-05:00), high draws, and shifting flexible plugs (22:00-06:00). "
-                "If nothing critical, include at least one 'info' tip (e.g., cost shifting)."
-            )
-            import json
-            user = "Devices JSON:\n" + json.dumps(compact, ensure_ascii=False)
-            resp = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role":"system","content":system},
-                    {"role":"user","content":user},
-                ],
-                temperature=0.2,
-                max_tokens=600,
-                timeout=30,
-            )
-            text = (resp.choices[0].message.content or "").strip()
-            # Try reading as JSON; tolerate leading prose
-            try:
-                data = json.loads(text)
-            except Exception:
-                start = text.find('{')
-                data = json.loads(text[start:]) if start >= 0 else {"insights": []}
-            ins = data.get("insights", []) if isinstance(data, dict) else []
+            with stage("llm_batch"):
+                batched = insights_batcher.submit(client, cache_key, compact, timeout=INSIGHTS_BATCH_WAIT_S)
+            if batched is None:
+                # The upstream call is still running; don't start another, and don't cache the rules' answer
+                registry.inc("voltspace_insights_fallback_total", reason="timeout")
+                cache_key = None
+                ins = rule_insights(table)
+            else:
+                ins = batched
         else:
             # No API key: fall back to rule-based directly
-            rule_based = insights(devices)
-            ins = rule_based.get("insights", []) if isinstance(rule_based, dict) else []
+            registry.inc("voltspace_insights_fallback_total", reason="no_key")
+            ins = rule_insights(table)
 
         # Clean and normalize
         cleaned: List[Dict[str, Any]] = []
@@ -196,45 +395,87 @@ def insights_ai(devices: List[Device]):
                 "detail": i.get("detail",""),
             })
 
-        # If fewer than min_items, pad using rule-based suggestions, then generic tips
-        if len(cleaned) < min_items:
-            rb = insights(devices)
-            rb_list = rb.get("insights", []) if isinstance(rb, dict) else []
-            for i in rb_list:
-                if len(cleaned) >= min_items:
-                    break
-                title = (i.get("title","Insight") or "Insight")[:128]
-                if any(c.get("title") == title for c in cleaned):
-                    continue
-                sev = (i.get("severity") or "info").lower()
-                if sev not in ("info","warn","critical"): sev = "info"
-                cleaned.append({
-                    "severity": sev,
-                    "title": title,
-                    "detail": i.get("detail",""),
-                })
-
-        if len(cleaned) < min_items:
-            # As a final fallback, add generic but varied tips
-            tips = [
-                {"severity":"info","title":"Shift flexible loads to off-peak","detail":"Move usage for flexible plugs to 22:00–06:00 to reduce costs."},
-                {"severity":"info","title":"Review long-on devices","detail":"Look for lights or AC units running >6–8 hours and turn off or adjust schedules."},
-                {"severity":"info","title":"Check phantom loads at night","detail":"Low-use devices drawing power overnight can add up; consider switching off."},
-                {"severity":"info","title":"Calibrate AC setpoints","detail":"A 1–2°C increase can significantly cut cooling energy while maintaining comfort."},
-            ]
-            for tip in tips:
-                if len(cleaned) >= min_items:
-                    break
-                if any(c.get("title") == tip["title"] for c in cleaned):
-                    continue
-                cleaned.append(tip)
+        with stage("pad"):
+            # If fewer than min_items, pad using rule-based suggestions, then generic tips
+            if len(cleaned) < min_items:
+                registry.inc("voltspace_insights_fallback_total", reason="padded")
+                for i in rule_insights(table):
+                    if len(cleaned) >= min_items:
+                        break
+                    title = (i.get("title","Insight") or "Insight")[:128]
+                    if any(c.get("title") == title for c in cleaned):
+                        continue
+                    sev = (i.get("severity") or "info").lower()
+                    if sev not in ("info","warn","critical"): sev = "info"
+                    cleaned.append({
+                        "severity": sev,
+                        "title": title,
+                        "detail": i.get("detail",""),
+                    })
+
+            if len(cleaned) < min_items:
+                # As a final fallback, add generic but varied tips
+                tips = [
+                    {"severity":"info","title":"Shift flexible loads to off-peak","detail":"Move usage for flexible plugs to 22:00–06:00 to reduce costs."},
+                    {"severity":"info","title":"Review long-on devices","detail":"Look for lights or AC units running >6–8 hours and turn off or adjust schedules."},
+                    {"severity":"info","title":"Check phantom loads at night","detail":"Low-use devices drawing power overnight can add up; consider switching off."},
+                    {"severity":"info","title":"Calibrate AC setpoints","detail":"A 1–2°C increase can significantly cut cooling energy while maintaining comfort."},
+                ]
+                for tip in tips:
+                    if len(cleaned) >= min_items:
+                        break
+                    if any(c.get("title") == tip["title"] for c in cleaned):
+                        continue
+                    cleaned.append(tip)
 
         # Cap to max_items
-        return {"insights": cleaned[:max_items]}
+        result = {"insights": cleaned[:max_items]}
+        if cache_key is not None:
+            insights_cache.set(cache_key, result)
+        return result
 
     except Exception:
         # On error, fall back
-        return insights(devices)
+        registry.inc("voltspace_insights_fallback_total", reason="error")
+        return {"insights": rule_insights(table)}
+
+
+# Generate + store in one call for run_insights.php (see insights_store.py)
+insights_store = InsightsStore(os.environ["INSIGHTS_DB_URL"], int(os.getenv("INSIGHTS_DB_POOL", "4"))) if os.getenv("INSIGHTS_DB_URL") else None
+NO_ISSUES_TIP = {
+    "severity": "info",
+    "title": "No critical issues detected",
+    "detail": "Try turning off long-on lights, reviewing AC setpoints (>6h), and shifting flexible plugs to 22:00–06:00.",
+}
+
+
+def _parse_run(body: bytes) -> Any:
+    data = ingest.load(body)
+    user_id = data.get("user_id") if isinstance(data, dict) else None
+    if not isinstance(user_id, int) or isinstance(user_id, bool):
+        raise ingest.IngestError([{"type": "int_type", "loc": ["body", "user_id"], "msg": "Input should be a valid integer", "input": user_id}])
+    rows = data.get("devices")
+    return user_id, rows, ingest.read_devices(rows, loc=("body", "devices"))
+
+
+def _insights_run(body: bytes) -> Dict[str, Any]:
+    user_id, rows, table = _parse(_parse_run, body)
+    if insights_store is None:
+        raise HTTPException(503, "INSIGHTS_DB_URL is not configured")
+    result = _generate_insights(rows, table)
+    items = result.get("insights") or rule_insights(table) or [NO_ISSUES_TIP]
+    with stage("store"):
+        count = insights_store.insert_many(user_id, items)
+    return {"ok": True, "count": count, "insights": items}
+
+
+@app.post("/insights/run", openapi_extra={"requestBody": {"required": True, "content": {"application/json": {"schema": {
+    "type": "object", "required": ["user_id", "devices"],
+    "properties": {"user_id": {"type": "integer"}, "devices": {"type": "array", "items": _DEVICE_SCHEMA}},
+}}}}})
+async def insights_run(request: Request):
+    """Generate a user's insights (AI, rule fallback, padding) and save them to the insights table."""
+    return await run_in_threadpool(_insights_run, await request.body())
 
 
 # ──────────────────────────────────────────────────────────────────────────────
@@ -246,33 +487,69 @@ class AgentQuery(BaseModel):
     user_id: Optional[int] = None
 
 
+# Per-user summaries (seeded by PHP, kept current by /events/device); see context_index.py
+AGENT_CONTEXT_TOKENS = int(os.getenv("AGENT_CONTEXT_TOKENS", "1200"))
+context_index = ContextIndex(
+    DATA_DIR / "agent_context.sqlite3",
+    kwh_source=lambda ids, now: energy_ledger.device_kwh(ids, now),
+)
+
+
+def _agent_context(q: AgentQuery) -> Optional[str]:
+    """The question-relevant slice of the user's context, within AGENT_CONTEXT_TOKENS."""
+    with stage("context"):
+        if q.user_id is not None:
+            if isinstance(q.context, dict):
+                context_index.seed(q.user_id, q.context)
+            ctx = context_index.build(q.user_id, q.question, AGENT_CONTEXT_TOKENS)
+            if ctx is not None:
+                return ctx
+        if isinstance(q.context, dict):
+            return render_context(snippets(doc_from_context(q.context)), q.question, AGENT_CONTEXT_TOKENS)
+        if q.context is not None:
+            return str(q.context)[:AGENT_CONTEXT_TOKENS * 4]
+        return None
+
+
+def _agent_messages(q: AgentQuery) -> List[Dict[str, str]]:
+    messages = [
+        {"role": "system", "content": "You are VoltSpace's home energy assistant. Be concise and actionable."}
+    ]
+    ctx = _agent_context(q)
+    if ctx:
+        messages.append({"role": "system", "content": "Context from database (summary of the user's home):\n" + ctx})
+    messages.append({"role": "user", "content": q.question.strip()})
+    return messages
+
+
+def _agent_no_key_answer(q: AgentQuery) -> str:
+    hint = " with context" if q.context or (q.user_id is not None and context_index.has(q.user_id)) else ""
+    return f"[Local demo] No OpenAI key set. Try using Dashboard & Insights; consider turning off long-running devices and shifting flexible loads{hint}."
+
+
+def _agent_error_answer(e: Exception) -> str:
+    # Fine-grained exceptions vary; keep user-friendly messages:
+    msg = str(e)
+    if "authentication" in msg.lower() or "auth" in msg.lower():
+        return "OpenAI authentication failed. Check OPENAI_API_KEY."
+    if "rate" in msg.lower() and "limit" in msg.lower():
+        return "OpenAI rate limit exceeded. Try again later."
+    if "timeout" in msg.lower() or "network" in msg.lower() or "connect" in msg.lower():
+        return "Network error reaching OpenAI. Check internet/proxy and try again."
+    return f"Assistant error: {msg}"
+
+
 @app.post("/agent")
 def agent(q: AgentQuery):
+    mark_parsed()
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
-        hint = " with context" if q.context else ""
-        return {"answer": f"[Local demo] No OpenAI key set. Try using Dashboard & Insights; consider turning off long-running devices and shifting flexible loads{hint}."}
-
-    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+        return {"answer": _agent_no_key_answer(q)}
 
     try:
-        client = OpenAI(api_key=api_key)
-        messages = [
-            {"role": "system", "content": "You are VoltSpace's home energy assistant. Be concise and actionable."}
-        ]
-        # Inject database context if provided by PHP
-        if q.context is not None:
-            try:
-                import json
-                ctx = q.context if isinstance(q.context, str) else json.dumps(q.context, ensure_ascii=False)
-            except Exception:
-                ctx = str(q.context)
-            messages.append({"role": "system", "content": "Context from database (JSON/text):\n" + (ctx[:6000] if isinstance(ctx, str) else str(ctx))})
-        messages.append({"role": "user", "content": q.question.strip()})
-
-        resp = client.chat.completions.create(
-            model=model,
-            messages=messages,
+        client = get_llm(api_key, agent_model())
+        resp = client.chat(
+            messages=_agent_messages(q),
             temperature=0.2,
             max_tokens=200,
             # OpenAI 1.x uses request timeouts via client config; this param is accepted by HTTPX under the hood.
@@ -280,176 +557,353 @@ def agent(q: AgentQuery):
         )
         answer = (resp.choices[0].message.content or "").strip()
         return {"answer": answer or "No answer."}
+    except Exception as e:
+        return {"answer": _agent_error_answer(e)}
 
-    # Fine-grained exceptions vary; keep user-friendly messages:
+
+def _sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/agent/stream")
+async def agent_stream(q: AgentQuery):
+    """Same as /agent, streamed as Server-Sent Events.
+
+    Emits `data: {"delta": "..."}` chunks as tokens arrive, then a final
+    `event: done` carrying the full `answer`. Errors are reported as a delta
+    with the same friendly text /agent would return.
+    """
+    mark_parsed()
+    api_key = os.getenv("OPENAI_API_KEY")
+    # Context lookups hit SQLite, so build the prompt in the threadpool before streaming starts
+    messages: Optional[List[Dict[str, str]]] = None
+    no_key = ""
+    failed: Optional[Exception] = None
+    try:
+        if api_key:
+            messages = await run_in_threadpool(_agent_messages, q)
+        else:
+            no_key = await run_in_threadpool(_agent_no_key_answer, q)
     except Exception as e:
-        # Common helpful messages:
-        msg = str(e)
-        if "authentication" in msg.lower() or "auth" in msg.lower():
-            return {"answer": "OpenAI authentication failed. Check OPENAI_API_KEY."}
-        if "rate" in msg.lower() and "limit" in msg.lower():
-            return {"answer": "OpenAI rate limit exceeded. Try again later."}
-        if "timeout" in msg.lower() or "network" in msg.lower() or "connect" in msg.lower():
-            return {"answer": "Network error reaching OpenAI. Check internet/proxy and try again."}
-        return {"answer": f"Assistant error: {msg}"}
+        failed = e
+
+    async def events() -> AsyncIterator[str]:
+        if not api_key:
+            answer = no_key if failed is None else _agent_error_answer(failed)
+            yield _sse({"delta": answer})
+            yield _sse({"answer": answer}, event="done")
+            return
+
+        parts: List[str] = []
+        try:
+            if failed is not None:
+                raise failed
+            client = get_llm(api_key, agent_model())
+            async for delta in client.stream_chat(messages=messages, temperature=0.2, max_tokens=200, timeout=30):
+                parts.append(delta)
+                yield _sse({"delta": delta})
+        except Exception as e:
+            msg = _agent_error_answer(e)
+            parts = [msg] if not parts else parts + ["\n" + msg]
+            yield _sse({"delta": parts[-1]})
+        answer = "".join(parts).strip()
+        yield _sse({"answer": answer or "No answer."}, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/agent/context/{user_id}")
+def agent_context(user_id: int, q: str = ""):
+    """The context /agent would send for this user and question (for tuning the budget)."""
+    ctx = context_index.build(user_id, q, AGENT_CONTEXT_TOKENS)
+    if ctx is None:
+        raise HTTPException(404, "No context for this user yet")
+    return {"user_id": user_id, "context": ctx, "approx_tokens": approx_tokens(ctx), "budget": AGENT_CONTEXT_TOKENS}
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Device events (posted by toggle_device.php) and energy accounting
+# ──────────────────────────────────────────────────────────────────────────────
+ENERGY_DB = DATA_DIR / "energy.sqlite3"
+energy_ledger = EnergyLedger(ENERGY_DB)
+
+# Per-device run history in memory-mapped arrays, for /anomalies (see anomalies.py)
+device_series = DeviceSeries(
+    DATA_DIR / "series",
+    history=int(os.getenv("ANOMALY_HISTORY", "128")),
+    half_life_days=float(os.getenv("ANOMALY_HALF_LIFE_DAYS", "14")),
+)
+
+
+class DeviceEvent(BaseModel):
+    device_id: int
+    home_id: int
+    user_id: Optional[int] = None
+    on: bool
+    power_w: float = 0          # draw while on, as computed by the PHP app
+    ts: Optional[float] = None  # unix seconds; defaults to now
+    log_id: Optional[int] = None  # device_logs.id, makes replays idempotent
+    name: Optional[str] = None
+    type: Optional[str] = None
+    state: Optional[Dict[str, Any]] = None   # device state after the change (rule flags such as 'flexible')
+
+
+@app.post("/events/device")
+def device_event(ev: DeviceEvent):
+    applied = energy_ledger.apply(ev.device_id, ev.home_id, ev.on, ev.power_w, ev.ts, ev.log_id)
+    alerts: List[Dict[str, Any]] = []
+    if applied:
+        device_series.event(ev.device_id, ev.home_id, ev.on, ev.ts, ev.log_id, ev.type, ev.name)
+        if ev.user_id is not None:
+            context_index.device_event(ev.user_id, ev.device_id, ev.on, ev.power_w, ev.ts, ev.name, ev.type)
+        alerts = alert_engine.device_event(ev.device_id, ev.home_id, ev.user_id, ev.on, ev.power_w, ev.ts, ev.name, ev.type, ev.state)
+    return {"ok": True, "applied": applied, "alerts": alerts}
+
+
+# Rules re-checked per event, with timers for threshold crossings (see alerts.py)
+alert_engine = AlertEngine(DATA_DIR / "alerts.sqlite3")
+
+
+@app.get("/alerts")
+def list_alerts(user_id: int, after: int = 0, undelivered: bool = False, limit: int = 50):
+    return {"alerts": alert_engine.for_user(user_id, after=after, undelivered=undelivered, limit=min(max(limit, 1), 500))}
+
+
+class AlertAck(BaseModel):
+    user_id: int
+    ids: List[int]
+
+
+@app.post("/alerts/ack")
+def ack_alerts(a: AlertAck):
+    return {"ok": True, "acked": alert_engine.ack(a.user_id, a.ids)}
+
+
+class EnergyBackfill(BaseModel):
+    home_id: int
+    devices: Dict[int, float]       # device_id -> draw while on (W)
+    logs: List[Dict[str, Any]]      # {id, device_id, ts, to}
+    types: Dict[int, str] = Field(default_factory=dict)   # device_id -> type, for anomaly baselines
+
+
+@app.post("/energy/backfill")
+async def energy_backfill(b: EnergyBackfill):
+    """Replay a home's device_logs once; later toggles arrive through /events/device."""
+    if cpu_pool.enabled:
+        with stage("offload"):
+            applied = await cpu_pool.run(offload.energy_backfill, str(ENERGY_DB), b.home_id, b.devices, b.logs)
+    else:
+        applied = await run_in_threadpool(energy_ledger.backfill, b.home_id, b.devices, b.logs)
+    await run_in_threadpool(device_series.backfill, b.home_id, b.types, b.logs, b.devices.keys())
+    return {"ok": True, "applied": applied}
+
+
+@app.get("/energy/report")
+def energy_report(home_ids: str):
+    """Precomputed kWh today / month / year for comma-separated home ids."""
+    ids = [int(x) for x in home_ids.split(",") if x.strip().isdigit()]
+    return {"homes": energy_ledger.report(ids)}
+
+
+@app.get("/energy/series/{home_id}")
+def energy_series(home_id: int, period: str = "hour", start: str = "", end: str = "~"):
+    if period not in ("hour", "day", "month"):
+        raise HTTPException(400, "period must be hour, day or month")
+    return {"home_id": home_id, "period": period, "buckets": energy_ledger.series(home_id, period, start, end)}
+
+
+@app.get("/anomalies")
+def anomalies(home_ids: str = ""):
+    """Devices deviating from their own (or their type's) usual runs, for comma-separated home ids or the whole fleet."""
+    ids = [int(x) for x in home_ids.split(",") if x.strip().isdigit()] if home_ids else None
+    with stage("anomalies"):
+        return {"anomalies": device_series.detect(ids)}
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Time-of-use load shifting for flexible plugs (see loadshift.py)
+# ──────────────────────────────────────────────────────────────────────────────
+class FlexLoad(BaseModel):
+    id: Optional[int] = None
+    name: Optional[str] = None
+    power_w: float = Field(gt=0)
+    hours: float = Field(gt=0)                   # run time, rounded up to whole slots
+    ready_in_h: Optional[float] = None           # earliest start, hours from now
+    done_within_h: Optional[float] = None        # must finish by, hours from now
+
+
+class HomeShift(BaseModel):
+    home_id: int
+    price_cents_per_kwh: float = Field(ge=0)     # homes.energy_price_cents_per_kwh
+    overrides: Dict[int, float] = Field(default_factory=dict)   # hour of day (0-23) -> cents/kWh
+    peak_w: Optional[float] = Field(default=None, gt=0)
+    base_w: Union[float, List[float]] = 0.0     # other household draw, flat or one value per slot
+    loads: List[FlexLoad] = Field(default_factory=list)
+
+
+class ShiftRequest(BaseModel):
+    homes: List[HomeShift]
+    tariff: Dict[int, float] = Field(default_factory=dict)      # hourly overrides for every home; a home's own win
+    horizon_h: int = Field(default=24, ge=1, le=168)
+    slot_minutes: int = 60
+    start: Optional[datetime] = None             # local time; defaults to now, rounded up to a slot boundary
+
+
+@app.post("/loadshift")
+def load_shift(req: ShiftRequest):
+    """Cheapest start times for flexible loads under each home's peak cap."""
+    hours = set(req.tariff).union(*(h.overrides for h in req.homes))
+    if any(not 0 <= h <= 23 for h in hours):
+        raise HTTPException(400, "tariff hours must be 0-23")
+    homes = [h.model_dump() for h in req.homes]
+    try:
+        with stage("loadshift"):
+            return loadshift.plan(homes, req.tariff, req.start, req.horizon_h, req.slot_minutes)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
 
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Meshy image → 3D (v1 JSON API + data URI; downloads GLB locally)
+# All handlers are async and the long-running part lives in meshy_jobs, so a
+# pending conversion never holds a threadpool worker.
 # ──────────────────────────────────────────────────────────────────────────────
-@app.post("/meshify")
-def meshify(image: UploadFile = File(...), hint: str = Form("smart home floor plan")):
-    """Convert a 2D floor plan image to 3D via Meshy and serve a local GLB URL."""
-    meshy_key = os.getenv("MESHY_API_KEY")
-    if not meshy_key:
+async def _save_upload(image: UploadFile) -> tuple[Path, str, str]:
+    """Store the upload under its content key (streamed, see uploads.py); returns (path, mime, key)."""
+    if not os.getenv("MESHY_API_KEY"):
         raise HTTPException(status_code=500, detail="MESHY_API_KEY not set in ai-service/.env")
-
     if image.content_type not in ("image/png", "image/jpeg"):
         raise HTTPException(status_code=400, detail="Only PNG or JPG images are supported")
 
-    # Save locally (optional)
-    tmp_path = UPLOAD_DIR / f"{int(time.time()*1000)}_{image.filename}"
-    with tmp_path.open("wb") as f:
-        f.write(image.file.read())
-
-    # Build data URI for Meshy JSON API
-    mime = image.content_type or mimetypes.guess_type(tmp_path.name)[0] or "image/png"
-    b64 = base64.b64encode(tmp_path.read_bytes()).decode("ascii")
-    data_uri = f"data:{mime};base64,{b64}"
-
-    # Submit task (JSON, not multipart)
-    headers = {
-        "Authorization": f"Bearer {meshy_key}",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "image_url": data_uri,      # v1 API expects a URL or data URI
-        "should_texture": True,
-        "should_remesh": True,
-        "enable_pbr": True,
-        # Optional: "subject": hint,
-        # Optional: "background": "transparent",
-    }
-
-    resp = requests.post(
-        "https://api.meshy.ai/openapi/v1/image-to-3d",
-        headers=headers,
-        json=payload,
-        timeout=60,
-    )
-    if resp.status_code >= 300:
-        raise HTTPException(status_code=resp.status_code, detail=f"Meshy submit failed: {resp.text}")
-
-    task_id = (resp.json() or {}).get("result")
-    if not task_id:
-        raise HTTPException(status_code=500, detail="Meshy did not return a task id")
-
-    # Poll task until complete (~7 minutes)
-    deadline = time.time() + 420
-    model_remote_url = None
-    status = None
-    last_payload = None
-
-    while time.time() < deadline:
-        pr = requests.get(
-            f"https://api.meshy.ai/openapi/v1/image-to-3d/{task_id}",
-            headers={"Authorization": f"Bearer {meshy_key}"},
-            timeout=30,
-        )
-        if pr.status_code >= 300:
-            raise HTTPException(status_code=pr.status_code, detail=f"Meshy task status failed: {pr.text}")
+    mime = image.content_type or mimetypes.guess_type(image.filename or "")[0] or "image/png"
+    with stage("upload"):
+        tmp_path, key, fresh = await save_upload(image, UPLOAD_DIR, MESHY_OPTIONS, MESHY_MAX_UPLOAD_BYTES)
+    if fresh:
+        with stage("shrink"):
+            await run_in_threadpool(shrink_image, tmp_path, mime, MESHY_MAX_IMAGE_PX, MESHY_TARGET_BYTES)
+    return tmp_path, mime, key
 
-        tj = pr.json()
-        last_payload = tj
-        status = (tj.get("status") or "").upper()
 
-        model_urls = tj.get("model_urls") or {}
-        model_remote_url = model_urls.get("glb")
+def _cached_model(key: str) -> Optional[str]:
+    cached = model_cache.lookup(key)
+    registry.inc("voltspace_cache_lookups_total", cache="models", result="hit" if cached else "miss")
+    return cached
 
-        if status in ("SUCCEEDED", "COMPLETED", "DONE") and model_remote_url:
-            break
-        if status in ("FAILED", "ERROR", "CANCELED"):
-            raise HTTPException(status_code=500, detail=f"Meshy task failed: {tj}")
 
-        time.sleep(3)
+@app.post("/meshify")
+async def meshify(image: UploadFile = File(...), hint: str = Form("smart home floor plan")):
+    """Convert a 2D floor plan image to 3D via Meshy and serve a local GLB URL."""
+    tmp_path, mime, key = await _save_upload(image)
+    cached = _cached_model(key)
+    if cached:
+        return {"model_url": model_url_for(cached), "cached": True}
+    job = meshy_jobs.enqueue(tmp_path, mime, hint, key=key)
+    try:
+        job = await meshy_jobs.wait(job.id, timeout=MESHY_DEADLINE_S + 60)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"Meshy task timed out; job {job.id} is still running")
+    if job.status != "succeeded":
+        raise HTTPException(status_code=504 if "timed out" in (job.error or "") else 500, detail=job.error)
+    return {"model_url": job.model_url, "job_id": job.id}
 
-    if not (status and model_remote_url):
-        raise HTTPException(
-            status_code=504,
-            detail=f"Meshy task timed out; last status: {status}, payload: {last_payload}",
-        )
 
-    # Download GLB locally so it’s served from FastAPI’s static dir
-    dl = requests.get(model_remote_url, stream=True, timeout=180)
-    if dl.status_code >= 300:
-        raise HTTPException(status_code=dl.status_code, detail=f"Failed to download GLB: {dl.text}")
+@app.post("/meshify/jobs", status_code=202)
+async def meshify_jobs_create(image: UploadFile = File(...), hint: str = Form("smart home floor plan")):
+    """Queue a conversion and return immediately; poll /meshify/jobs/{id} for the result."""
+    tmp_path, mime, key = await _save_upload(image)
+    cached = _cached_model(key)
+    if cached:
+        return {"job_id": None, "status": "succeeded", "model_url": model_url_for(cached), "cached": True}
+    job = meshy_jobs.enqueue(tmp_path, mime, hint, key=key)
+    return {"job_id": job.id, "status": job.status, "status_url": f"/meshify/jobs/{job.id}"}
+
 
-    glb_path = MODELS_DIR / f"{task_id}.glb"
-    with glb_path.open("wb") as f:
-        for chunk in dl.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
+@app.get("/meshify/jobs/{job_id}")
+def meshify_job(job_id: str):
+    job = meshy_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Unknown job")
+    return job.public()
 
-    return {"model_url": f"http://127.0.0.1:8000/static/models/{task_id}.glb"}
 
 @app.post("/meshify/submit")
-def meshify_submit(image: UploadFile = File(...), hint: str = Form("smart home floor plan")):
-    import base64, mimetypes, requests, os, time
-    from fastapi import HTTPException
-
-    meshy_key = os.getenv("MESHY_API_KEY")
-    if not meshy_key:
-        raise HTTPException(500, "MESHY_API_KEY not set")
-
-    if image.content_type not in ("image/png","image/jpeg"):
-        raise HTTPException(400, "Only PNG/JPG supported")
-
-    # save + data URI
-    tmp_path = UPLOAD_DIR / f"{int(time.time()*1000)}_{image.filename}"
-    tmp_path.write_bytes(image.file.read())
-    
-    mime = image.content_type or mimetypes.guess_type(tmp_path.name)[0] or "image/png"
-    data_uri = f"data:{mime};base64,{base64.b64encode(tmp_path.read_bytes()).decode('ascii')}"
-
-    headers = {"Authorization": f"Bearer {meshy_key}", "Content-Type": "application/json"}
-    payload = {
-        "image_url": data_uri,
-        "should_texture": True,
-        "should_remesh": True,
-        "enable_pbr": True,
-    }
-    r = requests.post("https://api.meshy.ai/openapi/v1/image-to-3d", headers=headers, json=payload, timeout=60)
-    if r.status_code >= 300:
-        raise HTTPException(r.status_code, f"Meshy submit failed: {r.text}")
-    task_id = (r.json() or {}).get("result")
-    if not task_id:
-        raise HTTPException(500, f"No task id. Raw: {r.text}")
+async def meshify_submit(image: UploadFile = File(...), hint: str = Form("smart home floor plan")):
+    tmp_path, mime, _ = await _save_upload(image)
+    task_id = await submit_task(meshy_jobs.client, tmp_path, mime)
     return {"task_id": task_id}
 
 # -- Check status (raw passthrough)
 @app.get("/meshify/status/{task_id}")
-def meshify_status(task_id: str):
-    import requests, os
-    meshy_key = os.getenv("MESHY_API_KEY") or ""
-    r = requests.get(f"https://api.meshy.ai/openapi/v1/image-to-3d/{task_id}",
-                     headers={"Authorization": f"Bearer {meshy_key}"}, timeout=30)
+async def meshify_status(task_id: str):
+    r = await get_task(meshy_jobs.client, task_id)
     return {"code": r.status_code, "json": (r.json() if r.headers.get("content-type","").startswith("application/json") else r.text)}
 
 # -- Download the GLB when ready
 @app.post("/meshify/fetch_glb/{task_id}")
-def meshify_fetch_glb(task_id: str):
-    import requests, os, time
-    r = requests.get(f"https://api.meshy.ai/openapi/v1/image-to-3d/{task_id}",
-                     headers={"Authorization": f"Bearer {os.getenv('MESHY_API_KEY') or ''}"}, timeout=30)
+async def meshify_fetch_glb(task_id: str):
+    r = await get_task(meshy_jobs.client, task_id)
     j = r.json()
     model_url = (j.get("model_urls") or {}).get("glb")
     if not model_url:
         raise HTTPException(404, f"No GLB in payload: {j}")
-    dl = requests.get(model_url, stream=True, timeout=180)
-    if dl.status_code >= 300:
-        raise HTTPException(dl.status_code, f"GLB download failed: {dl.text}")
-    glb_path = MODELS_DIR / f"{task_id}.glb"
-    with glb_path.open("wb") as f:
-        for c in dl.iter_content(8192):
-            if c: f.write(c)
-    return {"model_url": f"http://127.0.0.1:8000/static/models/{task_id}.glb"}
+    await download_glb(meshy_jobs.client, model_url, MODELS_DIR / f"{task_id}.glb")
+    return {"model_url": model_url_for(f"{task_id}.glb")}
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Metrics and profiling
+# ──────────────────────────────────────────────────────────────────────────────
+def _runtime_gauges():
+    st = insights_cache.stats()
+    yield "voltspace_insights_cache_entries", "gauge", {}, st["size"]
+    queue = meshy_jobs._queue
+    yield "voltspace_meshy_queue_depth", "gauge", {}, queue.qsize() if queue is not None else 0
+    counts: Dict[str, int] = {}
+    for job in list(meshy_jobs.jobs.values()):
+        counts[job.status] = counts.get(job.status, 0) + 1
+    for status, n in counts.items():
+        yield "voltspace_meshy_jobs", "gauge", {"status": status}, n
+    yield "voltspace_profiler_enabled", "gauge", {}, 1 if profiler.enabled else 0
+    yield "voltspace_alert_timers", "gauge", {}, alert_engine.pending_timers()
+    yield "voltspace_workers", "gauge", {}, WORKERS
+    for phase, seconds in STARTUP.items():
+        yield "voltspace_startup_seconds", "gauge", {"phase": phase}, round(seconds, 4)
+
+
+registry.collector(_runtime_gauges)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus text exposition of request, stage, upstream and cache metrics."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+LOOPBACK = ("127.0.0.1", "::1", "localhost")
+
+
+@app.post("/debug/profiler")
+def debug_profiler(request: Request, enabled: bool, slow_ms: Optional[float] = None):
+    """Turn the sampling profiler on/off; slow requests then dump folded stacks to PROFILE_DIR.
+
+    Only for local callers, or ones sending X-Debug-Token equal to PROFILE_TOKEN.
+    """
+    token = os.getenv("PROFILE_TOKEN", "")
+    local = request.client is not None and request.client.host in LOOPBACK
+    if not local and not (token and hmac.compare_digest(request.headers.get("x-debug-token", ""), token)):
+        raise HTTPException(403, "profiler control is limited to local callers")
+    if slow_ms is not None:
+        profiler.slow_s = max(0.0, slow_ms) / 1000.0
+    if enabled:
+        profiler.start()
+    else:
+        profiler.stop()
+    return {"enabled": profiler.enabled, "slow_ms": profiler.slow_s * 1000.0, "dir": str(profiler.out_dir)}
+
+
+STARTUP["import"] = time.perf_counter() - _IMPORT_T0
@@ -0,0 +1,451 @@
+"""Async Meshy image → 3D pipeline.
+
+The submit / status / fetch_glb steps are plain coroutines over a shared
+httpx.AsyncClient, and MeshyJobManager strings them together in the
+background: uploads go into a bounded queue, a few submitter tasks hand them
+to Meshy, and a small pool of pollers checks every pending task with
+backoff until the GLB can be downloaded. Job state is written to a JSON file
+so finished (and in-flight) jobs survive a restart. Writes happen when a job
+changes state or progress, from a background thread, and several changes
+in a row are written once. Finished jobs are kept for `keep_age_s`, and
+only the newest `keep_finished` of them. Jobs carrying a content key are
+coalesced while in flight and recorded in the ModelCache when done.
+
+With several workers (serve.py) the job file is shared. Each worker runs the
+jobs it queued and merges its writes with the others' under a file lock.
+Lookups for jobs owned by another worker re-read the file, and only one
+worker resumes unfinished jobs after a restart.
+"""
+import asyncio
+import base64
+import json
+import os
+import time
+import uuid
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import IO, Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+from .metrics import upstream
+from .model_cache import ModelCache
+from .shared import MULTI_WORKER, file_lock, try_claim
+
+MESHY_API = os.getenv("MESHY_API_URL", "https://api.meshy.ai/openapi/v1/image-to-3d")
+
+DONE_STATUSES = ("SUCCEEDED", "COMPLETED", "DONE")
+FAILED_STATUSES = ("FAILED", "ERROR", "CANCELED")
+TERMINAL = ("succeeded", "failed")
+
+# Generation options sent with every task; part of the content key as well
+MESHY_OPTIONS: Dict[str, Any] = {
+    "should_texture": True,
+    "should_remesh": True,
+    "enable_pbr": True,
+}
+
+
+def meshy_key() -> str:
+    return os.getenv("MESHY_API_KEY") or ""
+
+
+def expired(jobs: List[Dict[str, Any]], keep: int, max_age_s: float, now: float) -> Set[str]:
+    """Ids of finished jobs past retention: older than max_age_s, or beyond the newest `keep`."""
+    done = sorted((j for j in jobs if j.get("status") in TERMINAL), key=lambda j: j.get("updated_at") or 0, reverse=True)
+    return {j["id"] for k, j in enumerate(done) if k >= keep or (j.get("updated_at") or 0) < now - max_age_s}
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Meshy API steps
+# ──────────────────────────────────────────────────────────────────────────────
+B64_READ = 3 * 64 * 1024   # multiple of 3, so chunks encode without padding in between
+DOWNLOAD_CHUNK = 64 * 1024   # one thread hop per write, so not too small
+
+
+def data_uri_body(image_path: Path, mime: str) -> Tuple[int, AsyncIterator[bytes]]:
+    """`{"image_url": "data:<mime>;base64,...", **MESHY_OPTIONS}` as (exact length, chunk stream).
+
+    The image is base64-encoded from disk a chunk at a time, so the request
+    never holds the whole data URI in memory. Reads and encoding run in a
+    worker thread, off the event loop.
+    """
+    head = b'{"image_url": "data:' + mime.encode("ascii") + b';base64,'
+    opts = json.dumps(MESHY_OPTIONS)[1:-1].encode("utf-8")
+    tail = b'"' + (b", " + opts if opts else b"") + b"}"
+    size = image_path.stat().st_size
+    length = len(head) + 4 * ((size + 2) // 3) + len(tail)
+
+    def encoded(f: IO[bytes]) -> bytes:
+        return base64.b64encode(f.read(B64_READ))
+
+    async def chunks() -> AsyncIterator[bytes]:
+        yield head
+        f = await asyncio.to_thread(image_path.open, "rb")
+        try:
+            while True:
+                block = await asyncio.to_thread(encoded, f)
+                if not block:
+                    break
+                yield block
+        finally:
+            await asyncio.to_thread(f.close)
+        yield tail
+
+    return length, chunks()
+
+
+async def submit_task(client: httpx.AsyncClient, image_path: Path, mime: str) -> str:
+    """Send the image to Meshy as a data URI (v1 API expects a URL or data URI); returns the Meshy task id."""
+    length, body = data_uri_body(image_path, mime)
+    with upstream("meshy", "submit"):
+        r = await client.post(
+            MESHY_API,
+            headers={
+                "Authorization": f"Bearer {meshy_key()}",
+                "Content-Type": "application/json",
+                "Content-Length": str(length),   # sized up front, so no chunked transfer encoding
+            },
+            content=body,
+            timeout=60,
+        )
+    if r.status_code >= 300:
+        raise HTTPException(r.status_code, f"Meshy submit failed: {r.text}")
+    task_id = (r.json() or {}).get("result")
+    if not task_id:
+        raise HTTPException(500, f"No task id. Raw: {r.text}")
+    return task_id
+
+
+async def get_task(client: httpx.AsyncClient, task_id: str) -> httpx.Response:
+    with upstream("meshy", "status"):
+        return await client.get(
+            f"{MESHY_API}/{task_id}",
+            headers={"Authorization": f"Bearer {meshy_key()}"},
+            timeout=30,
+        )
+
+
+async def download_glb(client: httpx.AsyncClient, url: str, dest: Path) -> None:
+    """Stream the GLB to dest (via a temp file so readers never see a partial model).
+
+    Disk writes run in a worker thread so multi-MB models don't block the loop.
+    """
+    part = dest.with_suffix(dest.suffix + ".part")
+    with upstream("meshy", "download"):
+        async with client.stream("GET", url, timeout=180) as dl:
+            if dl.status_code >= 300:
+                await dl.aread()
+                raise HTTPException(dl.status_code, f"GLB download failed: {dl.text}")
+            f = await asyncio.to_thread(part.open, "wb")
+            try:
+                async for chunk in dl.aiter_bytes(DOWNLOAD_CHUNK):
+                    if chunk:
+                        await asyncio.to_thread(f.write, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+    await asyncio.to_thread(part.replace, dest)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Background job subsystem
+# ──────────────────────────────────────────────────────────────────────────────
+@dataclass
+class MeshyJob:
+    id: str
+    image_path: str
+    mime: str
+    hint: str = ""
+    content_key: Optional[str] = None
+    status: str = "queued"          # queued | polling | downloading | succeeded | failed
+    task_id: Optional[str] = None
+    meshy_status: Optional[str] = None
+    progress: Optional[int] = None
+    model_url: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    def public(self) -> Dict[str, Any]:
+        d = asdict(self)
+        d.pop("image_path", None)
+        return d
+
+
+class MeshyJobManager:
+    def __init__(
+        self,
+        store_path: Path,
+        models_dir: Path,
+        model_url_for: Callable[[str], str],
+        queue_size: int = 16,
+        submitters: int = 2,
+        pollers: int = 2,
+        poll_interval: float = 3.0,
+        max_poll_interval: float = 20.0,
+        deadline_s: float = 420.0,
+        cache: Optional[ModelCache] = None,
+        keep_finished: int = 500,
+        keep_age_s: float = 7 * 86400.0,
+    ):
+        self.store_path = store_path
+        self.models_dir = models_dir
+        self.model_url_for = model_url_for
+        self.queue_size = queue_size
+        self.n_submitters = submitters
+        self.n_pollers = pollers
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.deadline_s = deadline_s
+        self.cache = cache
+        self.keep_finished = keep_finished
+        self.keep_age_s = keep_age_s
+
+        self.jobs: Dict[str, MeshyJob] = {}
+        self.client: Optional[httpx.AsyncClient] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Optional[asyncio.PriorityQueue] = None
+        self._done: Dict[str, asyncio.Event] = {}
+        self._inflight: Dict[str, str] = {}     # content key -> job id
+        self._own: Set[str] = set()             # jobs run by this process (every job, with one worker)
+        self._claim: Optional[IO[str]] = None
+        self._tasks: List[asyncio.Task] = []
+        self._dirty: Optional[asyncio.Event] = None
+        self._seq = 0
+
+    # -- lifecycle -------------------------------------------------------------
+    async def start(self) -> None:
+        self.client = httpx.AsyncClient(limits=httpx.Limits(max_connections=20, max_keepalive_connections=10))
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._pending = asyncio.PriorityQueue()
+        self._dirty = asyncio.Event()
+        self._load()
+        self._prune()
+        # Resume whatever was in flight when the service last stopped (one worker does this)
+        if MULTI_WORKER:
+            self._claim = try_claim(self.store_path)
+        resume = self._claim is not None or not MULTI_WORKER
+        for job in list(self.jobs.values()):
+            if job.status in TERMINAL or not resume:
+                continue
+            self._own.add(job.id)
+            if job.content_key:
+                self._inflight[job.content_key] = job.id
+            if job.task_id:
+                job.status = "polling"
+                self._schedule(job.id, 0.0, self.poll_interval)
+            elif Path(job.image_path).exists() and not self._queue.full():
+                job.status = "queued"
+                self._queue.put_nowait(job.id)
+            else:
+                self._fail(job, "Could not resume job after restart")
+        self._tasks = [asyncio.create_task(self._submitter()) for _ in range(self.n_submitters)]
+        self._tasks += [asyncio.create_task(self._poller()) for _ in range(self.n_pollers)]
+        self._tasks.append(asyncio.create_task(self._writer()))
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._write(self._snapshot())
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+        if self._claim is not None:
+            self._claim.close()
+            self._claim = None
+
+    # -- public API ------------------------------------------------------------
+    def enqueue(self, image_path: Path, mime: str, hint: str = "", key: Optional[str] = None) -> MeshyJob:
+        """Queue a conversion; an identical upload already in flight returns that job instead."""
+        if self._queue is None:
+            raise HTTPException(503, "Meshy job queue is not running")
+        if key and key in self._inflight:
+            return self.jobs[self._inflight[key]]
+        if key and MULTI_WORKER:
+            self._load()   # the same plan may be in flight on another worker
+            for other in self.jobs.values():
+                if other.content_key == key and other.status not in TERMINAL:
+                    return other
+        job = MeshyJob(id=uuid.uuid4().hex, image_path=str(image_path), mime=mime, hint=hint, content_key=key)
+        try:
+            self._queue.put_nowait(job.id)
+        except asyncio.QueueFull:
+            raise HTTPException(503, "Too many pending 3D conversions; try again shortly")
+        self.jobs[job.id] = job
+        self._own.add(job.id)
+        if key:
+            self._inflight[key] = job.id
+        self._changed()
+        return job
+
+    def get(self, job_id: str) -> Optional[MeshyJob]:
+        if MULTI_WORKER and job_id not in self._own:
+            self._load()
+        return self.jobs.get(job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> MeshyJob:
+        job = self.jobs.get(job_id)
+        if job is None:   # pruned meanwhile
+            raise HTTPException(404, "Unknown job")
+        if job.status in TERMINAL:
+            return job
+        if job_id in self._own:
+            ev = self._done.setdefault(job_id, asyncio.Event())
+            await asyncio.wait_for(ev.wait(), timeout)
+            return self.jobs.get(job_id) or job
+        # Run by another worker: follow it through the shared job store
+        deadline = time.monotonic() + timeout
+        while job.status not in TERMINAL:
+            if time.monotonic() >= deadline:
+                raise asyncio.TimeoutError
+            await asyncio.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+            job = self.get(job_id) or job
+        return job
+
+    # -- workers ---------------------------------------------------------------
+    def _schedule(self, job_id: str, delay: float, interval: float) -> None:
+        self._seq += 1
+        self._pending.put_nowait((time.time() + delay, self._seq, job_id, interval))
+
+    async def _submitter(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            try:
+                job.task_id = await submit_task(self.client, Path(job.image_path), job.mime)
+                job.status = "polling"
+                self._touch(job)
+                self._schedule(job.id, self.poll_interval, self.poll_interval)
+            except HTTPException as e:
+                self._fail(job, str(e.detail))
+            except Exception as e:
+                self._fail(job, f"Meshy submit failed: {e}")
+
+    async def _poller(self) -> None:
+        while True:
+            due, seq, job_id, interval = await self._pending.get()
+            wait = due - time.time()
+            if wait > 0:
+                # Not due yet: put it back and nap briefly so newer, sooner jobs still get picked up
+                self._pending.put_nowait((due, seq, job_id, interval))
+                await asyncio.sleep(min(wait, 0.5))
+                continue
+            job = self.jobs.get(job_id)
+            if job is None or job.status in TERMINAL:
+                continue
+            try:
+                await self._poll_once(job, interval)
+            except Exception as e:
+                if time.time() - job.created_at > self.deadline_s:
+                    self._fail(job, f"Meshy task status failed: {e}")
+                else:
+                    self._schedule(job.id, interval, min(interval * 2, self.max_poll_interval))
+
+    async def _poll_once(self, job: MeshyJob, interval: float) -> None:
+        r = await get_task(self.client, job.task_id)
+        if r.status_code >= 300:
+            raise RuntimeError(f"HTTP {r.status_code}: {r.text}")
+        tj = r.json()
+        seen = (job.meshy_status, job.progress)
+        job.meshy_status = (tj.get("status") or "").upper()
+        job.progress = tj.get("progress")
+        glb_url = (tj.get("model_urls") or {}).get("glb")
+
+        if job.meshy_status in DONE_STATUSES and glb_url:
+            job.status = "downloading"
+            self._touch(job)
+            glb_name = f"{job.content_key or job.task_id}.glb"
+            await download_glb(self.client, glb_url, self.models_dir / glb_name)
+            job.model_url = self.model_url_for(glb_name)
+            job.status = "succeeded"
+            self._finish(job)
+            if self.cache is not None and job.content_key:
+                self.cache.record(job.content_key, glb_name, Path(job.image_path).name)
+                keep = [j.image_path for j in self.jobs.values() if j.status not in TERMINAL]
+                self.cache.evict(protect=keep + [job.image_path, str(self.models_dir / glb_name)])
+        elif job.meshy_status in FAILED_STATUSES:
+            self._fail(job, f"Meshy task failed: {tj}")
+        elif time.time() - job.created_at > self.deadline_s:
+            self._fail(job, f"Meshy task timed out; last status: {job.meshy_status}")
+        else:
+            self._touch(job, persist=(job.meshy_status, job.progress) != seen)
+            self._schedule(job.id, interval, min(interval * 1.5, self.max_poll_interval))
+
+    # -- state -----------------------------------------------------------------
+    def _touch(self, job: MeshyJob, persist: bool = True) -> None:
+        job.updated_at = time.time()
+        if persist:
+            self._changed()
+
+    def _fail(self, job: MeshyJob, error: str) -> None:
+        job.status = "failed"
+        job.error = error
+        self._finish(job)
+
+    def _finish(self, job: MeshyJob) -> None:
+        if job.content_key:
+            self._inflight.pop(job.content_key, None)
+        ev = self._done.pop(job.id, None)
+        if ev is not None:
+            ev.set()
+        self._touch(job)
+        self._prune()
+
+    def _prune(self) -> None:
+        brief = [{"id": j.id, "status": j.status, "updated_at": j.updated_at} for j in self.jobs.values()]
+        for job_id in expired(brief, self.keep_finished, self.keep_age_s, time.time()):
+            self.jobs.pop(job_id, None)
+            self._own.discard(job_id)
+
+    def _changed(self) -> None:
+        if self._dirty is not None:
+            self._dirty.set()
+
+    async def _writer(self) -> None:
+        # One write per burst of changes, off the event loop (and off it while waiting for the file lock)
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            try:
+                await asyncio.to_thread(self._write, self._snapshot())
+            except Exception:
+                pass   # keep serving from memory; the next change retries the write
+
+    def _snapshot(self) -> Dict[str, Dict[str, Any]]:
+        # With several workers, only our own jobs are current here; the rest come from the file
+        return {j.id: asdict(j) for j in self.jobs.values() if not MULTI_WORKER or j.id in self._own}
+
+    def _read(self) -> List[Dict[str, Any]]:
+        if not self.store_path.exists():
+            return []
+        try:
+            return json.loads(self.store_path.read_text(encoding="utf-8")).get("jobs", [])
+        except Exception:
+            return []
+
+    def _load(self) -> None:
+        for d in self._read():
+            try:
+                job = MeshyJob(**d)
+            except TypeError:
+                continue
+            if job.id not in self._own:   # our own jobs are always current in memory
+                self.jobs[job.id] = job
+
+    def _write(self, records: Dict[str, Dict[str, Any]]) -> None:
+        self.store_path.parent.mkdir(parents=True, exist_ok=True)
+        # Several workers share the file: merge in their latest jobs under the lock before writing
+        with file_lock(self.store_path) if MULTI_WORKER else nullcontext():
+            if MULTI_WORKER:
+                records = {**{d["id"]: d for d in self._read() if "id" in d}, **records}
+            gone = expired(list(records.values()), self.keep_finished, self.keep_age_s, time.time())
+            jobs = [d for k, d in records.items() if k not in gone]
+            tmp = self.store_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps({"jobs": jobs}), encoding="utf-8")
+            tmp.replace(self.store_path)
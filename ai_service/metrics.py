@@ -0,0 +1,255 @@
+"""In-process metrics, request timing and an opt-in sampling profiler.
+
+- Counters and histograms are kept in a small registry and rendered in the
+  Prometheus text format by GET /metrics.
+- MetricsMiddleware times every request per route; `stage("name")` times a
+  block inside a handler and attributes it to the current endpoint.
+- When profiling is on, a sampler thread records folded stacks of all
+  threads; requests slower than the threshold get their samples written to
+  PROFILE_DIR as `.folded` files (flamegraph.pl / speedscope ready).
+"""
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# The ASGI scope of the request being handled; routing fills in scope["route"]
+_scope: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("voltspace_scope", default=None)
+_request_start: contextvars.ContextVar[float] = contextvars.ContextVar("voltspace_request_start", default=0.0)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._hists: Dict[str, Dict[Labels, List[float]]] = {}   # bucket counts..., sum, count
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._collectors: List[Callable[[], Iterator[Tuple[str, str, Dict[str, str], float]]]] = []
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            h = self._hists.setdefault(name, {}).get(key)
+            if h is None:
+                h = self._hists[name][key] = [0.0] * (len(BUCKETS) + 2)
+            for i, b in enumerate(BUCKETS):
+                if seconds <= b:
+                    h[i] += 1
+            h[-2] += seconds
+            h[-1] += 1
+
+    def collector(self, fn: Callable[[], Iterator[Tuple[str, str, Dict[str, str], float]]]) -> None:
+        """Register a scrape-time callback yielding (name, kind, labels, value) gauges/counters."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+
+        def head(name: str, default_kind: str) -> None:
+            kind, text = self._help.get(name, (default_kind, ""))
+            if text:
+                lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                head(name, "counter")
+                for key, v in series.items():
+                    lines.append(f"{name}{_fmt_labels(key)} {v:g}")
+            for name, series in sorted(self._hists.items()):
+                head(name, "histogram")
+                for key, h in series.items():
+                    for i, b in enumerate(BUCKETS):
+                        lines.append(f"{name}_bucket{_fmt_labels(key + (('le', f'{b:g}'),))} {h[i]:g}")
+                    lines.append(f"{name}_bucket{_fmt_labels(key + (('le', '+Inf'),))} {h[-1]:g}")
+                    lines.append(f"{name}_sum{_fmt_labels(key)} {h[-2]:.6f}")
+                    lines.append(f"{name}_count{_fmt_labels(key)} {h[-1]:g}")
+        seen = set()
+        for fn in self._collectors:
+            try:
+                for name, kind, labels, value in fn():
+                    if name not in seen:
+                        head(name, kind)
+                        seen.add(name)
+                    lines.append(f"{name}{_fmt_labels(tuple(sorted(labels.items())))} {value:g}")
+            except Exception:
+                continue
+        return "\n".join(lines) + "\n"
+
+
+def _fmt_labels(key: Labels) -> str:
+    if not key:
+        return ""
+    inner = ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in key)
+    return "{" + inner + "}"
+
+
+registry = Registry()
+registry.describe("voltspace_requests_total", "counter", "HTTP requests by endpoint and status")
+registry.describe("voltspace_request_seconds", "histogram", "HTTP request latency by endpoint")
+registry.describe("voltspace_stage_seconds", "histogram", "Time spent in a named stage of a handler")
+registry.describe("voltspace_upstream_calls_total", "counter", "Calls to OpenAI / Meshy by outcome")
+registry.describe("voltspace_upstream_seconds", "histogram", "Upstream call latency")
+registry.describe("voltspace_insights_fallback_total", "counter", "insights_ai answers that fell back to rule-based insights")
+registry.describe("voltspace_cache_lookups_total", "counter", "Response / model cache lookups by result")
+
+
+def current_endpoint() -> str:
+    scope = _scope.get()
+    if scope is None:
+        return "-"
+    return getattr(scope.get("route"), "path", None) or "unmatched"
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe("voltspace_stage_seconds", time.perf_counter() - t0, endpoint=current_endpoint(), stage=name)
+
+
+def mark_parsed() -> None:
+    """Call first thing in a handler: records request read + validation time as the 'parse' stage."""
+    t0 = _request_start.get()
+    if t0:
+        registry.observe("voltspace_stage_seconds", time.perf_counter() - t0, endpoint=current_endpoint(), stage="parse")
+        _request_start.set(0.0)   # a second call within the same request records nothing
+
+
+@contextmanager
+def upstream(service: str, op: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        registry.inc("voltspace_upstream_calls_total", service=service, op=op, outcome=outcome)
+        registry.observe("voltspace_upstream_seconds", time.perf_counter() - t0, service=service, op=op)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Sampling profiler
+# ──────────────────────────────────────────────────────────────────────────────
+IDLE_LEAVES = {"wait", "select", "poll", "_wait_for_tstate_lock", "accept"}
+
+
+class SamplingProfiler:
+    def __init__(self, out_dir: Path, interval_s: float = 0.005, slow_s: float = 1.0, max_samples: int = 200_000):
+        self.out_dir = out_dir
+        self.interval_s = interval_s
+        self.slow_s = slow_s
+        self._samples: Deque[Tuple[float, str]] = deque(maxlen=max_samples)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.enabled:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="voltspace-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self._thread = None
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            now = time.perf_counter()
+            for tid, frame in sys._current_frames().items():
+                if tid == me or frame.f_code.co_name in IDLE_LEAVES:
+                    continue
+                names: List[str] = []
+                f = frame
+                while f is not None:
+                    names.append(f"{f.f_code.co_name} ({Path(f.f_code.co_filename).name}:{f.f_lineno})")
+                    f = f.f_back
+                self._samples.append((now, ";".join(reversed(names))))
+
+    def dump_if_slow(self, endpoint: str, start: float, end: float) -> Optional[Path]:
+        if not self.enabled or end - start < self.slow_s:
+            return None
+        counts: Dict[str, int] = {}
+        for ts, stack in list(self._samples):
+            if start <= ts <= end:
+                counts[stack] = counts.get(stack, 0) + 1
+        if not counts:
+            return None
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        safe = endpoint.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+        path = self.out_dir / f"{int(time.time() * 1000)}_{safe}_{int((end - start) * 1000)}ms.folded"
+        path.write_text("".join(f"{s} {n}\n" for s, n in sorted(counts.items())), encoding="utf-8")
+        return path
+
+
+profiler = SamplingProfiler(
+    out_dir=Path(os.getenv("PROFILE_DIR") or Path(__file__).resolve().parent / "profiles"),
+    interval_s=float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000.0,
+    slow_s=float(os.getenv("PROFILE_SLOW_MS", "1000")) / 1000.0,
+)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# ASGI middleware
+# ──────────────────────────────────────────────────────────────────────────────
+class MetricsMiddleware:
+    """Times each HTTP request and labels it with the matched route path."""
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+        scope_token = _scope.set(scope)
+        st_token = _request_start.set(start)
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end = time.perf_counter()
+            endpoint = current_endpoint()
+            registry.inc("voltspace_requests_total", endpoint=endpoint, method=scope.get("method", ""), status=str(status["code"]))
+            registry.observe("voltspace_request_seconds", end - start, endpoint=endpoint)
+            profiler.dump_if_slow(endpoint, start, end)
+            _scope.reset(scope_token)
+            _request_start.reset(st_token)
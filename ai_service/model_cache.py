@@ -0,0 +1,154 @@
+"""Content-addressed cache for floor-plan uploads and their generated GLBs.
+
+An upload is keyed by SHA-256 over the image bytes plus the Meshy generation
+options, so a repeat upload maps straight to the model that was already
+generated. Files in UPLOAD_DIR and MODELS_DIR are kept under a size budget
+by evicting the least recently used entries (and stray legacy files) first.
+
+Hits only note their access time in memory. The times are folded into the
+index file when an entry is recorded, at eviction, and on flush(), so a
+cache hit never rewrites the index.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .shared import MULTI_WORKER, file_lock
+
+
+def finish_key(h: Any, options: Dict[str, Any]) -> str:
+    """Content key from a sha256 object already fed the image bytes (uploads are hashed while streamed)."""
+    h.update(json.dumps(options, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ModelCache:
+    def __init__(self, index_path: Path, upload_dir: Path, models_dir: Path, max_bytes: int, orphan_grace_s: float = 3600.0):
+        self.index_path = index_path
+        self.upload_dir = upload_dir
+        self.models_dir = models_dir
+        self.max_bytes = max_bytes
+        self.orphan_grace_s = orphan_grace_s
+        self._lock = threading.Lock()
+        self._index: Dict[str, Dict[str, Any]] = self._load()
+        self._touched: Dict[str, float] = {}    # key -> last hit not yet in the index file
+
+    # -- lookups ---------------------------------------------------------------
+    def lookup(self, key: str) -> Optional[str]:
+        """GLB filename for key if it is still on disk; refreshes its LRU position (in memory)."""
+        with self._lock:
+            e = self._index.get(key)
+            if not e and MULTI_WORKER:
+                self._index = self._load()   # another worker may have recorded it; the file is replaced atomically
+                e = self._index.get(key)
+            if not e or not (self.models_dir / e["model"]).exists():
+                return None                  # a missing model is dropped from the index at the next eviction
+            self._touched[key] = time.time()
+            return e["model"]
+
+    def record(self, key: str, model: str, upload: Optional[str]) -> None:
+        now = time.time()
+        with self._guard():
+            self._index[key] = {
+                "model": model,
+                "upload": upload,
+                "size": self._size(self.models_dir / model) + (self._size(self.upload_dir / upload) if upload else 0),
+                "created_at": now,
+                "last_access": now,
+            }
+            self._touched.pop(key, None)
+            self._save()
+
+    def flush(self) -> None:
+        """Write pending hit times to the index."""
+        with self._guard():
+            if self._touched:
+                self._save()
+
+    # -- eviction --------------------------------------------------------------
+    def evict(self, protect: Iterable[str] = ()) -> List[str]:
+        """Delete LRU entries until both directories fit in max_bytes; returns removed paths."""
+        protected = {str(Path(p).resolve()) for p in protect}
+        with self._guard():
+            stale = [k for k, e in self._index.items() if not (self.models_dir / e["model"]).exists()]
+            for key in stale:
+                self._index.pop(key)                # its upload, if any, is now an orphan file
+            tracked = set()
+            for e in self._index.values():
+                tracked.add(e["model"])
+                if e.get("upload"):
+                    tracked.add(e["upload"])
+
+            # (last use, key or None, files) — untracked files are evicted by mtime
+            candidates: List[Tuple[float, Optional[str], List[Path]]] = []
+            total = 0
+            for d in (self.upload_dir, self.models_dir):
+                for f in d.iterdir():
+                    if not f.is_file():
+                        continue
+                    st = f.stat()
+                    total += st.st_size
+                    if f.name in tracked or str(f.resolve()) in protected:
+                        continue
+                    if time.time() - st.st_mtime > self.orphan_grace_s:
+                        candidates.append((st.st_mtime, None, [f]))
+            removed: List[str] = []
+            for key, e in self._index.items():
+                files = [self.models_dir / e["model"]]
+                if e.get("upload"):
+                    files.append(self.upload_dir / e["upload"])
+                if any(str(f.resolve()) in protected for f in files):
+                    continue
+                candidates.append((self._touched.get(key, e["last_access"]), key, files))
+
+            for _, key, files in sorted(candidates, key=lambda c: c[0]):
+                if total <= self.max_bytes:
+                    break
+                for f in files:
+                    total -= self._size(f)
+                    f.unlink(missing_ok=True)
+                    removed.append(str(f))
+                if key is not None:
+                    self._index.pop(key, None)
+            if removed or stale or self._touched:
+                self._save()
+            return removed
+
+    # -- persistence -----------------------------------------------------------
+    @contextmanager
+    def _guard(self) -> Iterator[None]:
+        """Thread lock; with several workers also the index file lock plus a fresh read of the index."""
+        with self._lock:
+            if not MULTI_WORKER:
+                yield
+                return
+            with file_lock(self.index_path):
+                self._index = self._load()
+                yield
+
+    @staticmethod
+    def _size(p: Path) -> int:
+        try:
+            return p.stat().st_size
+        except OSError:
+            return 0
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            return json.loads(self.index_path.read_text(encoding="utf-8"))
+        except Exception:
+            return {}
+
+    def _save(self) -> None:
+        for key, t in self._touched.items():
+            e = self._index.get(key)
+            if e is not None:
+                e["last_access"] = max(e["last_access"], t)
+        self._touched.clear()
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._index), encoding="utf-8")
+        tmp.replace(self.index_path)
@@ -0,0 +1,97 @@
+"""Process pool for CPU-bound request work.
+
+Large /insights and /insights/batch bodies spend nearly all their time on
+JSON decoding and validation, which holds the GIL. /energy/backfill
+replays a home's whole toggle history. With OFFLOAD_WORKERS > 0 this work
+runs in a pool of worker processes instead of the threadpool, so one big
+fleet doesn't stall every other request in the worker, and spare cores get
+used.
+
+Bodies smaller than OFFLOAD_MIN_KB stay in-process, where shipping them
+to another process would cost more than it saves.
+
+Pool processes are spawned rather than forked, since the server already
+runs threads. They import only what the tasks below need (ingest, rules,
+energy), not main.py.
+"""
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+
+from . import ingest
+from .energy import EnergyLedger
+from .rules import DeviceTable, evaluate
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Tasks (run in-process or in the pool)
+# ──────────────────────────────────────────────────────────────────────────────
+def rule_insights(table: DeviceTable) -> List[Dict[str, Any]]:
+    return [ins for _, ins in evaluate(table, datetime.now().hour)]
+
+
+def grouped_insights(keys: List[str], table: DeviceTable) -> Dict[str, List[Dict[str, Any]]]:
+    results: Dict[str, List[Dict[str, Any]]] = {k: [] for k in keys}
+    for i, ins in evaluate(table, datetime.now().hour):
+        results[keys[table.group[i]]].append(ins)
+    return results
+
+
+def insights(body: bytes) -> Dict[str, Any]:
+    _, table = ingest.parse_devices(body)
+    return {"insights": rule_insights(table)}
+
+
+def insights_batch(body: bytes) -> Dict[str, Any]:
+    keys, table = ingest.parse_groups(body)
+    return {"results": grouped_insights(keys, table)}
+
+
+_ledgers: Dict[str, EnergyLedger] = {}
+
+
+def energy_backfill(db_path: str, home_id: int, watts: Dict[int, float], logs: List[Dict[str, Any]]) -> int:
+    ledger = _ledgers.get(db_path)
+    if ledger is None:
+        ledger = _ledgers[db_path] = EnergyLedger(db_path)
+    return ledger.backfill(home_id, watts, logs)
+
+
+def _ready() -> bool:
+    return True
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Pool
+# ──────────────────────────────────────────────────────────────────────────────
+class Offload:
+    def __init__(self, workers: int = 0, min_bytes: int = 256 * 1024):
+        self.workers = workers
+        self.min_bytes = min_bytes
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._pool is not None
+
+    def start(self) -> None:
+        if self.workers <= 0 or self._pool is not None:
+            return
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        for _ in range(self.workers):
+            self._pool.submit(_ready)   # spawn + import now, not on the first big request
+
+    def stop(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def wants(self, size: int) -> bool:
+        return self._pool is not None and size >= self.min_bytes
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        assert self._pool is not None
+        return await asyncio.get_running_loop().run_in_executor(self._pool, partial(fn, *args))
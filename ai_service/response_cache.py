@@ -0,0 +1,100 @@
+"""TTL + LRU response cache, optionally backed by SQLite on disk.
+
+Used by /insights_ai so an unchanged device snapshot doesn't trigger a new
+LLM call. Keys come from snapshot_key(), which hashes a canonical form of
+the compact device list with hours_on bucketed (so a snapshot taken a minute
+later still hits).
+
+The disk table is bounded like the memory LRU: expired rows go first, then
+the least recently used beyond max_disk_rows. Callers get their own copy of
+a cached value, so changing it can't corrupt the cache.
+"""
+import copy
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .shared import connect
+
+
+def snapshot_key(compact: List[Dict[str, Any]], hours_bucket: float, **extra: Any) -> str:
+    norm = []
+    for e in compact:
+        e = dict(e)
+        h = e.get("hours_on")
+        if h is not None and hours_bucket > 0:
+            e["hours_on"] = int(float(h) // hours_bucket)
+        norm.append(json.dumps(e, sort_keys=True, separators=(",", ":"), default=str))
+    norm.sort()
+    blob = json.dumps({"devices": norm, **extra}, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, ttl_s: float, max_entries: int, disk_path: Optional[Path] = None, max_disk_rows: Optional[int] = None):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self.max_disk_rows = max_disk_rows if max_disk_rows is not None else 8 * max_entries
+        self.hits = 0
+        self.misses = 0
+        self._mem: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if disk_path is not None:
+            disk_path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = connect(disk_path)
+            self._db.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires REAL NOT NULL, value TEXT NOT NULL)")
+            if "used" not in {r[1] for r in self._db.execute("PRAGMA table_info(cache)")}:
+                self._db.execute("ALTER TABLE cache ADD COLUMN used REAL NOT NULL DEFAULT 0")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_cache_used ON cache(used)")
+            self._db.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            item = self._mem.get(key)
+            if item is not None and item[0] > now:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(item[1])
+            if item is not None:
+                del self._mem[key]
+            if self._db is not None:
+                row = self._db.execute("SELECT expires, value FROM cache WHERE key=?", (key,)).fetchone()
+                if row and row[0] > now:
+                    value = json.loads(row[1])
+                    self._put_mem(key, row[0], value)
+                    with self._db:
+                        self._db.execute("UPDATE cache SET used=? WHERE key=?", (now, key))
+                    self.hits += 1
+                    return copy.deepcopy(value)
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        expires = now + self.ttl_s
+        with self._lock:
+            self._put_mem(key, expires, copy.deepcopy(value))
+            if self._db is not None:
+                with self._db:
+                    self._db.execute("INSERT OR REPLACE INTO cache(key, expires, value, used) VALUES (?, ?, ?, ?)", (key, expires, json.dumps(value), now))
+                    self._db.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+                    over = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_disk_rows
+                    if over > 0:
+                        self._db.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used LIMIT ?)", (over,))
+
+    def _put_mem(self, key: str, expires: float, value: Any) -> None:
+        self._mem[key] = (expires, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._mem), "disk": self._db is not None}
@@ -0,0 +1,128 @@
+"""Columnar rule engine behind /insights and /insights/batch.
+
+Devices are laid out as parallel NumPy arrays (type, on, power_w, hours on,
+state flags) and every entry of RULES is evaluated over the whole table in
+one vectorized pass. Adding a rule means adding a row to RULES, not another
+per-device branch.
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class Rule:
+    type: str                                   # device type this rule applies to (lowercase)
+    severity: str                               # 'info' | 'warn' | 'critical'
+    title: str                                  # str.format template: {name}, {hrs}, {power_w}
+    detail: str
+    requires_on: bool = True
+    min_hours: Optional[float] = None           # hours on must be strictly greater
+    min_power_w: Optional[int] = None           # power_w must be strictly greater
+    hours_of_day: Optional[Tuple[int, int]] = None  # inclusive local-hour window
+    flag: Optional[str] = None                  # state attribute that must be truthy
+
+
+# Same thresholds and wording the per-device loop in insights() used to have.
+RULES: Tuple[Rule, ...] = (
+    Rule(
+        type="light", severity="warn", min_hours=8,
+        title="Light on for {hrs}h: {name}",
+        detail="The light '{name}' appears to be on for over {hrs} hours. Consider turning it off.",
+    ),
+    Rule(
+        type="ac", severity="warn", min_hours=6,
+        title="AC running {hrs}h: {name}",
+        detail="'{name}' has been cooling for more than {hrs} hours. Review setpoint or schedule.",
+    ),
+    Rule(
+        type="plug", severity="info", hours_of_day=(0, 5), min_power_w=5,
+        title="Night-time load  on plug: {name}",
+        detail="'{name}' is using ~{power_w}W overnight (00:00–05:00). Consider turning it off.",
+    ),
+    Rule(
+        type="plug", severity="info", requires_on=False, flag="flexible",
+        title="Shiftable load: {name}",
+        detail="This plug is marked flexible. Consider moving usage to 22:00–06:00 to save costs.",
+    ),
+)
+
+RULE_FLAGS = tuple(sorted({r.flag for r in RULES if r.flag}))
+
+
+class DeviceTable:
+    """Column-oriented view of a device list; row i is the i-th device."""
+
+    __slots__ = ("names", "types", "on", "power_w", "hours_on", "flags", "group")
+
+    def __init__(
+        self,
+        names: Sequence[str],
+        types: np.ndarray,
+        on: np.ndarray,
+        power_w: np.ndarray,
+        hours_on: np.ndarray,
+        flags: Dict[str, np.ndarray],
+        group: Optional[np.ndarray] = None,
+    ):
+        self.names = names
+        self.types = types
+        self.on = on
+        self.power_w = power_w
+        self.hours_on = hours_on
+        self.flags = flags
+        self.group = group if group is not None else np.zeros(len(names), dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+def evaluate(
+    table: DeviceTable,
+    hour: int,
+    rules: Sequence[Rule] = RULES,
+) -> List[Tuple[int, Dict[str, Any]]]:
+    """Run every rule over the table; returns (row, insight) in device, then rule, order."""
+    if not len(table):
+        return []
+
+    rows: List[np.ndarray] = []
+    rule_ids: List[np.ndarray] = []
+    for k, r in enumerate(rules):
+        if r.hours_of_day is not None and not (r.hours_of_day[0] <= hour <= r.hours_of_day[1]):
+            continue
+        mask = table.types == r.type
+        if r.requires_on:
+            mask &= table.on
+        if r.min_hours is not None:
+            mask &= table.hours_on > r.min_hours
+        if r.min_power_w is not None:
+            mask &= table.power_w > r.min_power_w
+        if r.flag is not None:
+            mask &= table.flags.get(r.flag, False)
+        hit = np.flatnonzero(mask)
+        if hit.size:
+            rows.append(hit)
+            rule_ids.append(np.full(hit.size, k))
+
+    if not rows:
+        return []
+    row = np.concatenate(rows)
+    rid = np.concatenate(rule_ids)
+    order = np.lexsort((rid, row))
+
+    out: List[Tuple[int, Dict[str, Any]]] = []
+    for i, k in zip(row[order].tolist(), rid[order].tolist()):
+        r = rules[k]
+        fields = {
+            "name": table.names[i],
+            "hrs": int(table.hours_on[i]),
+            "power_w": int(table.power_w[i]),
+        }
+        out.append((i, {
+            "severity": r.severity,
+            "title": r.title.format(**fields),
+            "detail": r.detail.format(**fields),
+        }))
+    return out
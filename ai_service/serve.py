@@ -0,0 +1,168 @@
+"""Production launcher: several uvicorn worker processes over shared local state.
+
+    python -m ai_service.serve --workers 4 --port 8000 [--offload-workers 2]
+    python -m ai_service.serve --measure-startup [--runs 5]
+    python -m ai_service.serve --scaling 1,2,4 [--size 1000]
+
+uvicorn's supervisor starts the workers up front, and they all accept on
+one socket. AI_SERVICE_WORKERS is exported first, so every worker opens its
+stores in shared mode (see shared.py). The insights cache then defaults to
+disk, and job, alert and context state is read back from data/ rather
+than from one process's memory.
+
+--measure-startup times cold starts in fresh interpreters: interpreter
+start to ready, the import of main.py, and lifespan startup.
+--scaling runs the rule-insights benchmark (bench.py, http mode) against
+1, 2, ... workers, so multi-core scaling can be tracked next to the
+latency baselines.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+import uvicorn
+
+from .stubs import free_port
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Runs in a fresh interpreter; prints one JSON line once the app is ready to serve
+_PROBE = r"""
+import asyncio, json, sys, time
+t0 = time.perf_counter()
+from ai_service.main import app
+t1 = time.perf_counter()
+
+async def main():
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+        print(json.dumps({
+            "import_s": t1 - t0,
+            "lifespan_s": ready - t1,
+            "modules": len(sys.modules),
+            "openai_loaded": "openai" in sys.modules,
+        }), flush=True)
+
+asyncio.run(main())
+"""
+
+
+def _env(storage: str, **extra: str) -> Dict[str, str]:
+    env = dict(os.environ, AI_SERVICE_STORAGE_DIR=storage, **extra)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (str(ROOT), env.get("PYTHONPATH", "")) if p)
+    return env
+
+
+def measure_startup(runs: int) -> Dict[str, Any]:
+    samples: List[Dict[str, Any]] = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix="voltspace-startup-") as storage:
+            env = _env(storage)
+            env.pop("OPENAI_API_KEY", None)   # no post-startup client warm-up racing the probe
+            t0 = time.perf_counter()
+            proc = subprocess.Popen([sys.executable, "-c", _PROBE], cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True)
+            line = proc.stdout.readline() if proc.stdout else ""
+            process_s = time.perf_counter() - t0
+            proc.wait(timeout=60)
+            if not line:
+                raise RuntimeError(f"startup probe failed (exit {proc.returncode})")
+            samples.append({"process_s": process_s, **json.loads(line)})
+    out: Dict[str, Any] = {"runs": runs}
+    for k in ("process_s", "import_s", "lifespan_s"):
+        out[k] = round(statistics.median(s[k] for s in samples), 4)
+    out["modules"] = samples[-1]["modules"]
+    out["openai_loaded"] = samples[-1]["openai_loaded"]
+    return out
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, timeout: float = 60.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited with {proc.returncode}")
+        try:
+            if httpx.get(f"{url}/metrics", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"server at {url} not ready after {timeout:.0f}s")
+
+
+def scaling(workers: List[int], size: int, requests: int, concurrency: int) -> List[Dict[str, Any]]:
+    rows: List[Dict[str, Any]] = []
+    for n in workers:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        with tempfile.TemporaryDirectory(prefix="voltspace-scaling-") as storage:
+            server = subprocess.Popen(
+                [sys.executable, "-m", "ai_service.serve", "--workers", str(n), "--port", str(port), "--log-level", "warning"],
+                cwd=ROOT, env=_env(storage),
+            )
+            try:
+                _wait_ready(url, server)
+                saved = Path(storage) / "bench.json"
+                subprocess.run(
+                    [sys.executable, "-m", "ai_service.bench", "--mode", "http", "--url", url,
+                     "--scenarios", "insights,insights_batch", "--sizes", str(size),
+                     "--requests", str(requests), "--concurrency", str(concurrency), "--save", str(saved)],
+                    cwd=ROOT, env=_env(storage), check=True, stdout=subprocess.DEVNULL,
+                )
+                for r in json.loads(saved.read_text(encoding="utf-8"))["results"]:
+                    rows.append({"workers": n, "scenario": r["scenario"], "size": r["size"], "rps": r["rps"], "p95_ms": r["p95_ms"]})
+                    print(f"workers={n:<3} {r['scenario']:<15} n={r['size']:<7} {r['rps']:>9.1f} req/s  p95 {r['p95_ms']:>8.1f} ms", flush=True)
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+    return rows
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Run the VoltSpace AI service with several worker processes")
+    ap.add_argument("--host", default=os.getenv("AI_SERVICE_HOST", "127.0.0.1"))
+    ap.add_argument("--port", type=int, default=int(os.getenv("AI_SERVICE_PORT", "8000")))
+    ap.add_argument("--workers", type=int, default=int(os.getenv("AI_SERVICE_WORKERS", str(os.cpu_count() or 1))))
+    ap.add_argument("--offload-workers", type=int, default=None, help="process pool size per worker for big rule/accounting jobs (OFFLOAD_WORKERS)")
+    ap.add_argument("--log-level", default="info")
+    ap.add_argument("--measure-startup", action="store_true", help="time cold starts instead of serving")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--scaling", default="", help="comma-separated worker counts to benchmark, e.g. 1,2,4")
+    ap.add_argument("--size", type=int, default=1000, help="fleet size for --scaling")
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--save", default="", help="write --measure-startup / --scaling results JSON here")
+    return ap.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    if args.measure_startup or args.scaling:
+        report: Dict[str, Any] = {}
+        if args.measure_startup:
+            report["startup"] = measure_startup(args.runs)
+            print(json.dumps(report["startup"]), flush=True)
+        if args.scaling:
+            report["scaling"] = scaling([int(x) for x in args.scaling.split(",") if x.strip()], args.size, args.requests, args.concurrency)
+        if args.save:
+            with open(args.save, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        return 0
+
+    # Read by every worker at import time (shared.py), so set before uvicorn starts them
+    os.environ["AI_SERVICE_WORKERS"] = str(max(1, args.workers))
+    if args.offload_workers is not None:
+        os.environ["OFFLOAD_WORKERS"] = str(args.offload_workers)
+    uvicorn.run("ai_service.main:app", host=args.host, port=args.port, workers=max(1, args.workers), log_level=args.log_level)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
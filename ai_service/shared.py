@@ -0,0 +1,59 @@
+"""Local state shared between the worker processes started by serve.py.
+
+With AI_SERVICE_WORKERS > 1, every worker imports main.py and opens the same
+files under data/. Everything the workers need to agree on therefore lives
+there, rather than in process memory:
+
+- SQLite stores (energy ledger, alerts, assistant context, insights cache)
+  are opened in WAL mode with a busy timeout. Read-modify-write updates take
+  the write lock up front (BEGIN IMMEDIATE).
+- The JSON stores (model index, Meshy jobs) are rewritten under an
+  exclusive file lock after re-reading the current file.
+
+In a single process all of this is cheap and behaves exactly as before.
+"""
+import fcntl
+import os
+import sqlite3
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Iterator, Optional
+
+WORKERS = max(1, int(os.getenv("AI_SERVICE_WORKERS", "1")))
+MULTI_WORKER = WORKERS > 1
+
+
+def connect(path: Path | str) -> sqlite3.Connection:
+    """SQLite connection usable from several threads and processes at once."""
+    conn = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+    if str(path) != ":memory:":
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+@contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """Exclusive lock on `<path>.lock` across processes (blocks until free)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(f"{path}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def try_claim(path: Path) -> Optional[IO[str]]:
+    """Non-blocking, process-lifetime claim on `<path>.owner`; None if another worker holds it.
+
+    Keep the returned file open for as long as the claim should last.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    f = open(f"{path}.owner", "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
@@ -0,0 +1,145 @@
+"""Local stand-ins for the OpenAI and Meshy APIs, with configurable latency.
+
+Used by the benchmark suite (bench.py) and handy for manual testing: point
+OPENAI_BASE_URL at `<stub>/v1` and MESHY_API_URL at
+`<stub>/openapi/v1/image-to-3d`.
+
+    python -m ai_service.stubs --port 9100 --llm-latency 0.4
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+
+def build_stub_app(
+    llm_latency: float = 0.3,
+    llm_jitter: float = 0.1,
+    stream_chunk_delay: float = 0.02,
+    meshy_latency: float = 0.05,
+    meshy_job_seconds: float = 2.0,
+    glb_bytes: int = 256 * 1024,
+) -> FastAPI:
+    app = FastAPI(title="VoltSpace upstream stubs")
+    tasks: Dict[str, float] = {}
+    glb = b"glTF" + bytes(max(0, glb_bytes - 4))
+
+    async def _llm_delay() -> None:
+        await asyncio.sleep(max(0.0, llm_latency + random.uniform(-llm_jitter, llm_jitter)))
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        body: Dict[str, Any] = await request.json()
+        model = body.get("model", "stub")
+        insights = [
+            {"severity": "warn", "title": "Stub: long-on lights", "detail": "Turn off lights left on overnight."},
+            {"severity": "info", "title": "Stub: shift flexible loads", "detail": "Run flexible plugs 22:00–06:00."},
+            {"severity": "info", "title": "Stub: AC setpoint", "detail": "Raise the setpoint by 1–2°C."},
+        ]
+        user = next((m.get("content") or "" for m in body.get("messages", []) if m.get("role") == "user"), "")
+        if user.startswith("Households JSON:"):
+            # Batched /insights_ai prompt (llm_batcher.py): answer every household section
+            households = json.loads(user.split("\n", 1)[1])
+            content = json.dumps({"results": {h: {"insights": insights} for h in households}})
+        else:
+            content = json.dumps({"insights": insights})
+        await _llm_delay()
+        if not body.get("stream"):
+            return JSONResponse({
+                "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+
+        async def chunks():
+            for i in range(0, len(content), 16):
+                ch = {
+                    "id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "delta": {"content": content[i:i + 16]}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(ch)}\n\n"
+                await asyncio.sleep(stream_chunk_delay)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    @app.post("/openapi/v1/image-to-3d")
+    async def meshy_submit(request: Request):
+        body = await request.json()
+        if not str(body.get("image_url", "")).startswith("data:image/"):
+            return JSONResponse({"message": "image_url must be a data URI"}, status_code=400)
+        await asyncio.sleep(meshy_latency)
+        task_id = uuid.uuid4().hex
+        tasks[task_id] = time.time()
+        return {"result": task_id}
+
+    @app.get("/openapi/v1/image-to-3d/{task_id}")
+    async def meshy_task(task_id: str, request: Request):
+        await asyncio.sleep(meshy_latency)
+        started = tasks.get(task_id)
+        if started is None:
+            return JSONResponse({"message": "not found"}, status_code=404)
+        progress = min(100, int(100 * (time.time() - started) / max(meshy_job_seconds, 1e-6)))
+        if progress < 100:
+            return {"id": task_id, "status": "IN_PROGRESS", "progress": progress}
+        base = str(request.base_url).rstrip("/")
+        return {"id": task_id, "status": "SUCCEEDED", "progress": 100, "model_urls": {"glb": f"{base}/glb/{task_id}.glb"}}
+
+    @app.get("/glb/{name}")
+    async def meshy_glb(name: str):
+        await asyncio.sleep(meshy_latency)
+        return Response(glb, media_type="model/gltf-binary")
+
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ServerThread:
+    """Run an ASGI app with uvicorn on a background thread (for benchmarks and tests)."""
+
+    def __init__(self, app: Any, port: Optional[int] = None):
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    def __enter__(self) -> "ServerThread":
+        self._thread.start()
+        deadline = time.time() + 10
+        while not self._server.started:
+            if time.time() > deadline:
+                raise RuntimeError(f"Server on port {self.port} did not start")
+            time.sleep(0.02)
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=10)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Run OpenAI + Meshy stand-ins")
+    ap.add_argument("--port", type=int, default=9100)
+    ap.add_argument("--llm-latency", type=float, default=0.3)
+    ap.add_argument("--meshy-latency", type=float, default=0.05)
+    ap.add_argument("--meshy-job-seconds", type=float, default=2.0)
+    args = ap.parse_args()
+    uvicorn.run(
+        build_stub_app(llm_latency=args.llm_latency, meshy_latency=args.meshy_latency, meshy_job_seconds=args.meshy_job_seconds),
+        host="127.0.0.1",
+        port=args.port,
+    )
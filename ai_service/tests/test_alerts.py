@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+from ai_service.alerts import AlertEngine
+
+HOUR = 3600.0
+
+
+def test_fire_due_fires_each_episode_once(tmp_path):
+    db = tmp_path / "alerts.sqlite3"
+    engine = AlertEngine(db)
+    now = time.time()
+    assert engine.device_event(1, 10, 7, True, 60, ts=now, name="Lamp", type="light") == []
+    assert engine.pending_timers() == 1
+
+    assert engine.fire_due(now + 7 * HOUR) == []
+    fired = engine.fire_due(now + 8 * HOUR + 2)
+    assert [a["title"] for a in fired] == ["Light on for 8h: Lamp"]
+    assert engine.fire_due(now + 9 * HOUR) == []
+
+    # A restart re-arms from SQLite; the episode already fired stays fired
+    async def restart():
+        again = AlertEngine(db)
+        await again.start()
+        try:
+            assert again.pending_timers() == 1
+            return again.fire_due(now + 9 * HOUR), again.for_user(7)
+        finally:
+            await again.stop()
+
+    refired, stored = asyncio.run(restart())
+    assert refired == []
+    assert len(stored) == 1
+
+
+def test_toggle_drops_stale_timer_and_starts_new_episode(tmp_path):
+    engine = AlertEngine(tmp_path / "alerts.sqlite3")
+    now = time.time()
+    engine.device_event(1, 10, 7, True, 60, ts=now - 9 * HOUR, type="light")
+    engine.device_event(1, 10, 7, False, 0, ts=now - HOUR, type="light")
+    engine.device_event(1, 10, 7, True, 60, ts=now, type="light")
+    assert engine.fire_due(now + 8 * HOUR + 2) != []
+    assert len(engine.for_user(7)) == 2
+
+
+def test_failed_event_leaves_no_state(tmp_path):
+    engine = AlertEngine(tmp_path / "alerts.sqlite3")
+
+    def boom(*args):
+        raise RuntimeError("write failed")
+
+    engine._emit = boom
+    now = time.time()
+    try:
+        engine.device_event(1, 10, 7, True, 60, ts=now - 9 * HOUR, type="light")
+    except RuntimeError:
+        pass
+    assert engine._read_devices() == []
+    assert 1 not in engine._devices
+    assert engine.pending_timers() == 0
+
+
+def test_ack_marks_delivered(tmp_path):
+    engine = AlertEngine(tmp_path / "alerts.sqlite3")
+    fired = engine.device_event(1, 10, 7, True, 60, ts=time.time() - 9 * HOUR, type="light")
+    assert engine.ack(7, [a["id"] for a in fired]) == 1
+    assert engine.for_user(7, undelivered=True) == []
@@ -0,0 +1,60 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from ai_service.energy import EnergyLedger
+
+
+def ts(*args):
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+def test_apply_accrues_closed_intervals_into_buckets(tmp_path):
+    ledger = EnergyLedger(tmp_path / "energy.sqlite3")
+    assert ledger.apply(1, 10, True, 1000, ts=ts(2026, 3, 4, 9, 30))
+    assert ledger.apply(1, 10, False, 0, ts=ts(2026, 3, 4, 11, 0))
+    hours = ledger.series(10, "hour", "2026-03-04T00", "2026-03-04T23")
+    assert [(h["bucket"], h["on_seconds"]) for h in hours] == [("2026-03-04T09", 1800.0), ("2026-03-04T10", 3600.0)]
+    assert sum(h["kwh"] for h in hours) == pytest.approx(1.5)
+
+
+def test_apply_ignores_replayed_log_ids(tmp_path):
+    ledger = EnergyLedger(tmp_path / "energy.sqlite3")
+    assert ledger.apply(1, 10, True, 1000, ts=ts(2026, 3, 4, 9), log_id=5)
+    assert not ledger.apply(1, 10, True, 1000, ts=ts(2026, 3, 4, 9), log_id=5)
+    assert not ledger.apply(1, 10, False, 0, ts=ts(2026, 3, 4, 10), log_id=4)
+    assert ledger.apply(1, 10, False, 0, ts=ts(2026, 3, 4, 10), log_id=6)
+    assert ledger.report([10], now=ts(2026, 3, 4, 12))[10]["kwh_today"] == pytest.approx(1.0)
+
+
+def test_report_counts_open_intervals_and_periods(tmp_path):
+    ledger = EnergyLedger(tmp_path / "energy.sqlite3")
+    ledger.apply(1, 10, True, 2000, ts=ts(2026, 2, 28, 23))     # 1h in February, 1h on Mar 1
+    ledger.apply(1, 10, False, 0, ts=ts(2026, 3, 1, 1))
+    ledger.apply(2, 10, True, 500, ts=ts(2026, 3, 4, 10))       # still on
+    ledger.apply(3, 11, True, 100, ts=ts(2026, 3, 4, 11))
+    r = ledger.report([10, 11, 12], now=ts(2026, 3, 4, 12))
+    assert r[10]["kwh_today"] == pytest.approx(1.0)
+    assert r[10]["on_seconds_today"] == pytest.approx(7200.0)
+    assert r[10]["kwh_month"] == pytest.approx(3.0)
+    assert r[10]["kwh_year"] == pytest.approx(5.0)
+    assert r[11]["kwh_today"] == pytest.approx(0.1)
+    assert r[12] == {"backfilled": False, "kwh_today": 0.0, "on_seconds_today": 0.0, "kwh_month": 0.0, "kwh_year": 0.0}
+    # The open interval is not persisted by a report
+    assert ledger.series(10, "day", "2026-03-04", "2026-03-04") == []
+
+
+def test_backfill_rebuilds_and_is_idempotent(tmp_path):
+    ledger = EnergyLedger(tmp_path / "energy.sqlite3")
+    logs = [
+        {"id": 2, "device_id": 1, "ts": ts(2026, 3, 4, 10), "to": 0},
+        {"id": 1, "device_id": 1, "ts": ts(2026, 3, 4, 8), "to": 1},
+        {"id": 3, "device_id": 9, "ts": ts(2026, 3, 4, 8), "to": 1},   # not in this home's devices
+    ]
+    for _ in range(2):
+        assert ledger.backfill(10, {1: 1500}, logs) == 2
+    r = ledger.report([10], now=ts(2026, 3, 4, 12))[10]
+    assert r["backfilled"] is True
+    assert r["kwh_today"] == pytest.approx(3.0)
+    assert not ledger.apply(1, 10, True, 1500, ts=ts(2026, 3, 4, 10), log_id=2)
+    assert ledger.device_kwh([1, 2], now=ts(2026, 3, 4, 12)) == {1: pytest.approx(3.0), 2: 0.0}
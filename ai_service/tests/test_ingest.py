@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from ai_service import ingest
+
+
+def errors_of(fn, *args, **kwargs):
+    with pytest.raises(ingest.IngestError) as e:
+        fn(*args, **kwargs)
+    return [(err["loc"], err["type"]) for err in e.value.errors]
+
+
+def test_read_devices_reports_every_bad_field():
+    rows = [
+        {"name": "ok", "type": "light"},
+        "not a device",
+        {"name": 1, "type": None, "power_w": "12"},
+        {"name": "x", "type": "plug", "power_w": 1.5},
+        {"name": "y", "type": "plug", "state": "on"},
+        {"name": "z", "type": "ac", "last_active": "yesterday"},
+    ]
+    assert errors_of(ingest.read_devices, rows) == [
+        (["body", 1], "dict_type"),
+        (["body", 2, "name"], "string_type"),
+        (["body", 2, "type"], "string_type"),
+        (["body", 3, "power_w"], "int_type"),
+        (["body", 4, "state"], "dict_type"),
+        (["body", 5, "last_active"], "datetime_type"),
+    ]
+
+
+def test_read_devices_accepts_php_shapes():
+    rows = [
+        {"name": "a", "type": "Plug", "power_w": "7", "state": [], "last_active": "2026-01-01T00:00:00Z"},
+        {"name": "b", "type": "light", "power_w": 60.0, "state": {"on": True, "flexible": 1}, "last_active": 1767225600000},
+    ]
+    table = ingest.read_devices(rows)
+    assert table.types.tolist() == ["plug", "light"]
+    assert table.power_w.tolist() == [7, 60]
+    assert rows[0]["power_w"] == 7   # normalized in place for compact()
+    assert table.on.tolist() == [False, True]
+    assert table.flags["flexible"].tolist() == [False, True]
+
+
+def test_read_devices_needs_a_list():
+    assert errors_of(ingest.read_devices, {"name": "a"}) == [(["body"], "list_type")]
+
+
+def test_load_reports_bad_json():
+    assert errors_of(ingest.load, b"[{") == [(["body", 2], "json_invalid")]
+
+
+def test_parse_groups_errors_point_into_the_group():
+    body = json.dumps({"groups": {
+        "a": [{"name": "x", "type": "light"}],
+        "empty": [],
+        "b": [{"name": "y", "type": "ac"}, {"name": 3, "type": "ac", "power_w": "w"}, 5],
+    }}).encode()
+    assert errors_of(ingest.parse_groups, body) == [
+        (["body", "groups", "b", 1, "name"], "string_type"),
+        (["body", "groups", "b", 1, "power_w"], "int_type"),
+        (["body", "groups", "b", 2], "dict_type"),
+    ]
+
+
+def test_parse_groups_shape_errors():
+    assert errors_of(ingest.parse_groups, b'{"groups": []}') == [(["body", "groups"], "dict_type")]
+    assert errors_of(ingest.parse_groups, b'{"groups": {"a": {}}}') == [(["body", "groups", "a"], "list_type")]
+
+
+def test_parse_groups_sets_group_index():
+    body = json.dumps({"groups": {"a": [{"name": "x", "type": "light"}], "b": [{"name": "y", "type": "ac"}] * 2}}).encode()
+    keys, table = ingest.parse_groups(body)
+    assert keys == ["a", "b"]
+    assert table.group.tolist() == [0, 1, 1]
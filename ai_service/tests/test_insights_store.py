@@ -0,0 +1,46 @@
+from datetime import datetime, timezone
+
+from ai_service.insights_store import CHUNK_ROWS, InsightsStore
+
+
+def rows(store, user_id):
+    with store.connection() as conn:
+        return conn.execute(
+            "SELECT title, detail, severity, acknowledged, created_at FROM insights WHERE user_id=? ORDER BY id", (user_id,)
+        ).fetchall()
+
+
+def test_insert_many_normalizes_rows():
+    store = InsightsStore("sqlite://:memory:")
+    now = datetime(2026, 3, 4, 12, 30, tzinfo=timezone.utc)
+    n = store.insert_many(7, [
+        {"severity": "WARN", "title": "Lamp on", "detail": "Turn it off"},
+        {"severity": "loud", "title": "x" * 200},
+        {},
+    ], now=now)
+    assert n == 3
+    assert rows(store, 7) == [
+        ("Lamp on", "Turn it off", "warn", 0, "2026-03-04 12:30:00"),
+        ("x" * 128, "", "info", 0, "2026-03-04 12:30:00"),
+        ("Insight", "", "info", 0, "2026-03-04 12:30:00"),
+    ]
+    assert store.insert_many(7, []) == 0
+    assert store.count(7) == 3 and store.count(8) == 0
+
+
+def test_insert_many_chunks_large_batches(tmp_path):
+    store = InsightsStore(f"sqlite:///{tmp_path}/insights.sqlite3", pool_size=2)
+    items = [{"title": f"t{i}"} for i in range(CHUNK_ROWS * 2 + 3)]
+    assert store.insert_many(1, items) == len(items)
+    assert [r[0] for r in rows(store, 1)] == [i["title"] for i in items]
+    store.close()
+
+
+def test_failed_insert_rolls_back():
+    store = InsightsStore("sqlite://:memory:")
+    bad = [{"title": "ok"}] * CHUNK_ROWS + [{"title": None, "detail": object()}]
+    try:
+        store.insert_many(1, bad)
+    except Exception:
+        pass
+    assert store.count(1) == 0
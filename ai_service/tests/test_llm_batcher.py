@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from ai_service.llm_batcher import InsightsBatcher
+
+
+class Upstream:
+    """Counts calls; a household whose first device is named in `drop` is left out of merged replies."""
+
+    def __init__(self, delay=0.05, drop=(), fail_single=False):
+        self.delay = delay
+        self.drop = set(drop)
+        self.fail_single = fail_single
+        self.single_calls = []
+        self.multi_calls = []
+        self._lock = threading.Lock()
+
+    def single(self, client, compact):
+        with self._lock:
+            self.single_calls.append(compact[0]["name"])
+        time.sleep(self.delay)
+        if self.fail_single:
+            raise RuntimeError("upstream down")
+        return [{"title": "single " + compact[0]["name"]}]
+
+    def multi(self, client, compacts):
+        with self._lock:
+            self.multi_calls.append([c[0]["name"] for c in compacts])
+        time.sleep(self.delay)
+        return [None if c[0]["name"] in self.drop else [{"title": "multi " + c[0]["name"]}] for c in compacts]
+
+
+def run_all(batcher, jobs, timeout=5.0):
+    """Submit (key, name) pairs concurrently; returns results in submission order."""
+    out = [None] * len(jobs)
+    errors = [None] * len(jobs)
+    start = threading.Barrier(len(jobs))
+
+    def go(i, key, name):
+        start.wait()
+        try:
+            out[i] = batcher.submit("client", key, [{"name": name}], timeout=timeout)
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=go, args=(i, k, n)) for i, (k, n) in enumerate(jobs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return out, errors
+
+
+def test_concurrent_requests_share_one_call():
+    up = Upstream()
+    b = InsightsBatcher(up.single, up.multi, window_s=0.1, max_batch=8)
+    out, _ = run_all(b, [("k1", "a"), ("k2", "b"), ("k3", "c")])
+    assert len(up.multi_calls) == 1 and sorted(up.multi_calls[0]) == ["a", "b", "c"]
+    assert up.single_calls == []
+    assert out == [[{"title": "multi a"}], [{"title": "multi b"}], [{"title": "multi c"}]]
+
+
+def test_identical_snapshots_coalesce():
+    up = Upstream(delay=0.2)
+    b = InsightsBatcher(up.single, up.multi, window_s=0.0)
+    out, _ = run_all(b, [("same", "a")] * 5)
+    assert up.single_calls == ["a"]
+    assert out == [[{"title": "single a"}]] * 5
+
+
+def test_missing_section_retried_once_per_snapshot():
+    up = Upstream(drop={"b"})
+    b = InsightsBatcher(up.single, up.multi, window_s=0.1, max_batch=8)
+    out, _ = run_all(b, [("k1", "a"), ("k2", "b"), ("k2", "b"), ("k2", "b")])
+    assert up.multi_calls == [["a", "b"]] or up.multi_calls == [["b", "a"]]
+    assert up.single_calls == ["b"]
+    assert out == [[{"title": "multi a"}]] + [[{"title": "single b"}]] * 3
+
+
+def test_timeout_returns_none_without_a_second_call():
+    up = Upstream(delay=0.5)
+    b = InsightsBatcher(up.single, up.multi, window_s=0.0)
+    t0 = time.monotonic()
+    assert b.submit("client", "k", [{"name": "a"}], timeout=0.1) is None
+    assert time.monotonic() - t0 < 0.4
+    time.sleep(0.6)
+    assert up.single_calls == ["a"]
+
+
+def test_single_call_errors_reach_every_waiter():
+    up = Upstream(fail_single=True)
+    b = InsightsBatcher(up.single, up.multi, window_s=0.0)
+    _, errors = run_all(b, [("k", "a")] * 3)
+    assert up.single_calls == ["a"]
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    with pytest.raises(RuntimeError):   # the key is free again afterwards
+        b.submit("client", "k", [{"name": "a"}], timeout=1.0)
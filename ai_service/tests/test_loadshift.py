@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import pytest
+
+from ai_service import loadshift
+
+START = datetime(2026, 3, 4, 18, 0)
+# 18:00-21:59 peak, 00:00-05:59 cheap, everything else 20
+TARIFF = {**{h: 40.0 for h in range(18, 22)}, **{h: 5.0 for h in range(0, 6)}}
+
+
+def home(loads, **kw):
+    return {"home_id": 1, "price_cents_per_kwh": 20.0, "loads": loads, **kw}
+
+
+def plan_one(loads, slot_minutes=60, start=START, **kw):
+    return loadshift.plan([home(loads, **kw)], TARIFF, start, 24, slot_minutes)["homes"][0]
+
+
+def test_load_moves_to_cheapest_window():
+    h = plan_one([{"id": 1, "power_w": 2000, "hours": 2}])
+    (e,) = h["schedule"]
+    assert e["start"] == "2026-03-05T00:00" and e["end"] == "2026-03-05T02:00"
+    assert e["cost_cents"] == pytest.approx(20.0)       # 2 kW x 2 h x 5 c
+    assert e["baseline_cents"] == pytest.approx(160.0)  # started right away at 40 c
+    assert h["savings_cents"] == pytest.approx(140.0)
+
+
+def test_ready_and_deadline_bound_the_start():
+    h = plan_one([{"id": 1, "power_w": 1000, "hours": 1, "ready_in_h": 0.5, "done_within_h": 4.5}], slot_minutes=60)
+    (e,) = h["schedule"]
+    # Ready 18:30 rounds up to 19:00; due 22:30 rounds down to 22:00
+    assert "2026-03-04T19:00" <= e["start"] and e["end"] <= "2026-03-04T22:00"
+
+
+def test_bad_windows_are_unscheduled_not_errors():
+    h = plan_one([
+        {"id": 1, "power_w": 1000, "hours": 1, "ready_in_h": 5, "done_within_h": 3},
+        {"id": 2, "power_w": 1000, "hours": 3, "ready_in_h": 1, "done_within_h": 2},
+        {"id": 3, "power_w": 1000, "hours": 1},
+    ])
+    assert h["unscheduled"] == [
+        {"id": 1, "name": None, "reason": "deadline"},
+        {"id": 2, "name": None, "reason": "window"},
+    ]
+    assert [e["id"] for e in h["schedule"]] == [3]
+
+
+def test_peak_cap_spreads_loads_or_leaves_them_out():
+    loads = [{"id": i, "power_w": 3000, "hours": 2} for i in range(3)]
+    h = plan_one(loads, peak_w=4000, base_w=500)
+    starts = sorted(e["start_slot"] for e in h["schedule"])
+    assert len(starts) == 3 and all(b - a >= 2 for a, b in zip(starts, starts[1:]))
+    assert h["peak_w"] <= 4000
+
+    h = plan_one(loads, peak_w=3000, base_w=500)
+    assert [u["reason"] for u in h["unscheduled"]] == ["peak cap"] * 3
+
+
+def test_request_level_errors_still_raise():
+    with pytest.raises(ValueError):
+        plan_one([], base_w=[1.0, 2.0])
+    with pytest.raises(ValueError):
+        loadshift.plan([], slot_minutes=20)
+
+
+def test_start_rounds_up_to_slot_boundary():
+    assert loadshift.plan([], start=datetime(2026, 3, 4, 18, 7), slot_minutes=30)["start"] == "2026-03-04T18:30"
+    assert loadshift.plan([], start=datetime(2026, 3, 4, 18, 30), slot_minutes=30)["start"] == "2026-03-04T18:30"
+    assert loadshift.plan([], start=datetime(2026, 3, 4, 23, 50, 5), slot_minutes=15)["start"] == "2026-03-05T00:00"
@@ -0,0 +1,80 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+from ai_service import ingest
+from ai_service.rules import evaluate
+
+NOW = datetime(2026, 3, 4, 12, 0, tzinfo=timezone.utc)
+
+
+def per_device(rows, hour):
+    """The per-device loop insights() had before the rule table (baseline main.py)."""
+    out = []
+    for d in rows:
+        t = (d["type"] or "").lower()
+        st = d.get("state") or {}
+        on = bool(st.get("on", False))
+        hrs = 0.0
+        if on and d.get("last_active"):
+            hrs = max(0.0, (NOW - datetime.fromisoformat(d["last_active"])).total_seconds() / 3600.0)
+        if t == "light" and on and hrs > 8:
+            out.append({
+                "severity": "warn",
+                "title": f"Light on for {int(hrs)}h: {d['name']}",
+                "detail": f"The light '{d['name']}' appears to be on for over {int(hrs)} hours. Consider turning it off.",
+            })
+        if t == "ac" and on and hrs > 6:
+            out.append({
+                "severity": "warn",
+                "title": f"AC running {int(hrs)}h: {d['name']}",
+                "detail": f"'{d['name']}' has been cooling for more than {int(hrs)} hours. Review setpoint or schedule.",
+            })
+        if t == "plug" and on and 0 <= hour <= 5 and d["power_w"] > 5:
+            out.append({
+                "severity": "info",
+                "title": f"Night-time load  on plug: {d['name']}",
+                "detail": f"'{d['name']}' is using ~{d['power_w']}W overnight (00:00–05:00). Consider turning it off.",
+            })
+        if t == "plug" and st.get("flexible"):
+            out.append({
+                "severity": "info",
+                "title": f"Shiftable load: {d['name']}",
+                "detail": "This plug is marked flexible. Consider moving usage to 22:00–06:00 to save costs.",
+            })
+    return out
+
+
+def fleet(n, seed):
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        state = {"on": rnd.random() < 0.6}
+        if rnd.random() < 0.3:
+            state["flexible"] = rnd.random() < 0.5
+        rows.append({
+            "name": f"dev{i}",
+            "type": rnd.choice(["light", "Light", "ac", "AC", "plug", "tv", ""]),
+            "power_w": rnd.choice([0, 3, 5, 6, 60, 1500]),
+            "state": state,
+            "last_active": (NOW - timedelta(hours=rnd.uniform(0, 12))).isoformat() if rnd.random() < 0.9 else None,
+        })
+    return rows
+
+
+def test_evaluate_matches_per_device_loop():
+    for seed in range(5):
+        rows = fleet(400, seed)
+        for hour in (0, 3, 5, 6, 14, 23):
+            table = ingest.read_devices(rows, now=NOW)
+            assert [ins for _, ins in evaluate(table, hour)] == per_device(rows, hour)
+
+
+def test_evaluate_row_order_and_empty():
+    rows = [
+        {"name": "p", "type": "plug", "power_w": 40, "state": {"on": True, "flexible": True}},
+        {"name": "l", "type": "light", "power_w": 10, "state": {"on": True}, "last_active": (NOW - timedelta(hours=9)).isoformat()},
+    ]
+    out = evaluate(ingest.read_devices(rows, now=NOW), hour=2)
+    assert [row for row, _ in out] == [0, 0, 1]
+    assert [ins["title"] for _, ins in out] == ["Night-time load  on plug: p", "Shiftable load: p", "Light on for 9h: l"]
+    assert evaluate(ingest.read_devices([], now=NOW), hour=2) == []
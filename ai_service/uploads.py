@@ -0,0 +1,130 @@
+"""Floor-plan uploads for /meshify with memory that stays flat.
+
+Uploads used to be read whole, written to disk, read back and base64-encoded
+into one string: about four copies of the image per request. Now:
+
+- UploadLimitMiddleware turns away oversized multipart bodies on the
+  /meshify routes before they are parsed. It checks Content-Length up front
+  and counts bytes for chunked bodies.
+- save_upload() copies the upload to UPLOAD_DIR in chunks, hashing as it
+  goes (in the threadpool, off the event loop); model_cache.finish_key
+  turns the hash into the content key.
+- shrink_image() downscales and recompresses oversized plans before they
+  are submitted, if Pillow is installed. Without it, images are sent as-is.
+
+meshy_jobs.submit_task streams the base64 JSON body straight from the file.
+"""
+import hashlib
+import json
+import uuid
+from pathlib import Path
+from typing import IO, Any, Dict, Tuple
+
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from .model_cache import finish_key
+
+CHUNK = 1024 * 1024
+MULTIPART_SLACK = 64 * 1024   # boundaries + the small form fields next to the image
+
+
+class UploadLimitMiddleware:
+    """Reject request bodies over max_bytes (plus multipart slack) on the given path prefixes."""
+
+    def __init__(self, app: Any, max_bytes: int, prefixes: Tuple[str, ...] = ("/meshify",)):
+        self.app = app
+        self.limit = max_bytes + MULTIPART_SLACK
+        self.prefixes = prefixes
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or scope.get("method") != "POST" or not scope["path"].startswith(self.prefixes):
+            await self.app(scope, receive, send)
+            return
+        for name, value in scope.get("headers") or ():
+            if name == b"content-length" and value.isdigit() and int(value) > self.limit:
+                body = json.dumps({"detail": f"Upload too large (max {self.limit - MULTIPART_SLACK} bytes)"}).encode()
+                await send({"type": "http.response.start", "status": 413, "headers": [
+                    (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                ]})
+                await send({"type": "http.response.body", "body": body})
+                return
+
+        seen = 0
+
+        async def counting_receive() -> Dict[str, Any]:
+            nonlocal seen
+            message = await receive()
+            if message["type"] == "http.request":
+                seen += len(message.get("body", b""))
+                if seen > self.limit:
+                    # Raised inside the form parser; FastAPI passes HTTPExceptions through as-is
+                    raise HTTPException(413, f"Upload too large (max {self.limit - MULTIPART_SLACK} bytes)")
+            return message
+
+        await self.app(scope, counting_receive, send)
+
+
+def _write(f: IO[bytes], h: Any, chunk: bytes) -> None:
+    h.update(chunk)
+    f.write(chunk)
+
+
+async def save_upload(image: UploadFile, upload_dir: Path, options: Dict[str, Any], max_bytes: int) -> Tuple[Path, str, bool]:
+    """Copy the upload to upload_dir/<content key><ext> in chunks; returns (path, key, newly written)."""
+    suffix = Path(image.filename or "").suffix.lower() or ".png"
+    part = upload_dir / f".{uuid.uuid4().hex}.part"
+    h = hashlib.sha256()
+    size = 0
+    try:
+        f = await run_in_threadpool(part.open, "wb")
+        try:
+            while True:
+                chunk = await image.read(CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(413, f"Upload too large (max {max_bytes} bytes)")
+                await run_in_threadpool(_write, f, h, chunk)
+        finally:
+            await run_in_threadpool(f.close)
+        if not size:
+            raise HTTPException(400, "Empty image upload")
+        key = finish_key(h, options)
+        path = upload_dir / f"{key}{suffix}"
+        if path.exists():
+            part.unlink()
+            return path, key, False
+        await run_in_threadpool(part.replace, path)
+        return path, key, True
+    except BaseException:
+        part.unlink(missing_ok=True)
+        raise
+
+
+def shrink_image(path: Path, mime: str, max_px: int, max_bytes: int) -> bool:
+    """Downscale to max_px on the long side and recompress if the image is bigger than that or max_bytes.
+
+    Rewrites path in place (same format) and returns True if it did. No-op
+    without Pillow, or for anything Pillow can't open.
+    """
+    try:
+        from PIL import Image  # optional; only needed to shrink oversized plans
+    except ImportError:
+        return False
+    try:
+        with Image.open(path) as im:
+            if max(im.size) <= max_px and path.stat().st_size <= max_bytes:
+                return False
+            im.draft("RGB", (max_px, max_px))   # JPEG: decode at a reduced scale straight away
+            im.thumbnail((max_px, max_px))
+            tmp = path.with_name(f".{path.name}.shrink")
+            if mime == "image/jpeg":
+                im.convert("RGB").save(tmp, format="JPEG", quality=85, optimize=True)
+            else:
+                im.save(tmp, format="PNG", optimize=True)
+    except (OSError, ValueError):
+        return False
+    tmp.replace(path)
+    return True
@@ -96,6 +96,7 @@ $state_json = json_encode($state);
 $stmt = $db->prepare('INSERT INTO devices(room_id, type, name, serial_number, bt_code, state_json, power_w, last_active, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, NOW(), NOW())');
 $stmt->bind_param('isssssi', $room_id, $type, $name, $serial, $bt, $state_json, $power_w);
 if ($stmt->execute()) {
+    vs_agent_context_reset();
     header('Location: ' . BASE_URL . '/pages/devices.php');
     exit;
 }
@@ -0,0 +1,42 @@
+<?php
+require_once __DIR__ . '/../includes/auth.php';
+require_once __DIR__ . '/../includes/utils.php';
+require_once __DIR__ . '/../config.php';
+require_login();
+
+$input = json_decode(file_get_contents('php://input'), true) ?: [];
+$question = trim($input['question'] ?? '');
+if ($question === '') { http_response_code(400); echo json_encode(['error'=>'Missing question']); exit; }
+
+$db = get_db();
+$u = current_user();
+$body = vs_agent_payload($db, (int)$u['id'], $question);
+// Release the session lock so other pages stay usable while the answer streams
+session_write_close();
+
+// Relay the AI service's Server-Sent Events to the browser as they arrive
+header('Content-Type: text/event-stream');
+header('Cache-Control: no-cache');
+header('X-Accel-Buffering: no');
+while (ob_get_level() > 0) { ob_end_flush(); }
+
+$ch = curl_init(AI_SERVICE_URL . '/agent/stream');
+curl_setopt($ch, CURLOPT_HTTPHEADER, ['Content-Type: application/json', 'Accept: text/event-stream']);
+curl_setopt($ch, CURLOPT_POST, true);
+curl_setopt($ch, CURLOPT_POSTFIELDS, json_encode($body));
+curl_setopt($ch, CURLOPT_WRITEFUNCTION, function ($ch, $chunk) {
+    echo $chunk;
+    flush();
+    return strlen($chunk);
+});
+curl_exec($ch);
+$http = curl_getinfo($ch, CURLINFO_HTTP_CODE);
+curl_close($ch);
+
+if ($http !== 200) {
+    $msg = 'Assistant unavailable (HTTP ' . $http . ')';
+    echo 'data: ' . json_encode(['delta' => $msg]) . "\n\n";
+    echo "event: done\n" . 'data: ' . json_encode(['answer' => $msg]) . "\n\n";
+    flush();
+}
+?>
@@ -14,6 +14,7 @@ if ($_SERVER['REQUEST_METHOD'] !== 'POST') {
 $stmt = $db->prepare('DELETE FROM insights WHERE user_id=?');
 $stmt->bind_param('i', $user['id']);
 $stmt->execute();
+vs_agent_context_reset();
 
 header('Location: ' . BASE_URL . '/pages/insights.php');
 exit;
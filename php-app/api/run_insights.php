@@ -35,19 +35,22 @@ foreach ($devs as $d) {
     ];
 }
 
-// Prefer AI-generated insights if available, then fall back
-$ch = curl_init(AI_SERVICE_URL . '/insights_ai');
-curl_setopt($ch, CURLOPT_RETURNTRANSFER, true);
-curl_setopt($ch, CURLOPT_HTTPHEADER, ['Content-Type: application/json']);
-curl_setopt($ch, CURLOPT_POST, true);
-curl_setopt($ch, CURLOPT_POSTFIELDS, json_encode($payload));
-$resp = curl_exec($ch);
-$http = curl_getinfo($ch, CURLINFO_HTTP_CODE);
-curl_close($ch);
-
-if ($http !== 200) {
-    // Fallback to rule-based endpoint
-    $ch = curl_init(AI_SERVICE_URL . '/insights');
+// One round trip: the AI service generates, falls back, pads and saves in bulk
+// (needs INSIGHTS_DB_URL on the service); otherwise do it step by step here.
+// The service answers within INSIGHTS_BATCH_WAIT_S (default 35 s) plus the save,
+// so keep this timeout above that.
+[$run_http, $run, $run_err] = vs_ai_request('POST', '/insights/run', ['user_id' => (int)$user['id'], 'devices' => $payload], 45000);
+if ($run_http === 200 && !empty($run['ok'])) {
+    $count = (int)$run['count'];
+} elseif ($run_err === CURLE_OPERATION_TIMEDOUT) {
+    // Timed out, not refused: the service may still save this run, so inserting
+    // our own set here could duplicate it
+    header('Content-Type: application/json');
+    echo json_encode(['ok'=>false, 'error'=>'AI service timed out; insights may still appear shortly', 'status'=>0]);
+    exit;
+} else {
+    // Prefer AI-generated insights if available, then fall back
+    $ch = curl_init(AI_SERVICE_URL . '/insights_ai');
     curl_setopt($ch, CURLOPT_RETURNTRANSFER, true);
     curl_setopt($ch, CURLOPT_HTTPHEADER, ['Content-Type: application/json']);
     curl_setopt($ch, CURLOPT_POST, true);
@@ -55,49 +58,63 @@ if ($http !== 200) {
     $resp = curl_exec($ch);
     $http = curl_getinfo($ch, CURLINFO_HTTP_CODE);
     curl_close($ch);
-}
 
-if ($http !== 200) {
-    header('Content-Type: application/json');
-    echo json_encode(['ok'=>false, 'error'=>'AI service error', 'status'=>$http]);
-    exit;
-}
-
-$data = json_decode($resp, true);
-$insights = $data['insights'] ?? [];
+    if ($http !== 200) {
+        // Fallback to rule-based endpoint
+        $ch = curl_init(AI_SERVICE_URL . '/insights');
+        curl_setopt($ch, CURLOPT_RETURNTRANSFER, true);
+        curl_setopt($ch, CURLOPT_HTTPHEADER, ['Content-Type: application/json']);
+        curl_setopt($ch, CURLOPT_POST, true);
+        curl_setopt($ch, CURLOPT_POSTFIELDS, json_encode($payload));
+        $resp = curl_exec($ch);
+        $http = curl_getinfo($ch, CURLINFO_HTTP_CODE);
+        curl_close($ch);
+    }
 
-// If AI endpoint returned an empty list, try rule-based endpoint, then ensure at least one info tip
-if (empty($insights)) {
-    $ch = curl_init(AI_SERVICE_URL . '/insights');
-    curl_setopt($ch, CURLOPT_RETURNTRANSFER, true);
-    curl_setopt($ch, CURLOPT_HTTPHEADER, ['Content-Type: application/json']);
-    curl_setopt($ch, CURLOPT_POST, true);
-    curl_setopt($ch, CURLOPT_POSTFIELDS, json_encode($payload));
-    $resp2 = curl_exec($ch);
-    $http2 = curl_getinfo($ch, CURLINFO_HTTP_CODE);
-    curl_close($ch);
-    if ($http2 === 200 && $resp2) {
-        $data2 = json_decode($resp2, true);
-        $insights = $data2['insights'] ?? [];
+    if ($http !== 200) {
+        header('Content-Type: application/json');
+        echo json_encode(['ok'=>false, 'error'=>'AI service error', 'status'=>$http]);
+        exit;
     }
+
+    $data = json_decode($resp, true);
+    $insights = $data['insights'] ?? [];
+
+    // If AI endpoint returned an empty list, try rule-based endpoint, then ensure at least one info tip
     if (empty($insights)) {
-        $insights = [[
-            'severity' => 'info',
-            'title' => 'No critical issues detected',
-            'detail' => 'Try turning off long-on lights, reviewing AC setpoints (>6h), and shifting flexible plugs to 22:00–06:00.'
-        ]];
+        $ch = curl_init(AI_SERVICE_URL . '/insights');
+        curl_setopt($ch, CURLOPT_RETURNTRANSFER, true);
+        curl_setopt($ch, CURLOPT_HTTPHEADER, ['Content-Type: application/json']);
+        curl_setopt($ch, CURLOPT_POST, true);
+        curl_setopt($ch, CURLOPT_POSTFIELDS, json_encode($payload));
+        $resp2 = curl_exec($ch);
+        $http2 = curl_getinfo($ch, CURLINFO_HTTP_CODE);
+        curl_close($ch);
+        if ($http2 === 200 && $resp2) {
+            $data2 = json_decode($resp2, true);
+            $insights = $data2['insights'] ?? [];
+        }
+        if (empty($insights)) {
+            $insights = [[
+                'severity' => 'info',
+                'title' => 'No critical issues detected',
+                'detail' => 'Try turning off long-on lights, reviewing AC setpoints (>6h), and shifting flexible plugs to 22:00–06:00.'
+            ]];
+        }
+    }
+    $count = 0;
+    foreach ($insights as $ins) {
+        $title = substr($ins['title'] ?? 'Insight', 0, 128);
+        $detail = $ins['detail'] ?? '';
+        $severity = $ins['severity'] ?? 'info';
+        $ack = 0;
+        $stmt = $db->prepare('INSERT INTO insights(user_id, title, detail, severity, acknowledged, created_at) VALUES (?, ?, ?, ?, ?, NOW())');
+        $stmt->bind_param('isssi', $user['id'], $title, $detail, $severity, $ack);
+        if ($stmt->execute()) $count++;
     }
 }
-$count = 0;
-foreach ($insights as $ins) {
-    $title = substr($ins['title'] ?? 'Insight', 0, 128);
-    $detail = $ins['detail'] ?? '';
-    $severity = $ins['severity'] ?? 'info';
-    $ack = 0;
-    $stmt = $db->prepare('INSERT INTO insights(user_id, title, detail, severity, acknowledged, created_at) VALUES (?, ?, ?, ?, ?, NOW())');
-    $stmt->bind_param('isssi', $user['id'], $title, $detail, $severity, $ack);
-    if ($stmt->execute()) $count++;
-}
+// New insights: have the next assistant question re-seed its context
+vs_agent_context_reset();
 
 // If browser expects HTML (e.g., direct form submit), redirect back to Insights page.
 $accept = $_SERVER['HTTP_ACCEPT'] ?? '';
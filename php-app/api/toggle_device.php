@@ -13,7 +13,7 @@ $device_id = (int)($_POST['device_id'] ?? 0);
 if ($device_id <= 0) { http_response_code(400); echo 'Invalid device'; exit; }
 
 // Ensure ownership
-$stmt = $db->prepare('SELECT d.id, d.state_json FROM devices d INNER JOIN rooms r ON d.room_id=r.id INNER JOIN homes h ON r.home_id=h.id WHERE d.id=? AND h.user_id=? LIMIT 1');
+$stmt = $db->prepare('SELECT d.id, d.name, d.type, d.power_w, d.state_json, r.home_id FROM devices d INNER JOIN rooms r ON d.room_id=r.id INNER JOIN homes h ON r.home_id=h.id WHERE d.id=? AND h.user_id=? LIMIT 1');
 $stmt->bind_param('ii', $device_id, $user['id']);
 $stmt->execute();
 $dev = $stmt->get_result()->fetch_assoc();
@@ -34,6 +34,27 @@ $stmt = $db->prepare('INSERT INTO device_logs(device_id, event, payload, created
 $e = 'toggle';
 $stmt->bind_param('iss', $device_id, $e, $payload);
 $stmt->execute();
+$log_id = (int)$stmt->insert_id;
+
+// Feed the AI service's energy ledger; best effort, the log row above stays the source of truth
+$dev['state_json'] = $new_json;
+[, $ev] = vs_ai_request('POST', '/events/device', [
+    'device_id' => $device_id,
+    'home_id' => (int)$dev['home_id'],
+    'user_id' => (int)$user['id'],
+    'on' => !$on,
+    'power_w' => vs_device_on_watts($dev),
+    'ts' => time(),
+    'log_id' => $log_id,
+    'name' => $dev['name'],
+    'type' => $dev['type'],
+    'state' => (object)$state,
+], 500);
+// Rules the toggle tripped right away (e.g. a flexible plug) go straight to insights
+$alerts = $ev['alerts'] ?? [];
+if ($alerts) {
+    vs_store_alerts($db, (int)$user['id'], $alerts);
+}
 
 $accept = $_SERVER['HTTP_ACCEPT'] ?? '';
 $wantsJson = strpos($accept, 'application/json') !== false;
@@ -46,6 +67,7 @@ if ($wantsJson) {
         'on' => !$on,
         'last_active' => date('c'),
         'last_active_fmt' => date('Y-m-d H:i'),
+        'alerts' => array_map(fn($a) => ['severity' => $a['severity'], 'title' => $a['title']], $alerts),
     ]);
     exit;
 }
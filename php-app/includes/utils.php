@@ -56,6 +56,175 @@ function vs_country_default_price(string $code): array {
     return ['currency'=>'EUR', 'cents_per_kwh'=>20, 'flag'=>'🏳️', 'name'=>'Unknown'];
 }
 
+// Instantaneous draw (W) for a device row, from its type and state_json
+function vs_device_watts(array $d): int {
+    $state = safe_json_decode($d['state_json']);
+    switch ($d['type']) {
+        case 'light':
+            $base = (int)($state['base_w'] ?? 9);
+            return ($state['on'] ?? false) ? (int)round($base * ((int)($state['brightness'] ?? 100)) / 100) : 0;
+        case 'ac':
+            if (!($state['on'] ?? false)) return 0;
+            $set = (int)($state['setpoint'] ?? 24); $h=(int)date('G'); $b=700; if($set<22) $b+=250; if($h>=12&&$h<=18) $b+=200; return min(1200,$b);
+        case 'tv':
+            if (!($state['on'] ?? false)) return 0; $b=(int)($state['brightness'] ?? 70); return max(20,(int)round(100*max(10,min(100,$b))/100));
+        case 'pc':
+            if (!($state['on'] ?? false)) return 5; $l=(int)($state['load'] ?? 20); return (int)round(60 + (250-60)*max(0,min(100,$l))/100);
+        case 'speaker':
+            if (!($state['on'] ?? false)) return 0; $v=(int)($state['volume'] ?? 30); return (int)round(3+0.25*max(0,min(100,$v)));
+        case 'fridge':
+            $min=(int)date('i'); $comp=($min%10)<3; $w=$comp?120:8; if(!empty($state['door_open'])) $w+=20; if(!empty($state['eco'])) $w=(int)round($w*0.9); return $w;
+        case 'washer':
+            if (!($state['on'] ?? false)) return 0; $p=strtolower((string)($state['phase']??'wash')); if($p==='spin')return 800; if($p==='wash')return 500; if($p==='heat')return 1200; return 10;
+        case 'camera':
+            return ($state['on'] ?? true) ? 5 : 0;
+        default:
+            return (($state['on'] ?? false) ? (int)$d['power_w'] : 0);
+    }
+}
+
+// Draw (W) the device has while switched on, used for energy accounting events
+function vs_device_on_watts(array $d): int {
+    $state = safe_json_decode($d['state_json']);
+    $state['on'] = true;
+    $d['state_json'] = json_encode($state);
+    return vs_device_watts($d);
+}
+
+// JSON request to the AI service; returns [http_code, decoded body or null]
+function vs_ai_request(string $method, string $path, ?array $body = null, int $timeout_ms = 3000): array {
+    $ch = curl_init(AI_SERVICE_URL . $path);
+    curl_setopt($ch, CURLOPT_RETURNTRANSFER, true);
+    curl_setopt($ch, CURLOPT_TIMEOUT_MS, $timeout_ms);
+    curl_setopt($ch, CURLOPT_CUSTOMREQUEST, $method);
+    if ($body !== null) {
+        curl_setopt($ch, CURLOPT_HTTPHEADER, ['Content-Type: application/json']);
+        curl_setopt($ch, CURLOPT_POSTFIELDS, json_encode($body));
+    }
+    $resp = curl_exec($ch);
+    $http = (int)curl_getinfo($ch, CURLINFO_HTTP_CODE);
+    $errno = curl_errno($ch);   // CURLE_OPERATION_TIMEDOUT: the service may still finish the request
+    curl_close($ch);
+    $data = is_string($resp) ? json_decode($resp, true) : null;
+    return [$http, is_array($data) ? $data : null, $errno];
+}
+
+// Replay a home's device_logs into the AI service's energy ledger and anomaly series (one-time per home)
+function vs_energy_backfill(mysqli $db, int $home_id): bool {
+    $stmt = $db->prepare('SELECT d.* FROM devices d INNER JOIN rooms r ON d.room_id=r.id WHERE r.home_id=?');
+    $stmt->bind_param('i', $home_id);
+    $stmt->execute();
+    $devices = [];
+    $types = [];
+    foreach ($stmt->get_result()->fetch_all(MYSQLI_ASSOC) as $d) {
+        $devices[(string)$d['id']] = vs_device_on_watts($d);
+        $types[(string)$d['id']] = (string)$d['type'];
+    }
+    $stmt = $db->prepare('SELECT l.id, l.device_id, l.payload, UNIX_TIMESTAMP(l.created_at) ts FROM device_logs l
+      INNER JOIN devices d ON l.device_id=d.id INNER JOIN rooms r ON d.room_id=r.id
+      WHERE r.home_id=? AND l.event=\'toggle\' ORDER BY l.id ASC');
+    $stmt->bind_param('i', $home_id);
+    $stmt->execute();
+    $logs = [];
+    foreach ($stmt->get_result()->fetch_all(MYSQLI_ASSOC) as $lg) {
+        $p = json_decode($lg['payload'] ?? '', true);
+        if (!is_array($p) || !array_key_exists('to', $p)) continue;
+        $logs[] = ['id' => (int)$lg['id'], 'device_id' => (int)$lg['device_id'], 'ts' => (int)$lg['ts'], 'to' => (bool)$p['to']];
+    }
+    [$http, ] = vs_ai_request('POST', '/energy/backfill', ['home_id' => $home_id, 'devices' => (object)$devices, 'types' => (object)$types, 'logs' => $logs], 15000);
+    return $http === 200;
+}
+
+// Compact RAG context for the assistant (devices, recent insights, recent logs).
+// Seeds the AI service's per-user summary; timestamps are sent as unix seconds.
+function vs_agent_context(mysqli $db, int $user_id): array {
+    $ctx = [];
+    // Devices summary
+    $stmt = $db->prepare('SELECT d.id, d.name, d.type, d.power_w, d.state_json, d.last_active, UNIX_TIMESTAMP(d.last_active) AS since, r.name AS room
+      FROM devices d INNER JOIN rooms r ON d.room_id=r.id INNER JOIN homes h ON r.home_id=h.id
+      WHERE h.user_id=? ORDER BY d.id DESC LIMIT 50');
+    $stmt->bind_param('i', $user_id);
+    $stmt->execute();
+    $devs = $stmt->get_result()->fetch_all(MYSQLI_ASSOC);
+    foreach ($devs as $d) {
+        $state = json_decode($d['state_json'] ?? '[]', true) ?: [];
+        $ctx['devices'][] = [
+            'id' => (int)$d['id'],
+            'name' => $d['name'], 'type' => $d['type'], 'room' => $d['room'],
+            'on' => (bool)($state['on'] ?? false),
+            'power_w' => (int)$d['power_w'],
+            'watts' => vs_device_on_watts($d),
+            'attrs' => array_diff_key($state, ['on'=>true]),
+            'last_active' => $d['last_active'],
+            'since' => $d['since'] !== null ? (int)$d['since'] : null,
+        ];
+    }
+    // Recent insights
+    $stmt = $db->prepare('SELECT title, severity, created_at, UNIX_TIMESTAMP(created_at) AS ts FROM insights WHERE user_id=? ORDER BY id DESC LIMIT 20');
+    $stmt->bind_param('i', $user_id);
+    $stmt->execute();
+    $ctx['insights'] = $stmt->get_result()->fetch_all(MYSQLI_ASSOC);
+    // Recent device logs
+    $stmt = $db->prepare('SELECT d.name AS device, l.event, l.payload, l.created_at, UNIX_TIMESTAMP(l.created_at) AS ts
+      FROM device_logs l INNER JOIN devices d ON l.device_id=d.id
+      INNER JOIN rooms r ON d.room_id=r.id INNER JOIN homes h ON r.home_id=h.id
+      WHERE h.user_id=? ORDER BY l.id DESC LIMIT 30');
+    $stmt->bind_param('i', $user_id);
+    $stmt->execute();
+    $ctx['logs'] = [];
+    foreach ($stmt->get_result()->fetch_all(MYSQLI_ASSOC) as $lg) {
+        $p = json_decode($lg['payload'] ?? '', true);
+        unset($lg['payload']);
+        $lg['on'] = (is_array($p) && array_key_exists('to', $p)) ? (bool)$p['to'] : null;
+        $ctx['logs'][] = $lg;
+    }
+    return $ctx;
+}
+
+// Save alerts from the AI service's real-time rule engine as insights, then
+// acknowledge them so they are delivered once.
+function vs_store_alerts(mysqli $db, int $user_id, array $alerts): int {
+    $ids = [];
+    $stmt = $db->prepare('INSERT INTO insights(user_id, title, detail, severity, acknowledged, created_at) VALUES (?, ?, ?, ?, 0, FROM_UNIXTIME(?))');
+    foreach ($alerts as $a) {
+        $title = substr($a['title'] ?? 'Insight', 0, 128);
+        $detail = $a['detail'] ?? '';
+        $severity = in_array($a['severity'] ?? '', ['info','warn','critical'], true) ? $a['severity'] : 'info';
+        $ts = (int)($a['ts'] ?? time());
+        $stmt->bind_param('isssi', $user_id, $title, $detail, $severity, $ts);
+        if ($stmt->execute()) $ids[] = (int)$a['id'];
+    }
+    if ($ids) {
+        vs_ai_request('POST', '/alerts/ack', ['user_id' => $user_id, 'ids' => $ids], 1000);
+    }
+    return count($ids);
+}
+
+function vs_pull_alerts(mysqli $db, int $user_id): int {
+    [$http, $data] = vs_ai_request('GET', '/alerts?undelivered=1&user_id=' . $user_id, null, 800);
+    if ($http !== 200 || empty($data['alerts'])) return 0;
+    return vs_store_alerts($db, $user_id, $data['alerts']);
+}
+
+// Request body for /agent and /agent/stream. The AI service keeps a per-user
+// summary current from toggle events, so the full context is only rebuilt and
+// sent every VS_AGENT_RESEED_S seconds (or after vs_agent_context_reset()).
+const VS_AGENT_RESEED_S = 900;
+
+function vs_agent_payload(mysqli $db, int $user_id, string $question): array {
+    $body = ['question' => $question, 'user_id' => $user_id];
+    $seeded = (int)($_SESSION['vs_agent_seeded_at'] ?? 0);
+    if (time() - $seeded >= VS_AGENT_RESEED_S) {
+        $body['context'] = vs_agent_context($db, $user_id);
+        $_SESSION['vs_agent_seeded_at'] = time();
+    }
+    return $body;
+}
+
+function vs_agent_context_reset(): void {
+    unset($_SESSION['vs_agent_seeded_at']);
+}
+
 function vs_ensure_home_energy_columns(mysqli $db): void {
     // Add columns to homes: country, energy_price_cents_per_kwh, currency if not present
     @$db->query("ALTER TABLE homes ADD COLUMN IF NOT EXISTS country CHAR(2) NULL");
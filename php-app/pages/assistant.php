@@ -44,6 +44,41 @@ function escapeHtml(s){
   return (s||'').replace(/[&<>"]/g, c => ({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;'}[c]));
 }
 
+// Read the SSE stream from agent_stream.php, painting tokens into el as they arrive
+async function streamAnswer(q, el){
+  const res = await fetch(BASE_URL + '/api/agent_stream.php', {
+    method:'POST',
+    headers:{'Content-Type':'application/json', 'Accept':'text/event-stream'},
+    body: JSON.stringify({question:q})
+  });
+  if (!res.ok || !res.body) throw new Error('stream unavailable');
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = '', text = '', answer = null;
+  while (true) {
+    const {value, done} = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, {stream:true});
+    let idx;
+    while ((idx = buf.indexOf('\n\n')) >= 0) {
+      const block = buf.slice(0, idx); buf = buf.slice(idx + 2);
+      let event = 'message', data = '';
+      block.split('\n').forEach(line => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      });
+      if (!data) continue;
+      const msg = JSON.parse(data);
+      if (event === 'done') { answer = msg.answer; continue; }
+      text += msg.delta || '';
+      if (el) el.textContent = text;
+      $messages.scrollTop = $messages.scrollHeight;
+    }
+  }
+  if (answer === null && !text) throw new Error('empty stream');
+  return answer !== null ? answer : text;
+}
+
 async function sendMsg(e){
   e.preventDefault();
   const q = ($input.value || '').trim();
@@ -56,19 +91,25 @@ async function sendMsg(e){
   history.push({role:'user', text:q});
   saveHistory(history);
 
+  const last = $messages.querySelector('.msg.bot:last-child .bubble');
   try {
-    const res = await fetch(BASE_URL + '/api/agent_query.php', {
-      method:'POST',
-      headers:{'Content-Type':'application/json'},
-      body: JSON.stringify({question:q})
-    });
-    const data = await res.json();
-    const last = $messages.querySelector('.msg.bot:last-child .bubble');
-    if (last) last.textContent = data.answer || 'No answer';
-    history.push({role:'bot', text: data.answer || 'No answer'});
+    let answer = null;
+    try {
+      answer = await streamAnswer(q, last);
+    } catch (_) {
+      // Streaming unavailable: fall back to the one-shot endpoint
+      const res = await fetch(BASE_URL + '/api/agent_query.php', {
+        method:'POST',
+        headers:{'Content-Type':'application/json'},
+        body: JSON.stringify({question:q})
+      });
+      const data = await res.json();
+      answer = data.answer;
+    }
+    if (last) last.textContent = answer || 'No answer';
+    history.push({role:'bot', text: answer || 'No answer'});
     saveHistory(history);
   } catch (err) {
-    const last = $messages.querySelector('.msg.bot:last-child .bubble');
     if (last) last.textContent = 'Error contacting assistant';
   }
   return false;
@@ -40,7 +40,7 @@ if ($_SERVER['REQUEST_METHOD'] === 'POST') {
 
     $stmt = $db->prepare('UPDATE devices SET name=?, state_json=?, power_w=?, last_active=? WHERE id=?');
     $stmt->bind_param('ssisi', $name, $state_json, $power_w, $la, $id);
-    if ($stmt->execute()) { $ok = true; $dev['name']=$name; $dev['power_w']=$power_w; $dev['last_active']=$la; $state=$st; }
+    if ($stmt->execute()) { $ok = true; vs_agent_context_reset(); $dev['name']=$name; $dev['power_w']=$power_w; $dev['last_active']=$la; $state=$st; }
 }
 
 include __DIR__ . '/../includes/header.php';
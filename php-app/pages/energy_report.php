@@ -17,36 +17,44 @@ $homes = $stmt->get_result()->fetch_all(MYSQLI_ASSOC);
 $midnight = strtotime(date('Y-m-d 00:00:00'));
 $now = time();
 
-function device_watts(array $d): int {
-    $state = safe_json_decode($d['state_json']);
-    switch ($d['type']) {
-        case 'light':
-            $base = (int)($state['base_w'] ?? 9);
-            return ($state['on'] ?? false) ? (int)round($base * ((int)($state['brightness'] ?? 100)) / 100) : 0;
-        case 'ac':
-            if (!($state['on'] ?? false)) return 0;
-            $set = (int)($state['setpoint'] ?? 24); $h=(int)date('G'); $b=700; if($set<22) $b+=250; if($h>=12&&$h<=18) $b+=200; return min(1200,$b);
-        case 'tv':
-            if (!($state['on'] ?? false)) return 0; $b=(int)($state['brightness'] ?? 70); return max(20,(int)round(100*max(10,min(100,$b))/100));
-        case 'pc':
-            if (!($state['on'] ?? false)) return 5; $l=(int)($state['load'] ?? 20); return (int)round(60 + (250-60)*max(0,min(100,$l))/100);
-        case 'speaker':
-            if (!($state['on'] ?? false)) return 0; $v=(int)($state['volume'] ?? 30); return (int)round(3+0.25*max(0,min(100,$v)));
-        case 'fridge':
-            $min=(int)date('i'); $comp=($min%10)<3; $w=$comp?120:8; if(!empty($state['door_open'])) $w+=20; if(!empty($state['eco'])) $w=(int)round($w*0.9); return $w;
-        case 'washer':
-            if (!($state['on'] ?? false)) return 0; $p=strtolower((string)($state['phase']??'wash')); if($p==='spin')return 800; if($p==='wash')return 500; if($p==='heat')return 1200; return 10;
-        case 'camera':
-            return ($state['on'] ?? true) ? 5 : 0;
-        default:
-            return (($state['on'] ?? false) ? (int)$d['power_w'] : 0);
+// Precomputed totals from the AI service's energy ledger; homes it hasn't seen are backfilled once
+$ledger = [];
+$ids = array_map(fn($h) => (int)$h['id'], $homes);
+if ($ids) {
+    [$http, $data] = vs_ai_request('GET', '/energy/report?home_ids=' . implode(',', $ids));
+    if ($http === 200 && isset($data['homes'])) {
+        $ledger = $data['homes'];
+        $backfilled = false;
+        foreach ($ids as $hid) {
+            if (empty($ledger[$hid]['backfilled'])) $backfilled = vs_energy_backfill($db, $hid) || $backfilled;
+        }
+        if ($backfilled) {
+            [$http, $data] = vs_ai_request('GET', '/energy/report?home_ids=' . implode(',', $ids));
+            $ledger = ($http === 200 && isset($data['homes'])) ? $data['homes'] : [];
+        }
     }
 }
+$from_ledger = false;
 
 // Build report per home
 $report = [];
 foreach ($homes as $h) {
     $hid = (int)$h['id'];
+    $price = (int)($h['cents'] ?? 0) / 100.0;
+    if (!empty($ledger[$hid]['backfilled'])) {
+        $l = $ledger[$hid];
+        $from_ledger = true;
+        $report[] = [
+            'home' => $h,
+            'kwh_today' => (float)$l['kwh_today'],
+            'cost_today' => $price * (float)$l['kwh_today'],
+            'mtd' => $price * (float)$l['kwh_month'],
+            'ytd' => $price * (float)$l['kwh_year'],
+        ];
+        continue;
+    }
+
+    // Fallback (AI service unavailable): integrate today's logs here and extrapolate
     // Devices in this home
     $stmtD = $db->prepare('SELECT d.* FROM devices d INNER JOIN rooms r ON d.room_id=r.id WHERE r.home_id=?');
     $stmtD->bind_param('i', $hid);
@@ -55,7 +63,7 @@ foreach ($homes as $h) {
 
     $kwh_today = 0.0;
     foreach ($devs as $d) {
-        $w = device_watts($d);
+        $w = vs_device_watts($d);
         // Integrate ON time since midnight using logs
         $stmtPrev = $db->prepare('SELECT payload, UNIX_TIMESTAMP(created_at) ts FROM device_logs WHERE device_id=? AND created_at<=FROM_UNIXTIME(?) ORDER BY created_at DESC LIMIT 1');
         $tsMid = $midnight; $did = (int)$d['id'];
@@ -104,7 +112,11 @@ include __DIR__ . '/../includes/header.php';
       </tr>
     <?php endforeach; ?>
   </table>
+  <?php if ($from_ledger): ?>
+  <p class="muted">MTD/YTD are accumulated from device on-time recorded in the logs.</p>
+  <?php else: ?>
   <p class="muted">MTD/YTD are rough estimates extrapolated from today's usage.</p>
+  <?php endif; ?>
   <p class="muted">Tip: open Devices and toggle items to reflect today's activity; logs are used to accumulate on-time.</p>
 </section>
 
@@ -56,6 +56,7 @@ if ($_SERVER['REQUEST_METHOD'] === 'POST' && ($_POST['action'] ?? '') === 'delet
                 $q3->execute();
 
                 $db->commit();
+                vs_agent_context_reset();
                 // redirect to avoid form resubmit and show message
                 header('Location: ' . BASE_URL . '/pages/homes.php?msg=' . urlencode('Home deleted'));
                 exit;
@@ -15,6 +15,9 @@ if (isset($_GET['ack'])) {
     exit;
 }
 
+// Alerts fired by the AI service's timers since the last visit (long-on devices, night loads)
+vs_pull_alerts($db, (int)$user['id']);
+
 $stmt = $db->prepare('SELECT * FROM insights WHERE user_id=? ORDER BY created_at DESC');
 $stmt->bind_param('i', $user['id']);
 $stmt->execute();